@@ -0,0 +1,443 @@
+"""
+Núcleo da auditoria: PDF -> contexto jurídico (RAG) -> relatório do LLM -> .docx.
+
+Não depende do Streamlit: roda nos workers da fila de auditorias (jobs.py).
+"""
+import os
+import re
+import time
+import hashlib
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from docx import Document as DocxDocument
+from langchain_openai import ChatOpenAI
+from langchain.prompts import PromptTemplate
+from ingestion import pdf_bytes_to_pages
+from ocr import blank_pages, fill_blank_pages, ocr_available
+from retrieval import CONTEXT_TOKEN_BUDGET, retrieve, retrieve_for_sections, format_context
+from prompt_budget import (LLM_MODEL, PROMPT_TOKEN_BUDGET, BOUNDARIES, assemble_prompt, context_limit,
+                           count_tokens, estimate_cost)
+from db import log_action
+from audit_cache import put_cached
+from metrics import StageTimer, record_audit
+
+STREAM_FLUSH_INTERVAL = 1.0  # Segundos entre envios do texto parcial para a página
+SINGLE_PASS_TOKENS = 15000  # Acima disso (~60 mil caracteres) o documento é auditado por seções (map-reduce)
+SECTION_CHARS = 20000
+SECTION_CONTEXT_TOKENS = 1200  # Orçamento de jurisprudência por seção
+SECTION_WORKERS = int(os.environ.get("AUDIT_SECTION_WORKERS", "4"))
+SECTION_OUTPUT_TOKENS = 1500  # Limite de resposta do LLM por seção
+REDUCE_OUTPUT_TOKENS = 4096
+MAX_AUDIT_TOKENS = int(os.environ.get("MAX_AUDIT_TOKENS", "300000"))  # Teto (entrada + saída) por auditoria
+
+SECTION_HEADING = re.compile(
+    r"^[ \t]*(?:\d{1,2}(?:\.\d{1,2})*[ \t]*[-–.)][ \t]*)?"
+    r"(?:CAP[IÍ]TULO|SE[CÇ][AÃ]O|CL[AÁ]USULA|ANEXO|T[IÍ]TULO|D[OA]S?[ \t]+[A-ZÁÉÍÓÚÂÊÔÃÕÇ]{3,})",
+    re.MULTILINE,
+)
+
+
+class AuditError(Exception):
+    """Problema no documento enviado, mostrado ao usuário como aviso (não é falha técnica)."""
+    user_message = True
+
+
+def get_pdf_text(pdf_docs, progress=None, timer=None):
+    """
+    Páginas extraídas uma única vez (em paralelo e com cache) e unidas no final.
+    Páginas digitalizadas (sem texto) passam pelo OCR (ver ocr.py).
+    Retorna (texto, nº de páginas, métricas do OCR).
+    """
+    timer = timer or StageTimer()
+    texts, n_pages = [], 0
+    ocr_stats = {"pages": 0, "cached": 0, "recognized": 0, "timed_out": False}
+    for pdf in pdf_docs:
+        try:
+            data = pdf.getvalue()
+            with timer.stage("extraction"):
+                pages = pdf_bytes_to_pages(data)
+            n_pages += len(pages)
+            blanks = blank_pages(pages)
+            if blanks and ocr_available():
+                if progress:
+                    progress(8, f"Reconhecendo texto de {len(blanks)} página(s) digitalizada(s) (OCR)...")
+                with timer.stage("ocr"):
+                    pages, stats = fill_blank_pages(data, pages)
+                for key in ("pages", "cached", "recognized"):
+                    ocr_stats[key] += stats[key]
+                ocr_stats["timed_out"] = ocr_stats["timed_out"] or stats["timed_out"]
+            texts.append("\n".join(pages))
+        except Exception as e:
+            print(f"Erro ao ler PDF: {e}")
+    return "\n".join(texts), n_pages, ocr_stats
+
+
+def create_word_docx(markdown_text):
+    doc = DocxDocument()
+    doc.add_heading('Lici Govtech - Relatório de Auditoria', 0)
+    for line in markdown_text.split('\n'):
+        if line.startswith('### '):
+            doc.add_heading(line.replace('### ', ''), level=2)
+        elif line.startswith('## '):
+            doc.add_heading(line.replace('## ', ''), level=1)
+        elif line.startswith('- ') or line.startswith('* '):
+            doc.add_paragraph(line.replace('- ', '').replace('* ', ''), style='List Bullet')
+        else:
+            doc.add_paragraph(line)
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+REPORT_FORMAT = """
+    ## 🚨 Relatório de Auditoria Técnica
+
+    ### 1. Análise de Conformidade (Lei 14.133/21)
+    (Análise geral do documento).
+
+    ### 2. Riscos e Irregularidades Identificadas
+    - **Ponto Crítico:** [Descreva o problema]
+    - **Fundamentação:** [Cite o Acórdão X ou Artigo Y da Lei 14.133 do contexto]
+    - **Recomendação:** [O que fazer]
+
+    ### 3. Conclusão do Auditor
+    """
+
+
+def get_autonomous_prompt(doc_type):
+    # O PROMPT ORIGINAL V15
+    return """
+    Você é um Auditor Federal de Controle Externo Especialista (Nível TCU).
+    
+    SUA MISSÃO:
+    Auditar o documento ({doc_type}) com base na Lei 14.133/21 e na JURISPRUDÊNCIA fornecida.
+
+    REGRAS DE OURO:
+    1. **LEGISLAÇÃO:** Priorize totalmente a Lei 14.133/2021.
+    2. **CITAÇÕES:** PROCURE NO TEXTO DO CONTEXTO o número do Acórdão, Súmula ou Enunciado. Se não encontrar, cite genericamente "Jurisprudência TCU". NÃO cite nomes de arquivos PDF.
+    3. **RIGOR:** Aponte riscos de sobrepreço, restrição de competitividade e direcionamento.
+
+    ---
+    CONTEXTO JURÍDICO (Base de Conhecimento):
+    {context}
+    ---
+
+    DOCUMENTO A SER AUDITADO ({doc_type}):
+    {text}
+
+    GERE O RELATÓRIO NESTE FORMATO:
+""" + REPORT_FORMAT
+
+
+def get_section_prompt(doc_type):
+    # Etapa "map": cada seção de um documento longo é auditada separadamente
+    return """
+    Você é um Auditor Federal de Controle Externo Especialista (Nível TCU).
+
+    SUA MISSÃO:
+    O documento ({doc_type}) é longo e está sendo auditado por partes.
+    Audite APENAS a SEÇÃO {section} abaixo, com base na Lei 14.133/21 e na JURISPRUDÊNCIA fornecida.
+
+    REGRAS DE OURO:
+    1. **LEGISLAÇÃO:** Priorize totalmente a Lei 14.133/2021.
+    2. **CITAÇÕES:** PROCURE NO TEXTO DO CONTEXTO o número do Acórdão, Súmula ou Enunciado. Se não encontrar, cite genericamente "Jurisprudência TCU". NÃO cite nomes de arquivos PDF.
+    3. **RIGOR:** Aponte riscos de sobrepreço, restrição de competitividade e direcionamento.
+
+    ---
+    CONTEXTO JURÍDICO (Base de Conhecimento):
+    {context}
+    ---
+
+    SEÇÃO {section} DO DOCUMENTO ({doc_type}):
+    {text}
+
+    Liste somente os achados desta seção, neste formato (ou responda "Sem achados relevantes."):
+    - **Ponto Crítico:** [Descreva o problema]
+    - **Fundamentação:** [Cite o Acórdão X ou Artigo Y da Lei 14.133 do contexto]
+    - **Recomendação:** [O que fazer]
+    """
+
+
+def get_reduce_prompt(doc_type):
+    # Etapa "reduce": junta os achados das seções no relatório padrão
+    return """
+    Você é um Auditor Federal de Controle Externo Especialista (Nível TCU).
+
+    SUA MISSÃO:
+    O documento ({doc_type}) foi auditado em {n_sections} seções. Abaixo estão os achados de cada uma.
+    Consolide-os em um único relatório: elimine repetições, agrupe pontos relacionados e
+    mantenha as fundamentações citadas. NÃO invente citações que não estejam nos achados.
+    {notice}
+
+    ACHADOS POR SEÇÃO:
+    {text}
+
+    GERE O RELATÓRIO NESTE FORMATO:
+""" + REPORT_FORMAT
+
+
+def split_sections(text, max_chars=SECTION_CHARS):
+    """
+    Divide o documento em seções de até max_chars, cortando preferencialmente
+    nos títulos (CLÁUSULA, CAPÍTULO, ANEXO, "DO OBJETO"...) e, se preciso, em
+    quebras de parágrafo.
+    """
+    starts = [m.start() for m in SECTION_HEADING.finditer(text) if m.start() > 0]
+    bounds = [0] + starts + [len(text)]
+    pieces = []
+    for a, b in zip(bounds, bounds[1:]):
+        block = text[a:b]
+        while len(block) > max_chars:
+            cut = block.rfind("\n", max_chars // 2, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(block[:cut])
+            block = block[cut:]
+        if block.strip():
+            pieces.append(block)
+
+    # Junta blocos pequenos vizinhos até o limite
+    sections, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(piece) > max_chars:
+            sections.append(current)
+            current = ""
+        current += piece
+    if current.strip():
+        sections.append(current)
+    return sections
+
+
+def stream_llm(llm, prompt, on_text=None):
+    """
+    Gera a resposta do LLM token a token.
+    on_text(texto até agora) é chamado no máximo a cada STREAM_FLUSH_INTERVAL.
+    Retorna (texto final, métricas: ttft, tokens de entrada/saída, tokens/s).
+    """
+    started = time.monotonic()
+    first_token_at = None
+    parts, usage = [], None
+    last_flush = started
+    for chunk in llm.stream(prompt):
+        if chunk.content:
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            parts.append(chunk.content)
+        if getattr(chunk, "usage_metadata", None):
+            usage = chunk.usage_metadata
+        now = time.monotonic()
+        if on_text and now - last_flush >= STREAM_FLUSH_INTERVAL:
+            on_text("".join(parts))
+            last_flush = now
+    finished = time.monotonic()
+
+    first_token_at = first_token_at or finished
+    text = "".join(parts)
+    output_tokens = usage["output_tokens"] if usage else count_tokens(text)
+    generation = finished - first_token_at
+    stats = {
+        "ttft_s": round(first_token_at - started, 3),
+        "total_s": round(finished - started, 3),
+        "input_tokens": usage["input_tokens"] if usage else count_tokens(prompt),
+        "output_tokens": output_tokens,
+        "tokens_per_s": round(output_tokens / generation, 1) if generation > 0 else None,
+    }
+    return text, stats
+
+
+def context_blocks(docs):
+    """Um bloco [JURISPRUDÊNCIA] por trecho, para o montador de prompt escolher trechos inteiros."""
+    return [format_context([doc]) for doc in docs]
+
+
+def usage_totals(stats, input_tokens, output_tokens):
+    """Acrescenta às métricas os tokens de todas as chamadas ao LLM e o custo estimado."""
+    stats.update(
+        total_input_tokens=input_tokens,
+        total_output_tokens=output_tokens,
+        cost_usd=estimate_cost(input_tokens, output_tokens),
+    )
+    return stats
+
+
+def audit_single_pass(raw_text, doc_type, vectorstore, llm, progress, timer, query_cache=None):
+    # 1. Busca Contexto (RAG)
+    progress(20, "Consultando Base Jurídica...")
+    with timer.stage("retrieval"):
+        docs = retrieve(vectorstore, raw_text, cache=query_cache)
+
+    # 2. Monta o prompt no orçamento de tokens e chama o LLM (streaming: o
+    # relatório aparece na página enquanto é escrito)
+    progress(35, "Gerando relatório (IA)...")
+    prompt_text = get_autonomous_prompt(doc_type)
+    prompt = PromptTemplate(template=prompt_text, input_variables=["context", "text", "doc_type"])
+    with timer.stage("prompt"):
+        final_prompt, usage = assemble_prompt(
+            prompt, raw_text, context_blocks(docs), context_budget=CONTEXT_TOKEN_BUDGET,
+            boundaries=(SECTION_HEADING,) + BOUNDARIES, doc_type=doc_type,
+        )
+    with timer.stage("llm"):
+        report, stats = stream_llm(llm, final_prompt, on_text=lambda text: progress(60, "Gerando relatório (IA)...", text))
+    stats["prompt"] = usage
+    return report, usage_totals(stats, stats["input_tokens"], stats["output_tokens"])
+
+
+def plan_sections(sections, doc_type):
+    """
+    Escolhe quantas seções cabem no teto MAX_AUDIT_TOKENS, reservando a
+    etapa de consolidação. Retorna (seções a auditar, seções que ficaram de fora).
+    """
+    overhead = count_tokens(get_section_prompt(doc_type)) + SECTION_CONTEXT_TOKENS  # instruções + contexto
+    budget = MAX_AUDIT_TOKENS - REDUCE_OUTPUT_TOKENS - count_tokens(get_reduce_prompt(doc_type))
+    planned = []
+    for section in sections:
+        # Custo da seção: entrada + saída na etapa map + a saída relida no reduce
+        cost = overhead + min(count_tokens(section), PROMPT_TOKEN_BUDGET) + 2 * SECTION_OUTPUT_TOKENS
+        if cost > budget:
+            break
+        budget -= cost
+        planned.append(section)
+    return planned, sections[len(planned):]
+
+
+def audit_by_sections(raw_text, doc_type, vectorstore, api_key, llm, progress, timer, query_cache=None):
+    """
+    Documento longo: audita as seções em paralelo (cada uma com sua busca de
+    jurisprudência) e consolida os achados no relatório padrão.
+    A etapa "llm" é o tempo de relógio das seções em paralelo mais a
+    consolidação; "prompt" soma as montagens feitas dentro das threads.
+    """
+    sections, skipped = plan_sections(split_sections(raw_text), doc_type)
+    n = len(sections)
+    progress(10, f"Documento longo: consultando Base Jurídica para {n} seções...")
+    # Todas as seções numa única busca em lote (embeddings + FAISS)
+    with timer.stage("retrieval"):
+        contexts = retrieve_for_sections(vectorstore, sections, SECTION_CONTEXT_TOKENS, cache=query_cache)
+    progress(15, f"Documento longo: auditando {n} seções em paralelo...")
+    section_llm = ChatOpenAI(
+        model_name=LLM_MODEL, temperature=0.2, openai_api_key=api_key, max_tokens=SECTION_OUTPUT_TOKENS
+    )
+    section_prompt = PromptTemplate(
+        template=get_section_prompt(doc_type), input_variables=["context", "text", "doc_type", "section"]
+    )
+
+    def audit_section(i):
+        with timer.stage("prompt"):
+            prompt, _ = assemble_prompt(
+                section_prompt, sections[i], context_blocks(contexts[i]), context_budget=SECTION_CONTEXT_TOKENS,
+                boundaries=(SECTION_HEADING,) + BOUNDARIES, doc_type=doc_type, section=f"{i + 1}/{n}",
+            )
+        message = section_llm.invoke(prompt)
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            return i, message.content, usage["input_tokens"], usage["output_tokens"]
+        return i, message.content, count_tokens(prompt), count_tokens(message.content)
+
+    findings = [None] * n
+    input_tokens = output_tokens = 0
+    map_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(SECTION_WORKERS, n))) as pool:
+        futures = [pool.submit(audit_section, i) for i in range(n)]
+        for done, future in enumerate(as_completed(futures), 1):
+            i, text, tokens_in, tokens_out = future.result()
+            findings[i] = text
+            input_tokens += tokens_in
+            output_tokens += tokens_out
+            partial = "\n\n".join(f"### Seção {j + 1}/{n}\n{f}" for j, f in enumerate(findings) if f)
+            progress(15 + 55 * done // n, f"Seção {done}/{n} auditada", partial)
+    timer.add("llm", time.perf_counter() - map_started)
+
+    notice = ""
+    if skipped:
+        notice = (f"ATENÇÃO: {len(skipped)} seção(ões) final(is) não foram auditadas por limite de tokens. "
+                  "Informe isso na Conclusão do Auditor.")
+    progress(75, "Consolidando achados (IA)...")
+    reduce_prompt = PromptTemplate(
+        template=get_reduce_prompt(doc_type), input_variables=["text", "doc_type", "n_sections", "notice"]
+    )
+    with timer.stage("prompt"):
+        final_prompt, usage = assemble_prompt(
+            reduce_prompt, "\n\n".join(f"SEÇÃO {i + 1}/{n}:\n{f}" for i, f in enumerate(findings)),
+            budget=context_limit() - REDUCE_OUTPUT_TOKENS, doc_type=doc_type, n_sections=n, notice=notice,
+        )
+    with timer.stage("llm"):
+        report, stats = stream_llm(llm, final_prompt, on_text=lambda text: progress(85, "Consolidando achados (IA)...", text))
+    stats.update(sections=n, sections_skipped=len(skipped), prompt=usage)
+    return report, usage_totals(stats, input_tokens + stats["input_tokens"], output_tokens + stats["output_tokens"])
+
+
+# Muda sozinha quando prompts, formato ou modelo mudam: invalida o cache de resultados
+PROMPT_VERSION = hashlib.sha256(
+    "|".join([LLM_MODEL, get_autonomous_prompt(""), get_section_prompt(""), get_reduce_prompt("")]).encode("utf-8")
+).hexdigest()[:12]
+
+
+def run_audit(pdf_bytes, doc_type, vectorstore, progress=None, query_cache=None):
+    """
+    Executa a auditoria completa de um PDF.
+    progress(pct, mensagem, parcial=None) é chamado a cada etapa e, durante a
+    geração, com o texto parcial do relatório.
+    Documentos acima de SINGLE_PASS_TOKENS são auditados por seções.
+    query_cache (retrieval.QueryCache) reaproveita buscas entre os arquivos de um lote.
+    Retorna (relatório em markdown, bytes do .docx, métricas: latência do LLM,
+    tokens de todas as chamadas, custo estimado, tamanho do documento e tempo
+    de cada etapa em "stages", ver metrics.py).
+    """
+    progress = progress or (lambda pct, message, partial=None: None)
+    api_key = os.environ.get("OPENAI_API_KEY")
+    timer = StageTimer()
+    started = time.perf_counter()
+
+    progress(5, "Lendo documento...")
+    raw_text, n_pages, ocr_stats = get_pdf_text([BytesIO(pdf_bytes)], progress, timer)
+    if len(raw_text.strip()) < 50:
+        if not ocr_available():
+            raise AuditError("⚠️ O PDF parece ser uma imagem digitalizada e o OCR não está disponível neste servidor.")
+        if ocr_stats["timed_out"]:
+            raise AuditError("⚠️ O PDF digitalizado é grande demais: o OCR não terminou no tempo limite.")
+        raise AuditError("⚠️ Não foi possível reconhecer texto no PDF digitalizado. Verifique a qualidade do scan.")
+
+    llm = ChatOpenAI(
+        model_name=LLM_MODEL, temperature=0.2, openai_api_key=api_key, stream_usage=True,
+        max_tokens=REDUCE_OUTPUT_TOKENS,
+    )
+    doc_tokens = count_tokens(raw_text)
+    if doc_tokens <= SINGLE_PASS_TOKENS:
+        report, stats = audit_single_pass(raw_text, doc_type, vectorstore, llm, progress, timer, query_cache)
+    else:
+        report, stats = audit_by_sections(raw_text, doc_type, vectorstore, api_key, llm, progress, timer, query_cache)
+
+    # 3. Gera o .docx a partir do texto final
+    progress(95, "Gerando .docx...", report)
+    with timer.stage("docx"):
+        docx_bytes = create_word_docx(report)
+    timer.add("total", time.perf_counter() - started)
+    stats.update(ocr=ocr_stats, doc_pages=n_pages, doc_tokens=doc_tokens, stages=timer.as_dict())
+    return report, docx_bytes, stats
+
+
+def make_job_handler(vectorstore):
+    """
+    Handler do AuditWorkerPool (jobs.py): audita o PDF do job, registra o log
+    com latência, tokens, custo e tempo das etapas, grava as métricas
+    (metrics.py) e guarda o resultado no cache de auditorias. Jobs de um lote
+    compartilham o cache de busca do lote (batch.query_cache).
+    """
+    from batch import query_cache
+
+    def handler(job, progress):
+        report, docx_bytes, stats = run_audit(
+            job["pdf"], job["doc_type"], vectorstore, progress, query_cache(job.get("batch_id"))
+        )
+        # Latência percebida: tempo até o primeiro token e velocidade de geração
+        details = (f"Job #{job['id']}: ttft={stats['ttft_s']}s, total={stats['total_s']}s, "
+                   f"tokens={stats['output_tokens']}, tokens/s={stats['tokens_per_s']}, "
+                   f"tokens_entrada={stats['total_input_tokens']}, tokens_saida={stats['total_output_tokens']}, "
+                   f"custo_usd={stats['cost_usd']}, "
+                   f"etapas={', '.join(f'{k}:{v:.2f}s' for k, v in stats['stages'].items())}")
+        print(f"Auditoria LLM - {details}")
+        log_action(job["username"], "AUDITORIA_LLM", details)
+        record_audit(job["id"], job["username"], job["doc_type"], len(job["pdf"]), stats)
+        if job["cache_key"]:
+            put_cached(job["cache_key"], job["doc_type"], report, docx_bytes)
+        return report, docx_bytes
+    return handler
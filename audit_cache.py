@@ -0,0 +1,77 @@
+"""
+Cache de resultados de auditoria no PostgreSQL (tabela audit_cache).
+
+A chave combina o hash do PDF, o tipo de documento, a versão dos prompts
+(audit.PROMPT_VERSION) e a versão da base jurídica (hash do manifesto do
+índice). Reenviar o mesmo edital devolve o relatório e o .docx guardados
+sem chamar o LLM. Entradas expiram após AUDIT_CACHE_TTL_DAYS e, se o total
+passar de AUDIT_CACHE_MAX_MB, as menos usadas recentemente são removidas.
+"""
+import os
+import hashlib
+from db import get_db_connection
+
+AUDIT_CACHE_TTL_DAYS = int(os.environ.get("AUDIT_CACHE_TTL_DAYS", "30"))
+AUDIT_CACHE_MAX_MB = int(os.environ.get("AUDIT_CACHE_MAX_MB", "500"))
+
+
+def cache_key(pdf_bytes, doc_type, prompt_version, kb_version):
+    doc_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    return hashlib.sha256(f"{doc_hash}|{doc_type}|{prompt_version}|{kb_version}".encode("utf-8")).hexdigest()
+
+
+def get_cached(key):
+    """(relatório, bytes do .docx) se houver entrada válida; registra o acerto."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE audit_cache SET hits = hits + 1, last_hit_at = NOW()
+        WHERE cache_key = %s AND created_at > NOW() - %s * INTERVAL '1 day'
+        RETURNING report, report_docx
+    """, (key, AUDIT_CACHE_TTL_DAYS))
+    row = cur.fetchone()
+    conn.commit()
+    conn.close()
+    if not row:
+        return None
+    return row[0], bytes(row[1])
+
+
+def put_cached(key, doc_type, report, docx_bytes):
+    conn = get_db_connection()
+    if conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO audit_cache (cache_key, doc_type, report, report_docx, size_bytes)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET report = EXCLUDED.report, report_docx = EXCLUDED.report_docx,
+                size_bytes = EXCLUDED.size_bytes, created_at = NOW(), last_hit_at = NOW()
+        """, (key, doc_type, report, docx_bytes, len(report.encode("utf-8")) + len(docx_bytes)))
+        conn.commit()
+        conn.close()
+    evict()
+
+
+def evict():
+    """Remove entradas vencidas e, acima do limite de tamanho, as menos usadas."""
+    conn = get_db_connection()
+    if conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM audit_cache WHERE created_at < NOW() - %s * INTERVAL '1 day'", (AUDIT_CACHE_TTL_DAYS,)
+        )
+        # Mantém as mais recentemente usadas cujo tamanho acumulado cabe no limite
+        cur.execute("""
+            DELETE FROM audit_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key, SUM(size_bytes) OVER (ORDER BY last_hit_at DESC, cache_key) AS running
+                    FROM audit_cache
+                ) ranked
+                WHERE running > %s
+            )
+        """, (AUDIT_CACHE_MAX_MB * 1024 * 1024,))
+        conn.commit()
+        conn.close()
@@ -1,85 +1,31 @@
 import streamlit as st
 import os
-import psycopg2
-from datetime import datetime
-from io import BytesIO
-from docx import Document as DocxDocument
-from pypdf import PdfReader
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
+import threading
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
-# Carrega variáveis de ambiente
+# Carrega variáveis de ambiente (antes dos módulos locais, que as leem na importação)
 load_dotenv()
 
+# Só o necessário para o login e as páginas sem IA. A pilha de IA (langchain,
+# FAISS, pypdf, python-docx: knowledge_base, embeddings e audit) é importada
+# dentro das funções que a usam, na primeira vez que forem chamadas.
+from db import connect, init_db, log_action, fetch_logs, log_actions, LOG_RETENTION_DAYS
+from jobs import (AuditWorkerPool, submit_job, record_cached_job, list_jobs, get_job, create_batch, list_batches,
+                  batch_jobs, ACTIVE_STATUSES)
+from batch import BATCH_WORKERS, DOC_TYPES, expand_uploads, guess_doc_type
+from audit_cache import cache_key, get_cached
+from metrics import (METRICS_PORT, STAGE_LABELS, record_audit, stage_percentiles, audit_summary, recent_audits,
+                     serve_metrics)
+
 # --- CONFIGURAÇÃO DO BANCO DE DADOS (PostgreSQL) ---
 def get_db_connection():
     try:
-        url = os.environ.get("DATABASE_URL")
-        conn = psycopg2.connect(url)
-        return conn
+        return connect()
     except Exception as e:
         st.error(f"Erro ao conectar no Banco de Dados: {e}")
         return None
 
-def init_db():
-    conn = get_db_connection()
-    if conn:
-        cur = conn.cursor()
-        # Tabelas essenciais
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                username VARCHAR(50) PRIMARY KEY,
-                password VARCHAR(50) NOT NULL,
-                role VARCHAR(20) DEFAULT 'user',
-                perm_auditor BOOLEAN DEFAULT FALSE,
-                perm_gerador BOOLEAN DEFAULT FALSE,
-                perm_parecer BOOLEAN DEFAULT FALSE,
-                perm_pca BOOLEAN DEFAULT FALSE,
-                perm_recursos BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS system_logs (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50),
-                action VARCHAR(200),
-                details TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS support_tickets (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50),
-                message TEXT,
-                status VARCHAR(20) DEFAULT 'aberto',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        # Cria ADMIN padrão se não existir
-        cur.execute("SELECT * FROM users WHERE username = 'admin'")
-        if not cur.fetchone():
-            cur.execute("""
-                INSERT INTO users (username, password, role, perm_auditor, perm_gerador, perm_parecer, perm_pca, perm_recursos)
-                VALUES ('admin', 'admin123', 'admin', TRUE, TRUE, TRUE, TRUE, TRUE)
-            """)
-        conn.commit()
-        cur.close()
-        conn.close()
-
-def log_action(username, action, details=""):
-    conn = get_db_connection()
-    if conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO system_logs (username, action, details) VALUES (%s, %s, %s)", (username, action, details))
-        conn.commit()
-        conn.close()
-
 def send_support_ticket(username, message):
     conn = get_db_connection()
     if conn:
@@ -90,137 +36,217 @@ def send_support_ticket(username, message):
         st.success("✅ Chamado aberto com sucesso!")
 
 # --- INICIALIZAÇÃO DB ---
-if "db_initialized" not in st.session_state:
-    init_db()
-    st.session_state["db_initialized"] = True
+@st.cache_resource
+def migrate_db():
+    """Migração do esquema uma vez por processo (init_db pula se o banco já estiver na versão atual)."""
+    if not init_db():
+        # Exceção não fica em cache: a próxima sessão tenta de novo
+        raise RuntimeError("Banco de Dados indisponível para a migração")
+    return True
+
+try:
+    migrate_db()
+except RuntimeError as e:
+    print(e)
 
-# --- MOTOR DE INTELIGÊNCIA (CÉREBRO V15) ---
 @st.cache_resource
+def start_metrics_server():
+    """Endpoint /metrics (formato Prometheus) em METRICS_PORT, um por processo."""
+    try:
+        return serve_metrics(METRICS_PORT)
+    except OSError as e:
+        print(f"Erro ao iniciar o endpoint de métricas na porta {METRICS_PORT}: {e}")
+
+if METRICS_PORT:
+    start_metrics_server()
+
+# --- MOTOR DE INTELIGÊNCIA (CÉREBRO V15) ---
+def load_local_knowledge_base():
+    """
+    Carrega o índice já publicado por build_index.py (ver knowledge_base.py),
+    sem ler PDFs nem gerar embeddings. Só num ambiente sem nenhuma versão
+    publicada o índice é construído aqui, pelo mesmo caminho da linha de comando,
+    e no modo compacto relido da versão publicada (build_index devolve o plano).
+    Retorna (vectorstore, metadados da versão).
+    """
+    from embeddings import make_embeddings
+    from compact_index import KB_INDEX_MODE
+    from knowledge_base import load_index, build_index, describe_changes
+
+    embeddings = make_embeddings()
+    vectorstore, info = load_index(embeddings)
+    if vectorstore is None:
+        print("Base Jurídica: nenhum índice publicado; construindo (rode build_index.py no deploy)")
+        vectorstore, info, report = build_index(embeddings)
+        print(f"Base Jurídica: {describe_changes(report)}")
+        if vectorstore is not None and KB_INDEX_MODE == "compact":
+            vectorstore, info = load_index(embeddings)
+    return vectorstore, info
+
+@st.cache_resource(show_spinner=False)
 def load_knowledge_base():
     """
-    Lê TODOS os arquivos da pasta data/legislacao.
-    Usa técnica de 'Lotes' (Batching) para ler tudo sem estourar limite da OpenAI.
+    Com KB_SERVICE_URL, usa o serviço de busca compartilhado (kb_service.py),
+    sem carregar o índice neste processo; se o serviço estiver fora na partida
+    ou cair depois, o índice local é carregado como fallback.
+    Retorna (vectorstore ou cliente do serviço, metadados da versão na
+    partida; com o serviço, a versão atual vem de client.info()).
     """
-    index_path = "faiss_index"
-    folder_path = "data/legislacao"
-    embeddings = OpenAIEmbeddings()
+    from kb_service import KB_SERVICE_URL, KBClient
 
-    # 1. Tenta carregar índice salvo do disco (Rápido)
-    if os.path.exists(index_path):
+    if KB_SERVICE_URL:
+        client = KBClient(KB_SERVICE_URL, fallback=lambda: load_local_knowledge_base()[0])
         try:
-            return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-        except:
-            pass
+            return client, client.info()
+        except OSError as e:
+            print(f"Serviço da Base Jurídica indisponível ({KB_SERVICE_URL}): {e}; usando o índice local")
+    return load_local_knowledge_base()
 
-    # 2. Se não existir, varre a pasta e lê os PDFs
-    docs = []
-    if not os.path.exists(folder_path):
-        return None
+@st.cache_resource(show_spinner=False)
+def get_audit_workers(_vectorstore):
+    """Pool de workers da fila de auditorias (um por processo do servidor)."""
+    from audit import make_job_handler
 
-    # Varredura completa (Recursiva)
-    for root, dirs, files in os.walk(folder_path):
-        for filename in files:
-            if filename.lower().endswith(".pdf"):
-                file_path = os.path.join(root, filename)
-                try:
-                    reader = PdfReader(file_path)
-                    text = ""
-                    for page in reader.pages:
-                        if page.extract_text():
-                            text += page.extract_text()
-                    
-                    # Só adiciona se tiver texto
-                    if text:
-                        docs.append(Document(page_content=text, metadata={"source": filename}))
-                except:
-                    print(f"Erro ao ler arquivo: {filename}")
-    
-    if not docs:
-        return None
-
-    # 3. Processamento em Lotes (Batching) - O SEGREDO PARA NÃO TRAVAR
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = text_splitter.split_documents(docs)
-    
-    batch_size = 100 # Envia de 100 em 100 pedaços
-    if len(splits) == 0:
-        return None
-        
-    # Primeiro lote cria o banco
-    vectorstore = FAISS.from_documents(splits[:batch_size], embeddings)
-    
-    # Restante dos lotes são adicionados aos poucos
-    for i in range(batch_size, len(splits), batch_size):
-        batch = splits[i : i + batch_size]
-        if batch:
-            vectorstore.add_documents(batch)
-            
-    vectorstore.save_local(index_path)
-    return vectorstore
+    return AuditWorkerPool(make_job_handler(_vectorstore)).start()
 
-def get_pdf_text(pdf_docs):
-    text = ""
-    for pdf in pdf_docs:
+@st.cache_resource
+def start_ai_warmup():
+    """
+    Depois do login, carrega a Base Jurídica e inicia os workers numa thread,
+    sem atrasar a página: ao abrir o Auditor está tudo pronto, e jobs que
+    ficaram na fila num reinício voltam a ser processados.
+    """
+    def warmup():
         try:
-            pdf_reader = PdfReader(pdf)
-            for page in pdf_reader.pages:
-                if page.extract_text():
-                    text += page.extract_text()
-        except:
-            pass
-    return text
-
-def create_word_docx(markdown_text):
-    doc = DocxDocument()
-    doc.add_heading('Lici Govtech - Relatório de Auditoria', 0)
-    for line in markdown_text.split('\n'):
-        if line.startswith('### '):
-            doc.add_heading(line.replace('### ', ''), level=2)
-        elif line.startswith('## '):
-            doc.add_heading(line.replace('## ', ''), level=1)
-        elif line.startswith('- ') or line.startswith('* '):
-            doc.add_paragraph(line.replace('- ', '').replace('* ', ''), style='List Bullet')
+            vectorstore, _ = load_knowledge_base()
+            get_audit_workers(vectorstore)
+        except Exception as e:
+            print(f"Erro ao preparar a IA em segundo plano: {e}")
+
+    thread = threading.Thread(target=warmup, name="ai-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def show_knowledge_base_status():
+    """Carrega (se ainda não estiver carregada) a Base Jurídica e mostra o status na barra lateral."""
+    with st.sidebar:
+        st.markdown("---")
+        st.caption("Status do Sistema:")
+        with st.spinner("Conectando IA..."):
+            try:
+                vectorstore, kb_info = load_knowledge_base()
+            except Exception as e:
+                # Falha não fica em cache: a próxima execução da página tenta de novo
+                print(f"Erro ao carregar a Base Jurídica: {e}")
+                vectorstore, kb_info = None, None
+        if vectorstore and getattr(vectorstore, "remote", False):
+            # O serviço pode ter sido reiniciado com outra versão: a chave do cache de
+            # auditorias usa a versão atual (relida com TTL pelo cliente), não a da partida
+            try:
+                kb_info = vectorstore.info()
+            except OSError as e:
+                print(f"Serviço da Base Jurídica indisponível ({vectorstore.url}): {e}")
+        if vectorstore:
+            from knowledge_base import describe_index
+            st.success("✅ Base Jurídica Ativa")
+            st.caption(describe_index(kb_info))
+            if getattr(vectorstore, "remote", False):
+                st.caption(f"Busca pelo serviço compartilhado ({vectorstore.url})")
         else:
-            doc.add_paragraph(line)
-    buffer = BytesIO()
-    doc.save(buffer)
-    return buffer.getvalue()
-
-def get_autonomous_prompt(doc_type):
-    # O PROMPT ORIGINAL V15
-    return """
-    Você é um Auditor Federal de Controle Externo Especialista (Nível TCU).
-    
-    SUA MISSÃO:
-    Auditar o documento ({doc_type}) com base na Lei 14.133/21 e na JURISPRUDÊNCIA fornecida.
-
-    REGRAS DE OURO:
-    1. **LEGISLAÇÃO:** Priorize totalmente a Lei 14.133/2021.
-    2. **CITAÇÕES:** PROCURE NO TEXTO DO CONTEXTO o número do Acórdão, Súmula ou Enunciado. Se não encontrar, cite genericamente "Jurisprudência TCU". NÃO cite nomes de arquivos PDF.
-    3. **RIGOR:** Aponte riscos de sobrepreço, restrição de competitividade e direcionamento.
-
-    ---
-    CONTEXTO JURÍDICO (Base de Conhecimento):
-    {context}
-    ---
-
-    DOCUMENTO A SER AUDITADO ({doc_type}):
-    {text}
-
-    GERE O RELATÓRIO NESTE FORMATO:
-
-    ## 🚨 Relatório de Auditoria Técnica
-
-    ### 1. Análise de Conformidade (Lei 14.133/21)
-    (Análise geral do documento).
+            st.warning("⚠️ Base em construção")
+    return vectorstore, kb_info
+
+# --- FILA DE AUDITORIAS (UI) ---
+@st.fragment(run_every=1)
+def poll_audit_job(job_id, username):
+    # Só este trecho é reexecutado a cada 1s enquanto a auditoria roda;
+    # o relatório aparece à medida que o LLM escreve
+    job = get_job(job_id, username, with_result=True)
+    if job and job["status"] in ACTIVE_STATUSES:
+        st.progress(job["progress"] / 100, text=f"{job['filename']}: {job['message'] or 'Na fila...'}")
+        if job["report"]:
+            st.markdown(job["report"])
+    else:
+        st.rerun()
+
+def show_audit_job(job_id, username):
+    job = get_job(job_id, username, with_result=True)
+    if job is None:
+        return
+    if job["status"] in ACTIVE_STATUSES:
+        poll_audit_job(job_id, username)
+    elif job["status"] == "erro":
+        st.warning(job["error"])
+    else:
+        st.success(f"Análise Concluída! ({job['filename']} · {job['doc_type']})")
+        st.markdown(job["report"])
+        st.download_button("📥 Baixar Relatório (.docx)", job["report_docx"], "Auditoria.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", key=f"docx_{job_id}")
 
-    ### 2. Riscos e Irregularidades Identificadas
-    - **Ponto Crítico:** [Descreva o problema]
-    - **Fundamentação:** [Cite o Acórdão X ou Artigo Y da Lei 14.133 do contexto]
-    - **Recomendação:** [O que fazer]
+# --- AUDITORIA EM LOTE (UI) ---
+def submit_audit_batch(username, name, files, doc_types, max_workers, kb_info, force):
+    """Enfileira os arquivos do lote (os que estão no cache entram já concluídos). Retorna o id do lote."""
+    from audit import PROMPT_VERSION
 
-    ### 3. Conclusão do Auditor
-    """
+    batch_id = create_batch(username, name, max_workers)
+    if not batch_id:
+        return None
+    from_cache = 0
+    for (filename, pdf_bytes), doc_type in zip(files, doc_types):
+        key = cache_key(pdf_bytes, doc_type, PROMPT_VERSION, kb_info["kb_version"] if kb_info else None)
+        cached = None if force else get_cached(key)
+        if cached:
+            job_id = record_cached_job(username, doc_type, filename, cached[0], cached[1], key, batch_id)
+            record_audit(job_id, username, doc_type, len(pdf_bytes), cache_hit=True)
+            from_cache += 1
+        else:
+            submit_job(username, doc_type, filename, pdf_bytes, key, batch_id)
+    log_action(username, "AUDITORIA_LOTE", f"Lote #{batch_id}: {len(files)} arquivos ({from_cache} do cache)")
+    return batch_id
+
+def batch_status_table(jobs):
+    st.dataframe([{
+        "Arquivo": job["filename"],
+        "Documento": job["doc_type"],
+        "Situação": job["status"],
+        "Progresso": job["progress"],
+        "Mensagem": job["error"] or job["message"] or "",
+    } for job in jobs], column_config={
+        "Progresso": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%d%%"),
+    }, use_container_width=True, hide_index=True)
+
+@st.fragment(run_every=2)
+def poll_audit_batch(batch_id, username):
+    # Situação de cada arquivo, reexecutada a cada 2s enquanto o lote roda
+    jobs = batch_jobs(batch_id, username)
+    pending = sum(1 for job in jobs if job["status"] in ACTIVE_STATUSES)
+    if not pending:
+        st.rerun()
+    st.progress((len(jobs) - pending) / len(jobs), text=f"{len(jobs) - pending}/{len(jobs)} documentos concluídos")
+    batch_status_table(jobs)
+
+def show_audit_batch(batch, username):
+    jobs = batch_jobs(batch["id"], username)
+    if not jobs:
+        return
+    if any(job["status"] in ACTIVE_STATUSES for job in jobs):
+        poll_audit_batch(batch["id"], username)
+        return
+    from batch import consolidated_report, batch_zip
+
+    failed = sum(1 for job in jobs if job["status"] == "erro")
+    st.success(f"Lote concluído: {len(jobs) - failed} de {len(jobs)} documentos auditados ({batch['name']})")
+    batch_status_table(jobs)
+    # Relatórios e .docx são lidos e o ZIP é montado uma vez por lote na sessão
+    results = st.session_state.setdefault("batch_results", {})
+    if batch["id"] not in results:
+        full = batch_jobs(batch["id"], username, with_result=True)
+        report = consolidated_report(batch["name"], full)
+        results[batch["id"]] = (report, batch_zip(report, full))
+    report, zip_bytes = results[batch["id"]]
+    with st.expander("📋 Relatório Consolidado", expanded=True):
+        st.markdown(report)
+    st.download_button("📥 Baixar Relatórios do Lote (.zip)", zip_bytes, f"Auditoria_Lote_{batch['id']}.zip",
+                       "application/zip", key=f"zip_{batch['id']}")
 
 # --- FRONTEND E NAVEGAÇÃO ---
 st.set_page_config(page_title="Lici Govtech", page_icon="🏛️", layout="wide")
@@ -294,16 +320,8 @@ if st.sidebar.button("Sair"):
     st.session_state["logged_in"] = False
     st.rerun()
 
-# --- CARREGA CÉREBRO ---
-with st.sidebar:
-    st.markdown("---")
-    st.caption("Status do Sistema:")
-    with st.spinner("Conectando IA..."):
-        vectorstore = load_knowledge_base()
-    if vectorstore:
-        st.success("✅ Base Jurídica Ativa")
-    else:
-        st.warning("⚠️ Base em construção")
+# --- CARREGA CÉREBRO (em segundo plano; o Auditor espera por ele se abrir antes) ---
+start_ai_warmup()
 
 # --- DASHBOARD ---
 if menu == "Dashboard":
@@ -339,50 +357,115 @@ if menu == "Dashboard":
 
     # --- MÓDULO AUDITOR (CÓDIGO V15 INTEGRADO AQUI) ---
     elif st.session_state["modulo_ativo"] == "auditor":
+        from audit import PROMPT_VERSION
+
+        vectorstore, kb_info = show_knowledge_base_status()
+        audit_workers = get_audit_workers(vectorstore)
         st.button("⬅️ Voltar ao Painel", on_click=lambda: st.session_state.update({"modulo_ativo": None}))
         st.title("Auditoria Especializada 🔍")
         st.info("A IA analisará o documento cruzando com a Lei 14.133/21 e Jurisprudência.")
 
-        doc_type = st.selectbox("Documento:", ["Edital de Licitação", "TR", "ETP", "Projeto Básico"])
-        uploaded_file = st.file_uploader("Upload do Arquivo PDF", type="pdf")
-
-        if uploaded_file and st.button("🚀 Iniciar Auditoria"):
-            if not api_key:
-                st.error("API Key não configurada.")
-            else:
-                with st.spinner("Lendo documento e consultando Base Jurídica..."):
-                    try:
-                        raw_text = get_pdf_text([uploaded_file])
-                        if len(raw_text) < 50:
-                            st.warning("⚠️ O PDF parece ser uma imagem digitalizada. O OCR será ativado na próxima versão.")
-                        else:
-                            # 1. Busca Contexto (RAG)
-                            contexto = ""
-                            if vectorstore:
-                                docs_rel = vectorstore.similarity_search(raw_text[:6000], k=6)
-                                for doc in docs_rel:
-                                    contexto += f"\n[JURISPRUDÊNCIA]: {doc.page_content}\n"
-                            
-                            # 2. Chama LLM
-                            llm = ChatOpenAI(model_name="gpt-4-turbo", temperature=0.2, openai_api_key=api_key)
-                            prompt_text = get_autonomous_prompt(doc_type)
-                            prompt = PromptTemplate(template=prompt_text, input_variables=["context", "text", "doc_type"])
-                            final_prompt = prompt.format(context=contexto, text=raw_text[:60000], doc_type=doc_type)
-                            
-                            response = llm.invoke(final_prompt)
-                            
-                            # 3. Mostra e Gera Download
-                            st.success("Análise Concluída!")
-                            st.markdown(response.content)
-                            
-                            word_data = create_word_docx(response.content)
-                            st.download_button("📥 Baixar Relatório (.docx)", word_data, "Auditoria.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
-                            
-                            # Loga a operação
-                            log_action(user["username"], "AUDITORIA", f"Doc: {doc_type}")
-
-                    except Exception as e:
-                        st.error(f"Erro técnico: {e}")
+        modo = st.radio("Modo:", ["Um documento", "Lote (vários arquivos ou ZIP)"], horizontal=True)
+
+        if modo != "Um documento":
+            # Lote: cada arquivo vira um job; no máximo `max_workers` deles rodam ao mesmo tempo
+            uploads = st.file_uploader("Arquivos PDF ou ZIP com PDFs", type=["pdf", "zip"], accept_multiple_files=True)
+            default_type = st.selectbox("Tipo padrão (ajuste por arquivo na tabela):", DOC_TYPES)
+            # Abrir os ZIPs e calcular os hashes só quando os arquivos mudam, não a cada interação
+            upload_key = tuple((u.file_id, u.size) for u in uploads or [])
+            expanded = st.session_state.get("batch_uploads")
+            if not expanded or expanded[0] != upload_key:
+                expanded = (upload_key, expand_uploads([(u.name, u.getvalue()) for u in uploads or []]))
+                st.session_state["batch_uploads"] = expanded
+            files, skipped = expanded[1]
+            for name, reason in skipped:
+                st.caption(f"Ignorado: {name} ({reason})")
+            if files:
+                rows = st.data_editor(
+                    [{"Arquivo": name, "Documento": guess_doc_type(name, default_type)} for name, _ in files],
+                    column_config={
+                        "Arquivo": st.column_config.TextColumn(disabled=True),
+                        "Documento": st.column_config.SelectboxColumn(options=DOC_TYPES, required=True),
+                    },
+                    use_container_width=True, hide_index=True,
+                )
+                c1, c2 = st.columns([2, 1])
+                batch_name = c1.text_input("Nome do lote:", f"Lote de {datetime.now():%d/%m/%Y %H:%M}")
+                max_workers = c2.number_input("Auditorias simultâneas:", 1, max(audit_workers.workers, 1),
+                                              min(BATCH_WORKERS, audit_workers.workers))
+                force_batch = st.checkbox("🔄 Forçar nova auditoria (ignorar relatórios já gerados para estes arquivos)")
+                if st.button(f"🚀 Auditar {len(files)} documento(s)"):
+                    if not api_key:
+                        st.error("API Key não configurada.")
+                    else:
+                        batch_id = submit_audit_batch(user["username"], batch_name, files,
+                                                      [row["Documento"] for row in rows], int(max_workers), kb_info,
+                                                      force_batch)
+                        if batch_id:
+                            audit_workers.notify()
+                            st.session_state["audit_batch"] = {"id": batch_id, "name": batch_name}
+
+            if st.session_state.get("audit_batch"):
+                show_audit_batch(st.session_state["audit_batch"], user["username"])
+
+            with st.expander("📦 Meus Lotes"):
+                batches = list_batches(user["username"])
+                if not batches:
+                    st.caption("Nenhum lote enviado ainda.")
+                else:
+                    labels = {
+                        b["id"]: f"#{b['id']} · {b['name']} · {b['done']}/{b['total']} concluídos · {b['created_at']:%d/%m/%Y %H:%M}"
+                        for b in batches
+                    }
+                    chosen = st.selectbox("Lote:", list(labels), format_func=labels.get)
+                    if st.button("Abrir Lote"):
+                        st.session_state["audit_batch"] = next(
+                            {"id": b["id"], "name": b["name"]} for b in batches if b["id"] == chosen
+                        )
+                        st.rerun()
+
+        else:
+            doc_type = st.selectbox("Documento:", DOC_TYPES)
+            uploaded_file = st.file_uploader("Upload do Arquivo PDF", type="pdf")
+            force_audit = st.checkbox("🔄 Forçar nova auditoria (ignorar relatório já gerado para este arquivo)")
+
+            if uploaded_file and st.button("🚀 Iniciar Auditoria"):
+                if not api_key:
+                    st.error("API Key não configurada.")
+                else:
+                    pdf_bytes = uploaded_file.getvalue()
+                    key = cache_key(pdf_bytes, doc_type, PROMPT_VERSION, kb_info["kb_version"] if kb_info else None)
+                    cached = None if force_audit else get_cached(key)
+                    if cached:
+                        # Mesmo arquivo, tipo, prompts e base jurídica: devolve o relatório já pronto
+                        job_id = record_cached_job(user["username"], doc_type, uploaded_file.name, cached[0], cached[1], key)
+                        log_action(user["username"], "AUDITORIA", f"Doc: {doc_type} (cache)")
+                        record_audit(job_id, user["username"], doc_type, len(pdf_bytes), cache_hit=True)
+                    else:
+                        # A auditoria roda em segundo plano: atualizar a página não perde o trabalho
+                        job_id = submit_job(user["username"], doc_type, uploaded_file.name, pdf_bytes, key)
+                        if job_id:
+                            audit_workers.notify()
+                    if job_id:
+                        st.session_state["audit_job"] = job_id
+
+            if st.session_state.get("audit_job"):
+                show_audit_job(st.session_state["audit_job"], user["username"])
+
+            # Relatórios anteriores continuam disponíveis
+            with st.expander("📂 Minhas Auditorias"):
+                jobs = list_jobs(user["username"])
+                if not jobs:
+                    st.caption("Nenhuma auditoria enviada ainda.")
+                else:
+                    labels = {
+                        job["id"]: f"#{job['id']} · {job['filename']} · {job['doc_type']} · {job['status']} · {job['created_at']:%d/%m/%Y %H:%M}"
+                        for job in jobs
+                    }
+                    chosen = st.selectbox("Auditoria:", list(labels), format_func=labels.get)
+                    if st.button("Abrir Relatório"):
+                        st.session_state["audit_job"] = chosen
+                        st.rerun()
 
     # Outros módulos (Placeholders)
     else:
@@ -429,7 +512,7 @@ elif menu == "Suporte / Ajuda":
 elif menu == "Admin":
     st.title("⚙️ Gestão de Clientes")
     
-    tab1, tab2, tab3 = st.tabs(["Novo Usuário", "Gerenciar/Bloquear", "Logs do Sistema"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Novo Usuário", "Gerenciar/Bloquear", "Logs do Sistema", "Desempenho"])
     
     # ABA 1: CRIAR (Igual ao anterior)
     with tab1:
@@ -506,20 +589,80 @@ elif menu == "Admin":
     # ABA 3: LOGS
     with tab3:
         st.subheader("Auditoria de Acessos")
-        if st.button("Atualizar Logs"):
-            st.rerun()
-            
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT timestamp, username, action, details FROM system_logs ORDER BY timestamp DESC LIMIT 50")
-        logs = cur.fetchall()
-        conn.close()
-        
+        archived = st.checkbox(f"Buscar no arquivo (logs com mais de {LOG_RETENTION_DAYS} dias)")
+        f1, f2, f3 = st.columns(3)
+        log_user = f1.selectbox("Usuário:", ["(todos)"] + user_list)
+        log_action_filter = f2.selectbox("Ação:", ["(todas)"] + log_actions(archived))
+        today = datetime.now().date()
+        period = f3.date_input("Período:", (today - timedelta(days=30), today))
+
+        # Filtros aplicados no banco; cada página continua de onde a anterior parou (timestamp, id)
+        filters = (archived, log_user, log_action_filter, tuple(period))
+        if st.button("Atualizar Logs") or st.session_state.get("log_filters") != filters:
+            st.session_state["log_filters"] = filters
+            st.session_state["log_cursors"] = [None]
+        cursors = st.session_state["log_cursors"]
+        logs, has_more = fetch_logs(
+            username=None if log_user == "(todos)" else log_user,
+            action=None if log_action_filter == "(todas)" else log_action_filter,
+            start=datetime.combine(period[0], datetime.min.time()) if period else None,
+            end=datetime.combine(period[-1], datetime.min.time()) + timedelta(days=1) if period else None,
+            before=cursors[-1], archived=archived,
+        )
+
         # Mostra em tabela bonita
-        st.dataframe(logs, column_config={
+        st.dataframe([row[1:] for row in logs], column_config={
             0: "Data/Hora",
             1: "Usuário",
             2: "Ação",
             3: "Detalhes"
         }, use_container_width=True)
 
+        p1, p2, p3 = st.columns([1, 1, 4])
+        if p1.button("⬅️ Anterior", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if p2.button("Próxima ➡️", disabled=not has_more):
+            cursors.append((logs[-1][1], logs[-1][0]))
+            st.rerun()
+        p3.caption(f"Página {len(cursors)}")
+
+    # ABA 4: DESEMPENHO (tempo de cada etapa das auditorias, ver metrics.py)
+    with tab4:
+        st.subheader("Desempenho das Auditorias")
+        windows = {"Últimas 24 horas": 24, "Últimos 7 dias": 24 * 7, "Últimos 30 dias": 24 * 30}
+        window = windows[st.selectbox("Período:", list(windows))]
+
+        summary = audit_summary(window)
+        if not summary or not summary["audits"]:
+            st.caption("Nenhuma auditoria registrada no período.")
+        else:
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Auditorias", summary["audits"])
+            m2.metric("Atendidas pelo cache", f"{summary['cache_hits'] / summary['audits']:.0%}")
+            m3.metric("Tokens (entrada / saída)", f"{summary['input_tokens']:,} / {summary['output_tokens']:,}")
+            m4.metric("Custo estimado", f"US$ {float(summary['cost_usd']):.2f}")
+            st.caption(f"Tamanho do PDF: p50 {summary['doc_bytes_p50'] / 1024:.0f} KB · "
+                       f"p95 {summary['doc_bytes_p95'] / 1024:.0f} KB · "
+                       f"OCR: {summary['ocr_pages']} páginas reconhecidas, {summary['ocr_cached']} do cache")
+
+            import pandas as pd
+
+            percentiles = stage_percentiles(window)
+            if percentiles:
+                st.markdown("**Latência por etapa (segundos)**")
+                chart = pd.DataFrame(
+                    {"p50": [v["p50"] for v in percentiles.values()], "p95": [v["p95"] for v in percentiles.values()]},
+                    index=[STAGE_LABELS.get(k, k) for k in percentiles],
+                )
+                st.bar_chart(chart, stack=False)
+                st.dataframe(chart.assign(auditorias=[v["count"] for v in percentiles.values()]), use_container_width=True)
+
+            rows = recent_audits()
+            st.markdown("**Últimas auditorias**")
+            st.dataframe(pd.DataFrame([{
+                "Data/Hora": r[0], "Job": r[1], "Usuário": r[2], "Documento": r[3],
+                "KB": round((r[4] or 0) / 1024), "Páginas": r[5], "Tokens doc": r[6], "Seções": r[7],
+                "Tokens entrada": r[8], "Tokens saída": r[9], "Custo US$": r[10], "TTFT s": r[11], "Cache": r[12],
+                **{STAGE_LABELS.get(k, k): v for k, v in (r[13] or {}).items()},
+            } for r in rows]), use_container_width=True)
@@ -0,0 +1,170 @@
+"""
+Auditoria em lote: vários PDFs (ou ZIPs com PDFs) numa só submissão.
+
+Cada arquivo vira um job da fila (jobs.py) ligado a um lote (audit_batches).
+Os workers auditam os arquivos em paralelo, no máximo max_workers do mesmo
+lote por vez, para um lote grande não segurar a fila dos outros usuários.
+Os arquivos do lote usam a mesma base jurídica carregada no processo (ou o
+serviço de busca) e o mesmo cache de embeddings, e os resultados da busca
+ficam num cache do lote (query_cache): consultas repetidas entre ETP, TR e
+edital não voltam ao índice. PDFs idênticos no lote são auditados uma vez
+só. No fim, o relatório consolidado resume os achados de cada documento e
+o ZIP traz os .docx individuais.
+"""
+import io
+import os
+import re
+import zipfile
+import hashlib
+import threading
+from collections import OrderedDict
+
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "2"))  # Auditorias simultâneas por lote (padrão)
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "100"))
+BATCH_MAX_FILE_MB = int(os.environ.get("BATCH_MAX_FILE_MB", "50"))  # Limite por PDF (também dentro do ZIP)
+BATCH_QUERY_CACHES = 8  # Lotes com cache de busca em memória (os mais recentes)
+
+DOC_TYPES = ["Edital de Licitação", "TR", "ETP", "Projeto Básico"]
+
+# Tipo sugerido pelo nome do arquivo (o usuário pode trocar antes de enviar)
+DOC_TYPE_HINTS = [
+    (re.compile(r"\betp\b|estudo[s]?[ _-]t[ée]cnico", re.IGNORECASE), "ETP"),
+    (re.compile(r"\btr\b|termo[ _-]de[ _-]refer", re.IGNORECASE), "TR"),
+    (re.compile(r"projeto[ _-]b[áa]sico|\bpb\b", re.IGNORECASE), "Projeto Básico"),
+    (re.compile(r"edital", re.IGNORECASE), "Edital de Licitação"),
+]
+CRITICAL_POINT = re.compile(r"ponto cr[íi]tico", re.IGNORECASE)
+CONCLUSION = re.compile(r"^#+[^\n]*conclus[ãa]o[^\n]*", re.IGNORECASE | re.MULTILINE)
+HEADING = re.compile(r"^#+ ", re.MULTILINE)
+
+
+def guess_doc_type(filename, default=DOC_TYPES[0]):
+    name = os.path.splitext(filename)[0].replace("_", " ")
+    for pattern, doc_type in DOC_TYPE_HINTS:
+        if pattern.search(name):
+            return doc_type
+    return default
+
+
+def expand_uploads(uploads, max_files=BATCH_MAX_FILES, max_bytes=BATCH_MAX_FILE_MB * 1024 * 1024):
+    """
+    Lista de (nome, bytes) com os PDFs enviados, abrindo os ZIPs.
+    Retorna (arquivos, ignorados), ignorados = [(nome, motivo)]: arquivos que
+    não são PDF, grandes demais, além do limite do lote ou repetidos.
+    """
+    files, skipped, seen = [], [], {}
+
+    def add(name, data):
+        if len(files) >= max_files:
+            skipped.append((name, f"limite de {max_files} arquivos por lote"))
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in seen:
+            skipped.append((name, f"mesmo conteúdo de {seen[digest]}"))
+            return
+        seen[digest] = name
+        files.append((name, data))
+
+    for name, data in uploads:
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(io.BytesIO(data))
+            except zipfile.BadZipFile:
+                skipped.append((name, "ZIP inválido"))
+                continue
+            for info in archive.infolist():
+                inner = os.path.basename(info.filename)
+                if info.is_dir() or info.filename.startswith("__MACOSX/") or not inner:
+                    continue
+                if not inner.lower().endswith(".pdf"):
+                    skipped.append((inner, "não é PDF"))
+                elif info.file_size > max_bytes:
+                    # Tamanho declarado no ZIP: não descompacta o que passar do limite
+                    skipped.append((inner, f"maior que {max_bytes // (1024 * 1024)} MB"))
+                else:
+                    add(inner, archive.read(info))
+        elif not name.lower().endswith(".pdf"):
+            skipped.append((name, "não é PDF"))
+        elif len(data) > max_bytes:
+            skipped.append((name, f"maior que {max_bytes // (1024 * 1024)} MB"))
+        else:
+            add(name, data)
+    return files, skipped
+
+
+_query_caches = OrderedDict()
+_query_caches_lock = threading.Lock()
+
+
+def query_cache(batch_id):
+    """
+    Cache de busca do lote (retrieval.QueryCache), compartilhado pelos
+    workers deste processo; None para auditorias avulsas.
+    """
+    if batch_id is None:
+        return None
+    from retrieval import QueryCache
+
+    with _query_caches_lock:
+        cache = _query_caches.get(batch_id)
+        if cache is None:
+            cache = _query_caches[batch_id] = QueryCache()
+            while len(_query_caches) > BATCH_QUERY_CACHES:
+                _query_caches.popitem(last=False)
+        _query_caches.move_to_end(batch_id)
+        return cache
+
+
+# --- RELATÓRIO CONSOLIDADO ---
+def summarize_report(report):
+    """(nº de pontos críticos, texto da Conclusão do Auditor) de um relatório no formato de audit.REPORT_FORMAT."""
+    critical = len(CRITICAL_POINT.findall(report or ""))
+    m = CONCLUSION.search(report or "")
+    if not m:
+        return critical, ""
+    end = HEADING.search(report, m.end())
+    return critical, report[m.end(): end.start() if end else len(report)].strip()
+
+
+def consolidated_report(name, jobs):
+    """Markdown com o resumo do lote e a conclusão de cada documento (jobs de jobs.batch_jobs com relatório)."""
+    done = [job for job in jobs if job["status"] == "concluido"]
+    failed = [job for job in jobs if job["status"] == "erro"]
+    lines = [
+        f"## 📦 Relatório Consolidado: {name}",
+        f"{len(jobs)} documentos · {len(done)} auditados · {len(failed)} com erro",
+        "",
+        "### Resumo por documento",
+    ]
+    conclusions = []
+    for job in jobs:
+        if job["status"] == "concluido":
+            critical, conclusion = summarize_report(job.get("report"))
+            lines.append(f"- **{job['filename']}** ({job['doc_type']}): {critical} ponto(s) crítico(s)")
+            if conclusion:
+                conclusions += ["", f"### {job['filename']} ({job['doc_type']})", conclusion]
+        elif job["status"] == "erro":
+            lines.append(f"- **{job['filename']}** ({job['doc_type']}): erro - {job['error']}")
+        else:
+            lines.append(f"- **{job['filename']}** ({job['doc_type']}): {job['status']}")
+    return "\n".join(lines + conclusions)
+
+
+def _entry_name(n, filename):
+    base = re.sub(r"(\.pdf)+$", "", filename, flags=re.IGNORECASE)
+    base = re.sub(r"[^\w.-]+", "_", base).strip("_") or "documento"
+    return f"{n:02d}_{base}.docx"
+
+
+def batch_zip(report, jobs):
+    """ZIP com o relatório consolidado (.md e .docx) e o .docx de cada documento auditado."""
+    from audit import create_word_docx
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("00_Relatorio_Consolidado.md", report)
+        archive.writestr("00_Relatorio_Consolidado.docx", create_word_docx(report))
+        for n, job in enumerate(jobs, 1):
+            if job["status"] == "concluido" and job.get("report_docx"):
+                archive.writestr(_entry_name(n, job["filename"]), job["report_docx"])
+    return buffer.getvalue()
@@ -0,0 +1,300 @@
+"""
+Benchmark de ponta a ponta (offline) do fluxo do auditor, com teste de carga.
+
+Sobe o servidor OpenAI falso (benchmarks/fake_openai.py) com latências
+configuráveis e usa um PostgreSQL local: o de DATABASE_URL ou, se não houver,
+um descartável criado com o pacote pgserver (pip install -r
+benchmarks/requirements.txt, que traz também as dependências do app). Mede, com
+o código real do app:
+  - pdf_text:    get_pdf_text dos PDFs de amostra (cache de páginas frio e quente)
+  - index:       build_index do corpus (cache de embeddings vazio), a
+                 reconstrução sem mudanças e o carregamento do índice publicado
+                 (o que load_knowledge_base faz na partida)
+  - retrieval:   latência de retrieve() com trechos do corpus (p50/p95)
+  - audit:       N usuários simulados enviando auditorias à fila (jobs.py),
+                 processadas pelo AuditWorkerPool com o mesmo handler do app
+                 (audit.make_job_handler): vazão, latência percebida (envio
+                 até a conclusão, p50/p95) e tempo de cada etapa (metrics.py)
+
+Os dados criados no banco (usuários bench_<execução>_*) são apagados no fim.
+A saída JSON (--json ou --output arquivo.json) traz a versão do código e a
+configuração, para comparar execuções entre versões.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_e2e.py [--folder data/legislacao] [--users 4] [--audits-per-user 2]
+        [--workers 4] [--chat-latency 0.5] [--embedding-latency 0.05] [--tokens-per-second 200] [--json]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import subprocess
+from io import BytesIO
+from contextlib import redirect_stdout
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+from fake_openai import start_server  # noqa: E402
+
+DOC_TYPE = "Edital de Licitação"
+POLL_INTERVAL = 0.25  # O app consulta o job a cada 1s; aqui mais curto para medir melhor
+SNIPPET_CHARS = 300
+
+
+def summarize(values):
+    if not values:
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": round(float(np.mean(values)), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p95": round(float(np.percentile(values, 95)), 4),
+        "max": round(float(np.max(values)), 4),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, round(time.perf_counter() - start, 4)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def start_database(tmp):
+    """(DATABASE_URL, servidor pgserver ou None). O servidor precisa ficar referenciado até o fim."""
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return url, None
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("Defina DATABASE_URL ou instale o pgserver (pip install -r benchmarks/requirements.txt) "
+                 "para um banco descartável.")
+    server = pgserver.get_server(os.path.join(tmp, "pgdata"))
+    return server.get_uri(), server
+
+
+def sample_pdfs(folder, paths, count):
+    from ingestion import scan_corpus
+
+    if not paths:
+        corpus = sorted(scan_corpus(folder).values())
+        step = max(1, len(corpus) // count)
+        paths = corpus[::step][:count]
+    return [(os.path.basename(p), open(p, "rb").read()) for p in paths]
+
+
+def bench_pdf_text(samples):
+    from audit import get_pdf_text
+
+    cold, warm = [], []
+    for name, data in samples:
+        cold.append(timed(get_pdf_text, [BytesIO(data)])[1])
+        warm.append(timed(get_pdf_text, [BytesIO(data)])[1])
+    return {"cold": summarize(cold), "warm": summarize(warm), "total_mb": round(sum(len(d) for _, d in samples) / 2**20, 2)}
+
+
+def bench_index(folder, index_path):
+    from embeddings import make_embeddings
+    from knowledge_base import build_index, load_index
+
+    embeddings = make_embeddings()
+    (vectorstore, info, _), build_s = timed(build_index, embeddings, folder, index_path)
+    _, rebuild_s = timed(build_index, embeddings, folder, index_path)
+    (vectorstore, info), load_s = timed(load_index, make_embeddings(), index_path)
+    return vectorstore, info, {
+        "files": info["files"], "chunks": info["chunks"], "build_s": build_s,
+        "rebuild_unchanged_s": rebuild_s, "load_s": load_s, "embedding_cache": embeddings.stats,
+    }
+
+
+def bench_retrieval(vectorstore, queries):
+    from retrieval import retrieve
+
+    rng = random.Random(42)
+    ids = list(vectorstore.index_to_docstore_id.values())
+    latencies = []
+    for _ in range(queries):
+        text = vectorstore.docstore.search(rng.choice(ids)).page_content
+        start = rng.randrange(max(len(text) - SNIPPET_CHARS, 1))
+        latencies.append(timed(retrieve, vectorstore, text[start : start + SNIPPET_CHARS])[1])
+    return summarize(latencies)
+
+
+def bench_audits(vectorstore, info, samples, users, audits_per_user, workers, use_cache, run_id):
+    from db import get_db_connection, init_db
+    from jobs import ACTIVE_STATUSES, AuditWorkerPool, get_job, record_cached_job, submit_job
+    from audit import PROMPT_VERSION, make_job_handler
+    from audit_cache import cache_key, get_cached
+    from metrics import STAGES
+
+    if not init_db():
+        sys.exit("Banco de Dados indisponível.")
+    pool = AuditWorkerPool(make_job_handler(vectorstore), workers=workers).start()
+    keys = set()
+
+    def simulated_user(n):
+        # Mesmo caminho da página: consulta o cache, enfileira, acompanha o job
+        username = f"bench_{run_id}_{n}"
+        results = []
+        for i in range(audits_per_user):
+            name, data = samples[(n + i) % len(samples)]
+            started = time.perf_counter()
+            key = cache_key(data, DOC_TYPE, PROMPT_VERSION, info["kb_version"])
+            keys.add(key)
+            cached = get_cached(key) if use_cache else None
+            if cached:
+                job_id = record_cached_job(username, DOC_TYPE, name, cached[0], cached[1], key)
+            else:
+                job_id = submit_job(username, DOC_TYPE, name, data, key)
+                pool.notify()
+            job = get_job(job_id, username)
+            while job and job["status"] in ACTIVE_STATUSES:
+                time.sleep(POLL_INTERVAL)
+                job = get_job(job_id, username)
+            results.append({"status": job["status"] if job else "perdido", "cached": bool(cached),
+                            "latency_s": time.perf_counter() - started})
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        results = [r for user_results in executor.map(simulated_user, range(users)) for r in user_results]
+    wall_s = time.perf_counter() - started
+
+    # Tempo de cada etapa, gravado pelo handler na tabela audit_metrics
+    pattern = f"bench_{run_id}_%"
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT stages, input_tokens, output_tokens, cost_usd FROM audit_metrics WHERE username LIKE %s",
+                (pattern,))
+    rows = cur.fetchall()
+    conn.close()
+    stages = {stage: [] for stage in STAGES}
+    for row in rows:
+        for stage, seconds in (row[0] or {}).items():
+            stages.setdefault(stage, []).append(seconds)
+
+    done = [r for r in results if r["status"] == "concluido"]
+    return {
+        "users": users, "audits": len(results), "completed": len(done),
+        "failed": len(results) - len(done), "cache_hits": sum(r["cached"] for r in results),
+        "wall_s": round(wall_s, 3),
+        "throughput_per_min": round(len(done) / wall_s * 60, 2) if wall_s else None,
+        "latency_s": summarize([r["latency_s"] for r in done]),
+        "stages_s": {stage: summarize(values) for stage, values in stages.items() if values},
+        "input_tokens": sum(r[1] or 0 for r in rows), "output_tokens": sum(r[2] or 0 for r in rows),
+        "cost_usd": round(float(sum(r[3] or 0 for r in rows)), 4),
+    }, keys
+
+
+def cleanup(run_id, keys):
+    """Apaga do banco o que o benchmark criou (importa quando DATABASE_URL é um banco de verdade)."""
+    from db import flush_logs, get_db_connection
+
+    flush_logs()
+    conn = get_db_connection()
+    if not conn:
+        return
+    cur = conn.cursor()
+    pattern = f"bench_{run_id}_%"
+    for table in ("audit_jobs", "audit_metrics", "system_logs"):
+        cur.execute(f"DELETE FROM {table} WHERE username LIKE %s", (pattern,))
+    if keys:
+        cur.execute("DELETE FROM audit_cache WHERE cache_key = ANY(%s)", (list(keys),))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="data/legislacao", help="corpus da base jurídica")
+    parser.add_argument("--pdfs", nargs="*", help="PDFs auditados (padrão: amostra do corpus)")
+    parser.add_argument("--samples", type=int, default=3, help="tamanho da amostra do corpus")
+    parser.add_argument("--queries", type=int, default=50, help="consultas do teste de busca")
+    parser.add_argument("--users", type=int, default=4, help="usuários simultâneos simulados")
+    parser.add_argument("--audits-per-user", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4, help="workers da fila de auditorias")
+    parser.add_argument("--use-cache", action="store_true", help="consultar o cache de auditorias (padrão: forçar nova)")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="segundos por requisição de embeddings")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="segundos até o início da resposta do chat")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="velocidade do chat falso")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fração de respostas 429 do servidor falso")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    parser.add_argument("--output", help="grava o JSON neste arquivo")
+    args = parser.parse_args()
+
+    # Os prints do app (logs dos workers etc.) vão para o stderr: o stdout fica só com o resultado
+    with redirect_stdout(sys.stderr):
+        report = run(args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+    index, audit = report["index"], report["audit"]
+    print(f"Revisão {report['revision']} · amostra: {', '.join(report['samples'])}")
+    print(f"pdf_text    frio p50={report['pdf_text']['cold']['p50']}s  quente p50={report['pdf_text']['warm']['p50']}s")
+    print(f"índice      {index['files']} arquivos, {index['chunks']} trechos: build={index['build_s']}s  "
+          f"rebuild sem mudanças={index['rebuild_unchanged_s']}s  carga={index['load_s']}s")
+    print(f"busca       p50={report['retrieval']['p50']}s  p95={report['retrieval']['p95']}s")
+    print(f"auditoria   {audit['completed']}/{audit['audits']} concluídas por {audit['users']} usuários em "
+          f"{audit['wall_s']}s ({audit['throughput_per_min']}/min)  latência p50={audit['latency_s'].get('p50')}s "
+          f"p95={audit['latency_s'].get('p95')}s")
+    for stage, values in audit["stages_s"].items():
+        print(f"  {stage:<11} p50={values['p50']}s  p95={values['p95']}s")
+
+
+def run(args):
+    tmp = tempfile.mkdtemp(prefix="bench_e2e_")
+    server = start_server(latency=0.0, rate_limit=args.rate_limit, tokens_per_second=args.tokens_per_second,
+                          embedding_latency=args.embedding_latency, chat_latency=args.chat_latency)
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    database_url, pg = start_database(tmp)
+    # Antes de importar o app: os módulos leem o ambiente na importação.
+    # Caches em pasta temporária, para os vetores falsos não irem para o cache de verdade
+    os.environ.update(
+        OPENAI_BASE_URL=url, EMBEDDINGS_BASE_URL=url, OPENAI_API_KEY="fake", EMBEDDINGS_MODEL="fake-embedding",
+        EMBEDDINGS_CACHE_PATH=os.path.join(tmp, "embeddings.sqlite3"),
+        PAGE_CACHE_PATH=os.path.join(tmp, "pages.sqlite3"), DATABASE_URL=database_url,
+    )
+
+    run_id = uuid.uuid4().hex[:8]
+    samples = sample_pdfs(args.folder, args.pdfs, args.samples)
+    report = {
+        "benchmark": "e2e", "revision": git_revision(), "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "output")},
+        "database": "pgserver" if pg else "DATABASE_URL",
+        "samples": [name for name, _ in samples],
+    }
+    report["pdf_text"] = bench_pdf_text(samples)
+    vectorstore, info, report["index"] = bench_index(args.folder, os.path.join(tmp, "index"))
+    report["retrieval"] = bench_retrieval(vectorstore, args.queries)
+    keys = set()
+    try:
+        report["audit"], keys = bench_audits(vectorstore, info, samples, args.users, args.audits_per_user,
+                                             args.workers, args.use_cache, run_id)
+    finally:
+        cleanup(run_id, keys)
+    report["fake_openai"] = dict(server.counters)
+    return report
+
+
+if __name__ == "__main__":
+    main()
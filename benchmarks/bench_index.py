@@ -0,0 +1,195 @@
+"""
+Benchmark do índice compacto (compact_index.py) contra o FAISS plano atual.
+
+Constrói o índice plano do corpus (build_index), grava as variantes compactas
+(SQ8 e IVF-PQ, com re-ranking nos vetores exatos em mmap) e mede, cada modo
+num processo novo:
+  - recall@k: fração dos k vizinhos exatos (índice plano) que o modo devolve
+  - latência por consulta (busca no índice + leitura do texto dos k trechos)
+  - memória residente (RSS anônima e de arquivos/mmap) acrescentada ao
+    carregar o índice e depois das consultas (Linux)
+  - tamanho em disco dos arquivos de cada modo
+
+Com --fake os embeddings vêm do servidor falso (benchmarks/fake_openai.py),
+cujos vetores são aleatórios: as consultas são então vetores do corpus com
+ruído, para haver vizinhos próximos de verdade. Com a API real, as consultas
+são trechos do texto dos próprios documentos.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_index.py [--fake] [--folder data/legislacao] [--k 10] [--queries 200] [--json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+FACTORIES = ["sq8", "ivfpq"]
+
+
+def rss_mb():
+    """
+    Memória residente (Linux: /proc/self/status) em MB: (anônima, de arquivos).
+    A parte de arquivos (páginas do mmap) é compartilhada e o kernel pode
+    descartá-la sob pressão; a anônima é a memória própria do processo.
+    """
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                key, value = line.split()[:2]
+                values[key] = int(value) / 1024
+    return values["RssAnon:"], values["RssFile:"]
+
+
+def rss_delta(before, after):
+    return {"anon_mb": round(after[0] - before[0], 1), "file_mb": round(after[1] - before[1], 1)}
+
+
+def dir_mb(path, names):
+    return round(sum(os.path.getsize(os.path.join(path, n)) for n in names if os.path.exists(os.path.join(path, n))) / 2**20, 2)
+
+
+def measure(mode, path, queries_file, k):
+    """Executado num processo novo: carrega um modo, roda as consultas e imprime JSON."""
+    from langchain_community.vectorstores import FAISS
+    from compact_index import CompactVectorStore
+
+    queries = np.load(queries_file)
+    before = rss_mb()
+    start = time.perf_counter()
+    if mode == "flat":
+        store = FAISS.load_local(path, None, allow_dangerous_deserialization=True)
+    else:
+        store = CompactVectorStore(path, None)
+    load_s = time.perf_counter() - start
+    loaded = rss_mb()
+
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, indices = store.index.search(query.reshape(1, -1), k)
+        ids = [store.index_to_docstore_id[i] for i in indices[0] if i != -1]
+        for doc_id in ids:
+            store.docstore.search(doc_id).page_content
+        latencies.append(time.perf_counter() - start)
+        results.append(ids)
+    print(json.dumps({
+        "load_s": round(load_s, 3),
+        "rss_load": rss_delta(before, loaded),
+        "rss_after_queries": rss_delta(before, rss_mb()),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "results": results,
+    }))
+
+
+def run_measure(mode, path, queries_file, k):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure", mode, path, queries_file, str(k)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def make_queries(vectorstore, embeddings, count, fake):
+    rng = random.Random(42)
+    positions = [rng.randrange(vectorstore.index.ntotal) for _ in range(count)]
+    if fake:
+        vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)[positions]
+        noise = np.random.default_rng(42).normal(size=vectors.shape).astype(np.float32)
+        scale = np.linalg.norm(vectors, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+        return vectors + 0.5 * scale * noise
+    texts = []
+    for position in positions:
+        text = vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]).page_content
+        start = rng.randrange(max(len(text) - 300, 1))
+        texts.append(text[start : start + 300])
+    return np.array(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="data/legislacao")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--fake", action="store_true", help="embeddings do servidor falso (sem API)")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    parser.add_argument("--measure", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        mode, path, queries_file, k = args.measure
+        measure(mode, path, queries_file, int(k))
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_index_")
+    if args.fake:
+        from fake_openai import start_server
+        server = start_server()
+        os.environ["EMBEDDINGS_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "fake")
+        # Vetores falsos não podem ir para o cache de embeddings de verdade
+        os.environ["EMBEDDINGS_CACHE_PATH"] = os.path.join(tmp, "embeddings.sqlite3")
+        os.environ["EMBEDDINGS_MODEL"] = "fake-embedding"
+    from embeddings import make_embeddings
+    from knowledge_base import ARTIFACT_FILES, build_index
+    from compact_index import (CHUNKS_FILE, COMPACT_FILE, IDS_FILE, OFFSETS_FILE, VECTORS_FILE,
+                               LEXICAL_DOCS_FILE, LEXICAL_LENGTHS_FILE, LEXICAL_TERMS_FILE, LEXICAL_TFS_FILE,
+                               factory_for, write_compact)
+
+    embeddings = make_embeddings()
+    index_path = os.path.join(tmp, "index")
+    start = time.perf_counter()
+    vectorstore, info, _ = build_index(embeddings, args.folder, index_path)
+    build_s = time.perf_counter() - start
+    flat_path = os.path.join(index_path, "versions", info["version"])
+    queries_file = os.path.join(tmp, "queries.npy")
+    np.save(queries_file, make_queries(vectorstore, embeddings, args.queries, args.fake))
+
+    modes = {"flat": (flat_path, dir_mb(flat_path, ARTIFACT_FILES), None)}
+    compact_files = (COMPACT_FILE, VECTORS_FILE, CHUNKS_FILE, OFFSETS_FILE, IDS_FILE,
+                     LEXICAL_TERMS_FILE, LEXICAL_DOCS_FILE, LEXICAL_TFS_FILE, LEXICAL_LENGTHS_FILE)
+    for kind in FACTORIES:
+        path = os.path.join(tmp, kind)
+        os.makedirs(path)
+        factory = write_compact(vectorstore, path, kind)
+        ram_files = (COMPACT_FILE, IDS_FILE, OFFSETS_FILE, LEXICAL_TERMS_FILE)
+        modes[kind] = (path, dir_mb(path, compact_files), {"factory": factory, "in_ram_mb": dir_mb(path, ram_files)})
+
+    results = []
+    truth = None
+    for mode, (path, disk_mb, extra) in modes.items():
+        r = run_measure(mode, path, queries_file, args.k)
+        found = r.pop("results")
+        if truth is None:
+            truth = found
+        recall = np.mean([len(set(a) & set(t)) / max(len(t), 1) for a, t in zip(found, truth)])
+        results.append(dict({"mode": mode, "disk_mb": disk_mb, f"recall@{args.k}": round(float(recall), 4)}, **r, **(extra or {})))
+
+    report = {"benchmark": "index", "chunks": vectorstore.index.ntotal, "files": info["files"],
+              "dimension": vectorstore.index.d, "queries": args.queries, "fake_embeddings": args.fake,
+              "build_s": round(build_s, 1), "auto_factory": factory_for(vectorstore.index.ntotal, vectorstore.index.d, "auto"),
+              "results": results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['chunks']} trechos de {report['files']} arquivos, dim {report['dimension']}, "
+          f"{args.queries} consultas (auto = {report['auto_factory']})")
+    for r in results:
+        print(f"{r['mode']:<6} recall@{args.k}={r[f'recall@{args.k}']:.3f}  p50={r['p50_ms']:.2f}ms  "
+              f"p95={r['p95_ms']:.2f}ms  RSS anônima +{r['rss_load']['anon_mb']}MB "
+              f"(após consultas +{r['rss_after_queries']['anon_mb']}MB, mmap +{r['rss_after_queries']['file_mb']}MB)  "
+              f"disco {r['disk_mb']}MB")
+
+
+if __name__ == "__main__":
+    main()
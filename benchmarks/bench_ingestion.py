@@ -0,0 +1,82 @@
+"""
+Benchmark da extração de texto dos PDFs (páginas/segundo).
+
+Compara, sobre o corpus data/legislacao:
+  - serial_legado: laço antigo (extract_text duas vezes por página + text +=)
+  - pool_frio:     ingestion.extract_pages com pool de processos e cache vazio
+  - cache_quente:  a mesma chamada com o cache de páginas já preenchido
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_ingestion.py [--folder data/legislacao] [--workers 4] [--json]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypdf import PdfReader  # noqa: E402
+from ingestion import PageCache, extract_pages, scan_corpus, file_sha256, INGEST_WORKERS  # noqa: E402
+
+
+def legacy_serial(paths):
+    pages = 0
+    for path in paths:
+        try:
+            reader = PdfReader(path)
+            text = ""
+            for page in reader.pages:
+                if page.extract_text():
+                    text += page.extract_text()
+                pages += 1
+        except Exception:
+            pass
+    return pages
+
+
+def run_pool(sources, workers, cache):
+    pages = 0
+    for key, file_pages in extract_pages(sources, workers=workers, cache=cache):
+        pages += len(file_pages or [])
+    return pages
+
+
+def timed(name, fn, *args):
+    start = time.perf_counter()
+    pages = fn(*args)
+    elapsed = time.perf_counter() - start
+    return {"name": name, "pages": pages, "seconds": round(elapsed, 3),
+            "pages_per_second": round(pages / elapsed, 1) if elapsed else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="data/legislacao")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--skip-legacy", action="store_true", help="não roda o laço serial antigo")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    files = scan_corpus(args.folder)
+    sources = {rel: (file_sha256(path), path) for rel, path in files.items()}
+    results = []
+    if not args.skip_legacy:
+        results.append(timed("serial_legado", legacy_serial, sorted(files.values())))
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PageCache(os.path.join(tmp, "pages.sqlite3"))
+        results.append(timed(f"pool_frio_{args.workers}w", run_pool, sources, args.workers, cache))
+        results.append(timed("cache_quente", run_pool, sources, args.workers, cache))
+
+    if args.json:
+        print(json.dumps({"benchmark": "ingestion", "files": len(files), "workers": args.workers, "results": results}))
+    else:
+        print(f"{len(files)} arquivos, {args.workers} workers")
+        for r in results:
+            print(f"{r['name']:<18} {r['pages']:>6} páginas  {r['seconds']:>8.2f}s  {r['pages_per_second']:>9} pág/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark da partida do app (auditor.py).
+
+Cada medida roda num processo Python novo (imports a frio):
+  - import_<módulo>:   tempo de importação de cada módulo do app
+  - login_page:        primeira renderização da tela de login (AppTest),
+                       incluindo a importação do streamlit e do auditor.py
+  - segunda_sessao:    outra sessão no mesmo processo (migração do banco já feita)
+  - pilha_ia_no_login: se langchain/FAISS/pypdf/docx foram carregados só para o login
+
+Sem DATABASE_URL acessível a tela de login ainda renderiza (a migração falha e
+é tentada de novo na próxima sessão), mas o tempo não inclui o banco.
+
+Uso (na raiz do repositório):
+    python benchmarks/bench_startup.py [--runs 5] [--json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["streamlit", "db", "jobs", "audit_cache", "embeddings", "knowledge_base", "audit"]
+AI_MODULES = ["langchain_openai", "langchain_community.vectorstores", "faiss", "pypdf", "docx"]
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+LOGIN_SNIPPET = """
+import sys, json, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+first = AppTest.from_file("auditor.py", default_timeout=60).run()
+login = time.perf_counter() - start
+start = time.perf_counter()
+second = AppTest.from_file("auditor.py", default_timeout=60).run()
+print(json.dumps({
+    "login_page": login,
+    "segunda_sessao": time.perf_counter() - start,
+    "ok": not first.exception and len(first.text_input) == 2,
+    "pilha_ia_no_login": sorted(m for m in %r if m in sys.modules),
+}))
+""" % (AI_MODULES,)
+
+
+def run_python(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def median(values):
+    return round(statistics.median(values), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="repetições de cada medida (mediana)")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        times = [float(run_python(IMPORT_SNIPPET.format(module=module))) for _ in range(args.runs)]
+        results[f"import_{module}"] = median(times)
+
+    runs = [json.loads(run_python(LOGIN_SNIPPET)) for _ in range(args.runs)]
+    results["login_page"] = median([r["login_page"] for r in runs])
+    results["segunda_sessao"] = median([r["segunda_sessao"] for r in runs])
+    results["login_ok"] = all(r["ok"] for r in runs)
+    results["pilha_ia_no_login"] = runs[-1]["pilha_ia_no_login"]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results.items():
+        unit = "s" if isinstance(value, float) else ""
+        print(f"{name:22s} {value}{unit}")
+
+
+if __name__ == "__main__":
+    main()
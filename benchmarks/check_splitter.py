@@ -0,0 +1,101 @@
+"""
+Verificação do fatiamento estrutural (legal_splitter.py) em informativos reais.
+
+Para cada arquivo (por padrão um informativo do TCU e um compilado e um
+informativo do TCE-ES), extrai as páginas e confere:
+  - decisão:  o número da decisão do label aparece no texto do trecho (antes,
+              as continuações herdavam a última decisão do documento);
+  - itens:    os números dos enunciados formam 1..n, sem o "1." do sumário ou
+              da ficha catalográfica cobrindo o resto do documento; nos
+              informativos do TCU há um item por referência de decisão;
+  - tamanho:  nenhum trecho abaixo de MIN_CHARS nem acima de MAX_CHARS (a
+              última parte de um enunciado longo passa um pouco de CHUNK_MAX
+              porque leva a referência inteira).
+
+Sai com código 1 se alguma verificação falhar.
+
+Uso (na raiz do repositório):
+    python benchmarks/check_splitter.py [--folder data/legislacao] [arquivo.pdf ...] [--json]
+"""
+import os
+import re
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingestion import extract_pages, file_sha256  # noqa: E402
+from legal_splitter import split_pages, _decision_refs, CHUNK_MAX  # noqa: E402
+
+DEFAULT_FILES = [
+    "tcu_informativos/2025_tcu_inf_500.pdf.pdf",
+    "tce_es_informativos/2015_tce_es_informativo_compilado.pdf.pdf",
+    "tce_es_informativos/2024_tce_es_informativo_133.pdf.pdf",
+]
+MIN_CHARS = 100
+MAX_CHARS = 2 * CHUNK_MAX
+
+
+def decision_in_text(decision, text):
+    number, year = decision.split()[-1].replace("TC-", "").split("/")
+    return re.search(rf"(?<!\d)0*{re.escape(number)}\s*/\s*{year}", text.replace(".", "")) is not None
+
+
+def check_file(rel, pages):
+    docs = split_pages(rel, pages)
+    errors = []
+    for doc in docs:
+        decision = doc.metadata.get("decisao")
+        if decision and not decision_in_text(decision, doc.page_content):
+            errors.append(f"decisão {decision} fora do trecho: {doc.page_content[-120:]!r}")
+        if not MIN_CHARS <= len(doc.page_content) <= MAX_CHARS:
+            errors.append(f"trecho com {len(doc.page_content)} caracteres: {doc.page_content[:80]!r}")
+
+    items = []
+    for doc in docs:
+        item = doc.metadata.get("item")
+        if item and item not in items:
+            items.append(item)
+    if items != [str(n) for n in range(1, len(items) + 1)]:
+        errors.append(f"itens fora de ordem: {items}")
+    refs = _decision_refs("\n".join(pages))
+    if rel.startswith("tcu_informativos") and len(items) != len(refs):
+        errors.append(f"{len(items)} itens para {len(refs)} referências de decisão")
+    return {
+        "file": rel,
+        "chunks": len(docs),
+        "labelled": sum(1 for doc in docs if doc.metadata.get("decisao")),
+        "items": len(items),
+        "refs": len(refs),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES, help="caminhos relativos à pasta da base")
+    parser.add_argument("--folder", default="data/legislacao")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args()
+
+    sources = {}
+    for rel in args.files:
+        path = os.path.join(args.folder, rel)
+        sources[rel] = (file_sha256(path), path)
+    results = [check_file(rel, pages or []) for rel, pages in sorted(extract_pages(sources, cache=False))]
+
+    if args.json:
+        print(json.dumps({"benchmark": "splitter", "results": results}))
+    else:
+        for r in results:
+            status = "ok" if not r["errors"] else f"{len(r['errors'])} erro(s)"
+            print(f"{r['file']:<60} {r['chunks']:>4} trechos  {r['labelled']:>4} com decisão  "
+                  f"{r['items']:>3} itens / {r['refs']:>3} refs  {status}")
+            for error in r["errors"][:10]:
+                print(f"    {error}")
+    sys.exit(1 if any(r["errors"] for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
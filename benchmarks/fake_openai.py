@@ -0,0 +1,189 @@
+"""
+Servidor falso compatível com a API da OpenAI, para testes e benchmarks offline.
+
+Endpoints:
+  POST /v1/embeddings        -> vetores determinísticos (derivados do hash do texto)
+  POST /v1/chat/completions  -> relatório fixo no formato do auditor, com ou sem
+                                streaming (SSE) a uma velocidade de tokens configurável
+
+Latência (geral ou por endpoint) e taxa de erros 429 configuráveis, para
+exercitar o backoff e simular uma API lenta.
+
+Uso:
+    python benchmarks/fake_openai.py --port 8765 --latency 0.2 --chat-latency 1.5 --rate-limit 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 EMBEDDINGS_BASE_URL=http://127.0.0.1:8765/v1 \
+        OPENAI_API_KEY=fake streamlit run auditor.py
+"""
+import json
+import uuid
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DIMENSIONS = 1536
+
+FAKE_REPORT = """## 🚨 Relatório de Auditoria Técnica
+
+### 1. Análise de Conformidade (Lei 14.133/21)
+Documento analisado pelo servidor falso de testes.
+
+### 2. Riscos e Irregularidades Identificadas
+- **Ponto Crítico:** Exigência de qualificação técnica sem justificativa.
+- **Fundamentação:** Art. 67 da Lei 14.133/2021 e Acórdão 1234/2024-Plenário.
+- **Recomendação:** Justificar ou retirar a exigência.
+
+### 3. Conclusão do Auditor
+Recomenda-se a correção dos pontos acima antes da publicação.
+"""
+
+
+def fake_vector(text, dimensions=DIMENSIONS):
+    """Vetor unitário determinístico: o mesmo texto sempre gera o mesmo vetor."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+        with self.server.lock:
+            self.server.counters["requests"] += 1
+        endpoint = "embedding" if self.path.rstrip("/").endswith("/embeddings") else "chat"
+        latency = config[f"{endpoint}_latency"]
+        time.sleep(config["latency"] if latency is None else latency)
+
+        if random.random() < config["rate_limit"]:
+            with self.server.lock:
+                self.server.counters["rate_limited"] += 1
+            return self._send_json(
+                429,
+                {"error": {"message": "Rate limit (fake)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                headers={"retry-after-ms": str(int(config["retry_after"] * 1000))},
+            )
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            return self._embeddings(payload)
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            return self._chat(payload)
+        self._send_json(404, {"error": {"message": f"Endpoint falso desconhecido: {self.path}"}})
+
+    def _embeddings(self, payload):
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # Entradas já tokenizadas (listas de inteiros) viram texto para o hash
+        inputs = [i if isinstance(i, str) else " ".join(map(str, i)) for i in inputs]
+        with self.server.lock:
+            self.server.counters["embedded_texts"] += len(inputs)
+        data = [
+            {"object": "embedding", "index": n, "embedding": fake_vector(text, self.server.config["dimensions"])}
+            for n, text in enumerate(inputs)
+        ]
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "fake"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    def _chat(self, payload):
+        config = self.server.config
+        tokens = FAKE_REPORT.split(" ")
+        tokens = [t + " " for t in tokens[:-1]] + tokens[-1:]
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_chars // 4 + len(tokens)}
+        with self.server.lock:
+            self.server.counters["chat_completions"] += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        base = {"id": completion_id, "created": int(time.time()), "model": payload.get("model", "fake")}
+
+        if not payload.get("stream"):
+            time.sleep(len(tokens) / config["tokens_per_second"])
+            return self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens)},
+            }]))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def event(data):
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for n, token in enumerate(tokens):
+            time.sleep(1 / config["tokens_per_second"])
+            delta = {"content": token} if n else {"role": "assistant", "content": token}
+            event(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        event(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            event(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(port=0, latency=0.0, rate_limit=0.0, retry_after=0.05, dimensions=DIMENSIONS,
+                 tokens_per_second=200.0, embedding_latency=None, chat_latency=None):
+    """
+    Sobe o servidor numa thread e retorna-o (server.server_address[1] é a porta).
+    embedding_latency/chat_latency substituem `latency` no respectivo endpoint.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {"latency": latency, "rate_limit": rate_limit, "retry_after": retry_after,
+                     "dimensions": dimensions, "tokens_per_second": tokens_per_second,
+                     "embedding_latency": embedding_latency, "chat_latency": chat_latency}
+    server.counters = {"requests": 0, "rate_limited": 0, "embedded_texts": 0, "chat_completions": 0}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por requisição")
+    parser.add_argument("--embedding-latency", type=float, help="segundos por requisição de embeddings")
+    parser.add_argument("--chat-latency", type=float, help="segundos até o início da resposta do chat")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fração de respostas 429")
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="velocidade do chat falso")
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency, args.rate_limit, dimensions=args.dimensions,
+                          tokens_per_second=args.tokens_per_second, embedding_latency=args.embedding_latency,
+                          chat_latency=args.chat_latency)
+    print(f"Servidor OpenAI falso em http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Constrói e publica o índice da base jurídica fora do app.
+
+Uso:
+    python build_index.py [--folder data/legislacao] [--index faiss_index] [--keep 3]
+
+Pode rodar no build da imagem Docker ou em produção com o app no ar: a nova
+versão só passa a valer (arquivo CURRENT) quando está completa, e o app a
+carrega no próximo processo/reinício. Ver knowledge_base.py.
+Com KB_INDEX_MODE=compact grava também o índice compacto (compact_index.py).
+"""
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from embeddings import make_embeddings
+from knowledge_base import FOLDER_PATH, INDEX_PATH, KEEP_VERSIONS, build_index, describe_changes, describe_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Constrói e publica o índice da base jurídica.")
+    parser.add_argument("--folder", default=FOLDER_PATH, help="Pasta com os PDFs de legislação")
+    parser.add_argument("--index", default=INDEX_PATH, help="Pasta do índice (versões + CURRENT)")
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="Versões mantidas em disco")
+    parser.add_argument("--workers", type=int, default=None, help="Processos para extrair texto dos PDFs")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    vectorstore, info, report = build_index(
+        make_embeddings(), args.folder, args.index, workers=args.workers, keep=max(args.keep, 1)
+    )
+    print(describe_changes(report))
+    if vectorstore is None:
+        print(f"Nenhum trecho indexado: verifique a pasta {args.folder}")
+        return 1
+    if report["published"]:
+        print(f"Publicado: {describe_index(info)} ({time.monotonic() - started:.1f}s)")
+    else:
+        print(f"Mesma base da versão ativa, nada publicado: {describe_index(info)} ({time.monotonic() - started:.1f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
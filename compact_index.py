@@ -0,0 +1,244 @@
+"""
+Modo compacto do índice (KB_INDEX_MODE=compact) para gastar menos memória por container.
+
+O índice FAISS plano guarda todos os vetores float32 em RAM e o docstore do
+langchain guarda o texto de todos os trechos. No modo compacto, build_index
+grava também, na pasta da versão:
+- compact.faiss: índice quantizado (SQ8 ou IVF-PQ), o único que fica em RAM;
+- vectors.f32: os vetores exatos, lidos por mmap só para reordenar os
+  candidatos (re-ranking) que o índice quantizado devolve;
+- chunks.jsonl + chunks.offsets.npy: texto e metadados dos trechos, lidos
+  por mmap sob demanda (chunks.ids.json: id de cada posição);
+- lexical.*: as listas invertidas do BM25 em arrays (posição do trecho e
+  frequência do termo) lidas por mmap, no lugar do lexical.pkl, que guarda
+  um Counter por trecho. Em RAM ficam só o vocabulário e as citações.
+
+CompactVectorStore expõe o que retrieval.py usa do FAISS do langchain
+(embeddings, index.search, index_to_docstore_id, docstore.search), então a
+busca não muda de um modo para o outro.
+"""
+import os
+import json
+import math
+import mmap
+import numpy as np
+import faiss
+from langchain.docstore.document import Document
+from lexical import BM25_B, BM25_K1, MAX_QUERY_TERMS, LexicalIndex, tokenize
+
+KB_INDEX_MODE = os.environ.get("KB_INDEX_MODE", "flat")  # "flat" ou "compact"
+COMPACT_FACTORY = os.environ.get("KB_COMPACT_FACTORY", "auto")  # "auto", "sq8", "ivfpq" ou string do faiss.index_factory
+COMPACT_FILE = "compact.faiss"
+VECTORS_FILE = "vectors.f32"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "chunks.offsets.npy"
+IDS_FILE = "chunks.ids.json"
+COMPACT_INFO_FILE = "compact.json"
+LEXICAL_TERMS_FILE = "lexical.terms.json"  # termo -> [início, df] nas listas; citações; soma dos tamanhos
+LEXICAL_DOCS_FILE = "lexical.docs.npy"  # Posição do trecho de cada entrada das listas invertidas
+LEXICAL_TFS_FILE = "lexical.tfs.npy"  # Frequência do termo em cada entrada
+LEXICAL_LENGTHS_FILE = "lexical.lengths.npy"  # Nº de termos de cada trecho (por posição)
+RERANK_FACTOR = 4  # Candidatos do índice quantizado por resultado pedido
+IVF_MIN_VECTORS = 10000  # Abaixo disso o IVF-PQ treina mal; "auto" usa SQ8
+PQ_MIN_VECTORS = 1000
+IVF_NPROBE = int(os.environ.get("KB_IVF_NPROBE", "16"))
+
+
+def factory_for(count, dimension, kind=COMPACT_FACTORY):
+    """String do faiss.index_factory para o tipo pedido."""
+    if kind == "auto":
+        kind = "ivfpq" if count >= IVF_MIN_VECTORS else "sq8"
+    if kind == "sq8":
+        return "SQ8"
+    if kind == "ivfpq":
+        if count < PQ_MIN_VECTORS:
+            return "SQ8"  # Poucos vetores para treinar o IVF e os 256 centróides do PQ
+        nlist = max(16, min(4096, int(4 * np.sqrt(count)), count // 39))
+        subquantizers = next(m for m in (96, 64, 48, 32, 16, 8, 4, 2, 1) if dimension % m == 0)
+        return f"IVF{nlist},PQ{subquantizers}"
+    return kind
+
+
+def write_compact(vectorstore, path, kind=COMPACT_FACTORY):
+    """Grava os arquivos do modo compacto a partir do FAISS plano já construído."""
+    count = vectorstore.index.ntotal
+    vectors = vectorstore.index.reconstruct_n(0, count).astype(np.float32)
+    factory = factory_for(count, vectors.shape[1], kind)
+    index = faiss.index_factory(vectors.shape[1], factory)
+    index.train(vectors)
+    index.add(vectors)
+    faiss.write_index(index, os.path.join(path, COMPACT_FILE))
+    vectors.tofile(os.path.join(path, VECTORS_FILE))
+
+    ids, offsets = [], [0]
+    with open(os.path.join(path, CHUNKS_FILE), "wb") as f:
+        for position in range(count):
+            doc_id = vectorstore.index_to_docstore_id[position]
+            ids.append(doc_id)
+            doc = vectorstore.docstore.search(doc_id)
+            line = json.dumps({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False)
+            f.write(line.encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+    np.save(os.path.join(path, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(path, IDS_FILE), "w", encoding="utf-8") as f:
+        json.dump(ids, f, ensure_ascii=False)
+    lexical = getattr(vectorstore, "lexical_index", None)
+    if lexical is not None:
+        write_compact_lexical(lexical, ids, path)
+    with open(os.path.join(path, COMPACT_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump({"factory": factory, "count": count, "dimension": int(vectors.shape[1])}, f)
+    return factory
+
+
+def write_compact_lexical(lexical, ids, path):
+    """Grava o índice lexical (lexical.LexicalIndex) em listas invertidas contíguas, na ordem de `ids`."""
+    positions = {doc_id: position for position, doc_id in enumerate(ids)}
+    lengths = np.zeros(len(ids), dtype=np.int32)
+    for doc_id, (length, _, _) in lexical.docs.items():
+        if doc_id in positions:
+            lengths[positions[doc_id]] = length
+    terms, docs, tfs = {}, [], []
+    for term in sorted(lexical.postings):
+        entries = sorted((positions[doc_id], tf) for doc_id, tf in lexical.postings[term].items() if doc_id in positions)
+        if entries:
+            terms[term] = [len(docs), len(entries)]
+            docs.extend(position for position, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+    citations = {
+        key: sorted(positions[doc_id] for doc_id in doc_ids if doc_id in positions)
+        for key, doc_ids in lexical.citations.items()
+    }
+    np.save(os.path.join(path, LEXICAL_DOCS_FILE), np.array(docs, dtype=np.int32))
+    np.save(os.path.join(path, LEXICAL_TFS_FILE), np.array(tfs, dtype=np.int32))
+    np.save(os.path.join(path, LEXICAL_LENGTHS_FILE), lengths)
+    with open(os.path.join(path, LEXICAL_TERMS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"terms": terms, "citations": citations, "total_length": int(lengths.sum())}, f, ensure_ascii=False)
+
+
+def has_compact(path):
+    """Versão com os arquivos do modo compacto, inclusive o índice lexical em listas invertidas."""
+    return all(os.path.exists(os.path.join(path, name)) for name in (COMPACT_INFO_FILE, LEXICAL_TERMS_FILE))
+
+
+class ChunkStore:
+    """Trechos lidos por mmap; só a posição de cada id fica em memória."""
+
+    def __init__(self, path):
+        self._file = open(os.path.join(path, CHUNKS_FILE), "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(path, IDS_FILE), encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.positions = {doc_id: position for position, doc_id in enumerate(self.ids)}
+
+    def _read(self, position):
+        return self._mmap[int(self._offsets[position]) : int(self._offsets[position + 1])]
+
+    def search(self, doc_id):
+        position = self.positions.get(doc_id)
+        if position is None:
+            return f"ID {doc_id} not found."  # Mesmo retorno do InMemoryDocstore
+        data = json.loads(self._read(position))
+        return Document(page_content=data["text"], metadata=data["metadata"])
+
+
+class CompactLexicalIndex(LexicalIndex):
+    """
+    LexicalIndex somente-leitura sobre os arquivos lexical.*: as listas
+    invertidas e os tamanhos dos trechos ficam em mmap; search() faz o mesmo
+    BM25 e lookup() é o da classe base (sobre as citações).
+    """
+
+    def __init__(self, path, ids):
+        with open(os.path.join(path, LEXICAL_TERMS_FILE), encoding="utf-8") as f:
+            data = json.load(f)
+        self.ids = ids
+        self.terms = data["terms"]
+        self.citations = {key: {ids[p] for p in positions} for key, positions in data["citations"].items()}
+        self.total_length = data["total_length"]
+        self._docs = np.load(os.path.join(path, LEXICAL_DOCS_FILE), mmap_mode="r")
+        self._tfs = np.load(os.path.join(path, LEXICAL_TFS_FILE), mmap_mode="r")
+        self._lengths = np.load(os.path.join(path, LEXICAL_LENGTHS_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, doc_id, text, source_path=""):
+        raise TypeError("CompactLexicalIndex é somente leitura")
+
+    def remove(self, doc_ids):
+        raise TypeError("CompactLexicalIndex é somente leitura")
+
+    def search(self, query, k=10):
+        """BM25: lista de (id, pontuação) em ordem decrescente."""
+        n = len(self.ids)
+        if not n:
+            return []
+        avg_length = self.total_length / n
+        idf = {}
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry:
+                idf[term] = math.log(1 + (n - entry[1] + 0.5) / (entry[1] + 0.5))
+        query_terms = sorted(idf, key=idf.get, reverse=True)[:MAX_QUERY_TERMS]
+        if not query_terms:
+            return []
+        scores = np.zeros(n)
+        for term in query_terms:
+            start, df = self.terms[term]
+            docs = self._docs[start : start + df]
+            tfs = self._tfs[start : start + df].astype(np.float64)
+            lengths = self._lengths[docs]
+            norm = tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length))
+            np.add.at(scores, docs, idf[term] * norm)
+        hits = np.flatnonzero(scores)
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(self.ids[position], float(scores[position])) for position in top]
+
+
+class RerankedIndex:
+    """Busca no índice quantizado e reordena os candidatos pela distância exata (vetores em mmap)."""
+
+    def __init__(self, index, vectors):
+        self._index = index
+        self._vectors = vectors
+        self.ntotal = index.ntotal
+        self.d = index.d
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        _, candidates = self._index.search(queries, k * RERANK_FACTOR)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, cands) in enumerate(zip(queries, candidates)):
+            cands = np.unique(cands[cands >= 0])  # ordenado: leitura sequencial no mmap
+            if not len(cands):
+                continue
+            exact = ((self._vectors[cands] - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            distances[row, : len(order)] = exact[order]
+            indices[row, : len(order)] = cands[order]
+        return distances, indices
+
+
+class CompactVectorStore:
+    """Substituto somente-leitura do FAISS do langchain para a busca (ver retrieval.py)."""
+
+    _normalize_L2 = False
+
+    def __init__(self, path, embeddings):
+        with open(os.path.join(path, COMPACT_INFO_FILE), encoding="utf-8") as f:
+            self.info = json.load(f)
+        index = faiss.read_index(os.path.join(path, COMPACT_FILE))
+        if self.info["factory"].startswith("IVF"):
+            faiss.ParameterSpace().set_index_parameter(index, "nprobe", IVF_NPROBE)
+        vectors = np.memmap(
+            os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r",
+            shape=(self.info["count"], self.info["dimension"]),
+        )
+        self.embeddings = embeddings
+        self.index = RerankedIndex(index, vectors)
+        self.docstore = ChunkStore(path)
+        self.index_to_docstore_id = dict(enumerate(self.docstore.ids))
+        if os.path.exists(os.path.join(path, LEXICAL_TERMS_FILE)):
+            self.lexical_index = CompactLexicalIndex(path, self.docstore.ids)
@@ -0,0 +1,500 @@
+"""
+Acesso ao PostgreSQL (DATABASE_URL) sem dependência do Streamlit,
+para ser usado tanto pela página quanto pelos workers em segundo plano.
+
+- Pool de conexões único por processo, compartilhado entre as sessões:
+  conn.close() devolve a conexão ao pool em vez de fechá-la, então o
+  código que já faz "conn = get_db_connection() ... conn.close()" continua igual.
+  Conexões esquecidas sem close() são recolhidas pelo coletor de lixo numa
+  fila sem lock e devolvidas ao pool no próximo acquire().
+- log_action só enfileira; uma thread grava os logs em lotes e o atexit
+  garante a gravação do que restar quando o processo termina.
+- A mesma thread move periodicamente os logs com mais de LOG_RETENTION_DAYS
+  dias para system_logs_archive, mantendo system_logs pequena; fetch_logs
+  lê qualquer uma das duas com filtros e paginação por chave (timestamp, id).
+- init_db só executa o DDL quando a versão gravada em schema_version é
+  anterior a SCHEMA_VERSION (suba a constante ao mudar o esquema). Pode ser
+  rodado no deploy com "python db.py".
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+import psycopg2
+from psycopg2.pool import PoolError
+from psycopg2.extras import execute_values
+
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = 30  # Segundos esperando uma conexão livre
+RECLAIM_INTERVAL = 1.0  # Enquanto espera, recolhe a cada tanto as conexões abandonadas
+HEALTHCHECK_AFTER = 30  # Conexão ociosa há mais que isso é testada (SELECT 1) antes do uso
+LOG_FLUSH_INTERVAL = 2.0
+LOG_BATCH_SIZE = 500
+LOG_MAX_PENDING = 10000  # Se o banco cair, guarda no máximo isso em memória
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "90"))  # Depois disso vai para o arquivo (0 = nunca)
+LOG_ARCHIVE_INTERVAL = 3600  # Segundos entre rodadas de arquivamento
+LOG_ARCHIVE_BATCH = 10000
+LOG_PAGE_SIZE = 50
+SCHEMA_VERSION = 5
+SCHEMA_LOCK_ID = 5141  # pg_advisory_xact_lock: só um processo migra por vez
+LOG_ARCHIVE_LOCK_ID = 5142  # Só um processo arquiva por vez
+LOG_TABLES = {False: "system_logs", True: "system_logs_archive"}
+
+
+# --- POOL DE CONEXÕES ---
+class PooledConnection:
+    """Conexão emprestada do pool; close() (ou o coletor de lixo) a devolve."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __del__(self):
+        # Rede de segurança para caminhos de erro que não chamam close(). O coletor
+        # pode rodar com o lock do pool tomado pela mesma thread: só enfileira
+        if self._conn is not None:
+            self._pool.abandon(self._conn)
+
+
+class ConnectionPool:
+    """
+    Pool simples: conexões abertas sob demanda (até maxconn) e mantidas
+    ociosas para reuso. Quando todas estão em uso, acquire() espera.
+    (O ThreadedConnectionPool do psycopg2 fecha tudo acima de minconn ao
+    devolver e dá erro quando esgota, em vez de esperar.)
+    """
+
+    def __init__(self, dsn, maxconn=DB_POOL_MAX):
+        self.dsn = dsn
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []  # (conexão, instante do último uso)
+        self._lock = threading.Lock()
+        self._abandoned = queue.SimpleQueue()  # put() reentrante: seguro dentro de __del__
+
+    def acquire(self):
+        deadline = time.monotonic() + DB_POOL_TIMEOUT
+        while True:
+            self._reclaim()
+            remaining = deadline - time.monotonic()
+            if self._slots.acquire(timeout=max(0, min(RECLAIM_INTERVAL, remaining))):
+                break
+            if remaining <= RECLAIM_INTERVAL:
+                raise PoolError("Pool de conexões esgotado")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return PooledConnection(self, psycopg2.connect(self.dsn))
+                conn, last_used = item
+                if self._healthy(conn, last_used):
+                    return PooledConnection(self, conn)
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < HEALTHCHECK_AFTER:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def abandon(self, conn):
+        """Conexão de um PooledConnection coletado sem close(); devolvida no próximo acquire()."""
+        self._abandoned.put(conn)
+
+    def _reclaim(self):
+        while True:
+            try:
+                conn = self._abandoned.get_nowait()
+            except queue.Empty:
+                return
+            self.release(conn)
+
+    def release(self, conn):
+        try:
+            if not conn.closed:
+                conn.rollback()  # Descarta transação deixada aberta
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        except Exception:
+            conn.close()
+        finally:
+            self._slots.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connect():
+    """Conexão do pool do processo; levanta exceção se o banco estiver fora."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(os.environ.get("DATABASE_URL"))
+    return _pool.acquire()
+
+
+def get_db_connection():
+    try:
+        return connect()
+    except Exception as e:
+        print(f"Erro ao conectar no Banco de Dados: {e}")
+        return None
+
+
+def schema_version(cur):
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    return cur.fetchone()[0] or 0
+
+
+def init_db():
+    """Cria/atualiza o esquema se necessário. Retorna False se o banco estiver fora."""
+    conn = get_db_connection()
+    if conn:
+        cur = conn.cursor()
+        if schema_version(cur) >= SCHEMA_VERSION:
+            conn.close()
+            return True
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+        if schema_version(cur) >= SCHEMA_VERSION:
+            # Outro processo migrou enquanto esperávamos o lock
+            conn.close()
+            return True
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);")
+        # Tabelas essenciais
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                username VARCHAR(50) PRIMARY KEY,
+                password VARCHAR(50) NOT NULL,
+                role VARCHAR(20) DEFAULT 'user',
+                perm_auditor BOOLEAN DEFAULT FALSE,
+                perm_gerador BOOLEAN DEFAULT FALSE,
+                perm_parecer BOOLEAN DEFAULT FALSE,
+                perm_pca BOOLEAN DEFAULT FALSE,
+                perm_recursos BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS system_logs (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50),
+                action VARCHAR(200),
+                details TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS support_tickets (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50),
+                message TEXT,
+                status VARCHAR(20) DEFAULT 'aberto',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Fila de auditorias (ver jobs.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS audit_jobs (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50),
+                doc_type VARCHAR(50),
+                filename VARCHAR(255),
+                status VARCHAR(20) DEFAULT 'pendente',
+                progress INTEGER DEFAULT 0,
+                message TEXT,
+                input_pdf BYTEA,
+                report TEXT,
+                report_docx BYTEA,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                heartbeat_at TIMESTAMP,
+                finished_at TIMESTAMP
+            );
+        """)
+        cur.execute("ALTER TABLE audit_jobs ADD COLUMN IF NOT EXISTS cache_key VARCHAR(64);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_jobs_user ON audit_jobs (username, created_at DESC);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_jobs_queue ON audit_jobs (status, created_at);")
+        # Cache de resultados (ver audit_cache.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS audit_cache (
+                cache_key VARCHAR(64) PRIMARY KEY,
+                doc_type VARCHAR(50),
+                report TEXT,
+                report_docx BYTEA,
+                size_bytes INTEGER,
+                hits INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_cache_last_hit ON audit_cache (last_hit_at DESC);")
+        # Logs: índices para a listagem paginada (ORDER BY timestamp DESC, id DESC) e os filtros,
+        # e a tabela de arquivo com os logs antigos (ver archive_logs)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS system_logs_archive (
+                id INTEGER PRIMARY KEY,
+                username VARCHAR(50),
+                action VARCHAR(200),
+                details TEXT,
+                timestamp TIMESTAMP
+            );
+        """)
+        for table in LOG_TABLES.values():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table} (timestamp, id);")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table} (username, timestamp, id);")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_action ON {table} (action, timestamp, id);")
+        # Métricas de desempenho por auditoria (ver metrics.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS audit_metrics (
+                id SERIAL PRIMARY KEY,
+                job_id INTEGER,
+                username VARCHAR(50),
+                doc_type VARCHAR(50),
+                doc_bytes INTEGER,
+                doc_pages INTEGER,
+                doc_tokens INTEGER,
+                sections INTEGER,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                cost_usd NUMERIC(10, 4),
+                ttft_s REAL,
+                cache_hit BOOLEAN DEFAULT FALSE,
+                ocr_pages INTEGER DEFAULT 0,
+                ocr_cached INTEGER DEFAULT 0,
+                stages JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_metrics_created ON audit_metrics (created_at DESC);")
+        # Auditorias em lote: cada arquivo é um job com batch_id (ver jobs.py e batch.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS audit_batches (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(50),
+                name VARCHAR(255),
+                max_workers INTEGER DEFAULT 2,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("ALTER TABLE audit_jobs ADD COLUMN IF NOT EXISTS batch_id INTEGER;")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_jobs_batch ON audit_jobs (batch_id, status);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_batches_user ON audit_batches (username, created_at DESC);")
+        # Tentativas de cada job (ficha das gravações do worker e limite de novas reservas)
+        cur.execute("ALTER TABLE audit_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;")
+        cur.execute("ALTER TABLE audit_jobs ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255);")
+        # Cria ADMIN padrão se não existir
+        cur.execute("SELECT * FROM users WHERE username = 'admin'")
+        if not cur.fetchone():
+            cur.execute("""
+                INSERT INTO users (username, password, role, perm_auditor, perm_gerador, perm_parecer, perm_pca, perm_recursos)
+                VALUES ('admin', 'admin123', 'admin', TRUE, TRUE, TRUE, TRUE, TRUE)
+            """)
+        cur.execute("INSERT INTO schema_version (version) VALUES (%s) ON CONFLICT DO NOTHING", (SCHEMA_VERSION,))
+        conn.commit()
+        cur.close()
+        conn.close()
+        return True
+    return False
+
+
+# --- LOGS EM LOTE ---
+_log_queue = queue.Queue()
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def log_action(username, action, details=""):
+    """Enfileira o log (sem esperar o banco); a gravação é feita em lotes."""
+    _log_queue.put((username, action, details))
+    _start_log_writer()
+
+
+def _start_log_writer():
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = threading.Thread(target=_log_writer_loop, name="log-writer", daemon=True)
+            _log_writer.start()
+
+
+def _log_writer_loop():
+    last_archive = None
+    while True:
+        time.sleep(LOG_FLUSH_INTERVAL)
+        flush_logs()
+        if last_archive is None or time.monotonic() - last_archive >= LOG_ARCHIVE_INTERVAL:
+            last_archive = time.monotonic()
+            archive_logs()
+
+
+def flush_logs():
+    """
+    Grava no banco todos os logs pendentes (em lotes). O timestamp é o default
+    da coluna (relógio do banco, o mesmo que archive_logs usa), não o do app.
+    """
+    while True:
+        batch = []
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        conn = get_db_connection()
+        if not conn:
+            _requeue(batch)
+            return
+        try:
+            cur = conn.cursor()
+            execute_values(
+                cur, "INSERT INTO system_logs (username, action, details) VALUES %s", batch
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"Erro ao gravar logs: {e}")
+            _requeue(batch)
+            return
+        finally:
+            conn.close()
+
+
+def _requeue(batch):
+    if _log_queue.qsize() + len(batch) <= LOG_MAX_PENDING:
+        for item in batch:
+            _log_queue.put(item)
+    else:
+        print(f"Descartando {len(batch)} logs: banco indisponível e fila cheia")
+
+
+atexit.register(flush_logs)
+
+
+# --- ARQUIVO E CONSULTA DOS LOGS ---
+def archive_logs(days=LOG_RETENTION_DAYS, batch=LOG_ARCHIVE_BATCH):
+    """
+    Move para system_logs_archive, em lotes, os logs com mais de `days` dias.
+    Se outro processo já estiver arquivando, não faz nada. Retorna quantos moveu.
+    """
+    if days <= 0:
+        return 0
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    moved = 0
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (LOG_ARCHIVE_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                break
+            cur.execute("""
+                WITH moved AS (
+                    DELETE FROM system_logs WHERE id IN (
+                        SELECT id FROM system_logs
+                        WHERE timestamp < LOCALTIMESTAMP - %s * INTERVAL '1 day'
+                        ORDER BY timestamp, id
+                        LIMIT %s
+                    )
+                    RETURNING id, username, action, details, timestamp
+                )
+                INSERT INTO system_logs_archive (id, username, action, details, timestamp)
+                SELECT id, username, action, details, timestamp FROM moved
+                ON CONFLICT (id) DO NOTHING
+            """, (days, batch))
+            count = cur.rowcount
+            conn.commit()
+            moved += count
+            if count < batch:
+                break
+    except Exception as e:
+        print(f"Erro ao arquivar logs: {e}")
+    finally:
+        conn.close()
+    return moved
+
+
+def fetch_logs(username=None, action=None, start=None, end=None, before=None, limit=LOG_PAGE_SIZE, archived=False):
+    """
+    Uma página de logs, do mais recente ao mais antigo, com filtros opcionais
+    (usuário, ação, período [start, end)). Paginação por chave: `before` é o
+    (timestamp, id) da última linha da página anterior, então qualquer página
+    custa o mesmo que a primeira. archived=True lê system_logs_archive.
+    Retorna (linhas (id, timestamp, username, action, details), há_mais).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return [], False
+    where, params = [], []
+    for condition, value in (("username = %s", username), ("action = %s", action),
+                             ("timestamp >= %s", start), ("timestamp < %s", end)):
+        if value is not None:
+            where.append(condition)
+            params.append(value)
+    if before is not None:
+        where.append("(timestamp, id) < (%s, %s)")
+        params.extend(before)
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT id, timestamp, username, action, details FROM {LOG_TABLES[archived]}"
+        + (f" WHERE {' AND '.join(where)}" if where else "")
+        + " ORDER BY timestamp DESC, id DESC LIMIT %s",
+        params + [limit + 1],
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return rows[:limit], len(rows) > limit
+
+
+def log_actions(archived=False):
+    """Ações distintas dos logs, saltando pelo índice de ação (não lê a tabela inteira)."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    table = LOG_TABLES[archived]
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH RECURSIVE actions AS (
+            (SELECT action FROM {table} WHERE action IS NOT NULL ORDER BY action LIMIT 1)
+            UNION ALL
+            SELECT (SELECT action FROM {table} WHERE action > actions.action ORDER BY action LIMIT 1)
+            FROM actions WHERE actions.action IS NOT NULL
+        )
+        SELECT action FROM actions WHERE action IS NOT NULL
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    sys.exit(0 if init_db() else 1)
@@ -0,0 +1,184 @@
+"""
+Estágio de vetorização (embeddings) com cache local e lotes concorrentes.
+
+- Cache SQLite indexado por (modelo, sha256 do texto): trecho idêntico nunca
+  é vetorizado duas vezes, seja na construção da base ou na consulta.
+- Os lotes vão para a API em paralelo (limite configurável) e, em caso de
+  limite de taxa (429) ou falha transitória, todas as threads pausam juntas
+  respeitando o Retry-After antes de tentar de novo.
+- EMBEDDINGS_BASE_URL aponta para outro servidor compatível com a OpenAI
+  (ex.: um servidor falso local para testes e benchmarks).
+"""
+import os
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+EMBEDDINGS_MODEL = os.environ.get("EMBEDDINGS_MODEL", "text-embedding-ada-002")
+EMBEDDINGS_BASE_URL = os.environ.get("EMBEDDINGS_BASE_URL")
+EMBEDDINGS_CACHE_PATH = os.environ.get("EMBEDDINGS_CACHE_PATH", ".cache/embeddings.sqlite3")
+EMBEDDINGS_CONCURRENCY = int(os.environ.get("EMBEDDINGS_CONCURRENCY", "4"))
+EMBEDDINGS_BATCH_SIZE = 100  # Trechos por requisição
+MAX_RETRIES = 6
+MAX_BACKOFF = 60.0
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# --- CACHE DE VETORES (SQLite) ---
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDINGS_CACHE_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, model, hashes):
+        """{hash: vetor} para os hashes que já estão no cache."""
+        found = {}
+        hashes = list(hashes)
+        with self._connect() as conn:
+            for i in range(0, len(hashes), 500):  # Limite de parâmetros do SQLite
+                chunk = hashes[i : i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                    [model] + chunk,
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model, items):
+        """items: lista de (hash, vetor)."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, h, array("f", vector).tobytes()) for h, vector in items],
+            )
+
+
+# --- EMBEDDINGS COM CACHE E CONCORRÊNCIA ---
+class CachedEmbeddings(Embeddings):
+    """Envolve um Embeddings do LangChain (OpenAIEmbeddings) com cache e lotes concorrentes."""
+
+    def __init__(self, base, model=EMBEDDINGS_MODEL, cache=None,
+                 batch_size=EMBEDDINGS_BATCH_SIZE, max_concurrency=EMBEDDINGS_CONCURRENCY):
+        self.base = base
+        self.model = model
+        self.cache = EmbeddingCache() if cache is None else cache
+        self.batch_size = batch_size
+        self.max_concurrency = max(1, max_concurrency)
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "embedded": 0, "requests": 0, "retries": 0}
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.cache.get_many(self.model, set(hashes)) if self.cache else {}
+        self._count("cache_hits", sum(1 for h in hashes if h in vectors))
+
+        # Textos repetidos dentro da mesma chamada também só vão uma vez
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in vectors and h not in missing:
+                missing[h] = t
+        if missing:
+            items = list(missing.items())
+            batches = [items[i : i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            if len(batches) == 1 or self.max_concurrency == 1:
+                results = [self._embed_batch(b) for b in batches]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                    results = list(pool.map(self._embed_batch, batches))
+            for result in results:
+                vectors.update(result)
+            self._count("embedded", len(missing))
+        return [vectors[h] for h in hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def _count(self, key, n=1):
+        # Chamado pelas threads dos lotes e por auditorias simultâneas: "+=" em dict não é atômico
+        with self._lock:
+            self.stats[key] += n
+
+    def _wait_pause(self):
+        delay = self._pause_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _embed_batch(self, batch):
+        """Vetoriza um lote com backoff exponencial; grava no cache assim que chega."""
+        texts = [t for h, t in batch]
+        for attempt in range(MAX_RETRIES + 1):
+            self._wait_pause()
+            try:
+                self._count("requests")
+                result = self.base.embed_documents(texts)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                self._count("retries")
+                delay = min(MAX_BACKOFF, retry_after(e) or (2 ** attempt + random.random()))
+                with self._lock:
+                    # Todas as threads esperam: insistir durante um 429 só piora
+                    self._pause_until = max(self._pause_until, time.monotonic() + delay)
+        items = [(h, vector) for (h, t), vector in zip(batch, result)]
+        if self.cache:
+            self.cache.put_many(self.model, items)
+        return dict(items)
+
+
+def retry_after(error):
+    """Segundos pedidos pelo servidor (cabeçalhos retry-after-ms / retry-after), se houver."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def make_embeddings():
+    """Embeddings da aplicação: OpenAI (ou EMBEDDINGS_BASE_URL) com cache local."""
+    kwargs = {"model": EMBEDDINGS_MODEL, "max_retries": 0}  # As novas tentativas ficam por nossa conta
+    if EMBEDDINGS_BASE_URL:
+        kwargs["openai_api_base"] = EMBEDDINGS_BASE_URL
+        kwargs["check_embedding_ctx_length"] = False  # Envia texto puro, sem tokenizar localmente
+    return CachedEmbeddings(OpenAIEmbeddings(**kwargs))
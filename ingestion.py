@@ -0,0 +1,214 @@
+"""
+Extração de texto de PDFs em paralelo, com cache de páginas em disco.
+
+Este módulo é leve de propósito (só pypdf + stdlib): os processos do pool
+o importam no 'spawn', sem carregar Streamlit/LangChain. O pool só é usado
+na construção da base (muitos arquivos); o PDF de uma auditoria é extraído
+no próprio processo, pois cada worker da fila criaria o seu pool.
+O cache é um SQLite indexado por (hash do arquivo, número da página), então
+reconstruções e re-fatiamentos da base não precisam abrir o PDF de novo.
+"""
+import os
+import io
+import sqlite3
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pypdf import PdfReader
+
+PAGE_CACHE_PATH = os.environ.get("PAGE_CACHE_PATH", ".cache/pages.sqlite3")
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+PAGES_PER_TASK = 20  # Páginas por tarefa do pool (arquivos grandes viram várias tarefas)
+MIN_PAGES_FOR_POOL = 40  # Abaixo disso, extrair no próprio processo é mais rápido
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def scan_corpus(folder_path):
+    """Varredura recursiva da pasta -> {caminho relativo: caminho no disco}."""
+    found = {}
+    for root, dirs, files in os.walk(folder_path):
+        for filename in files:
+            if filename.lower().endswith(".pdf"):
+                path = os.path.join(root, filename)
+                rel = os.path.relpath(path, folder_path).replace(os.sep, "/")
+                found[rel] = path
+    return found
+
+
+# --- CACHE DE PÁGINAS (SQLite) ---
+class PageCache:
+    def __init__(self, path=PAGE_CACHE_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    file_hash TEXT NOT NULL,
+                    page_no INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (file_hash, page_no)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    file_hash TEXT PRIMARY KEY,
+                    n_pages INTEGER NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, file_hash):
+        """Lista com o texto de cada página, ou None se o arquivo não está (completo) no cache."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT n_pages FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                "SELECT page_no, text FROM pages WHERE file_hash = ? ORDER BY page_no", (file_hash,)
+            ).fetchall()
+        if len(rows) != row[0]:
+            return None
+        return [text for page_no, text in rows]
+
+    def put(self, file_hash, pages):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (file_hash, page_no, text) VALUES (?, ?, ?)",
+                [(file_hash, i, text) for i, text in enumerate(pages)],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO files (file_hash, n_pages) VALUES (?, ?)", (file_hash, len(pages))
+            )
+
+
+# --- EXTRAÇÃO ---
+def open_pdf(source):
+    return PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def _extract_range(source, start, stop, reader=None):
+    """Tarefa do pool: extrai as páginas [start, stop) chamando extract_text uma vez por página."""
+    reader = open_pdf(source) if reader is None else reader
+    texts = []
+    for i in range(start, stop):
+        try:
+            texts.append(reader.pages[i].extract_text() or "")
+        except Exception:
+            texts.append("")
+    return start, texts
+
+
+def extract_pages(sources, workers=None, cache=None):
+    """
+    Extrai o texto, página a página, de vários PDFs.
+    sources: {chave: (sha256, caminho ou bytes)}.
+    Gera (chave, [texto da pág. 0, texto da pág. 1, ...]) à medida que cada
+    arquivo fica pronto, ou (chave, None) se o PDF não pôde ser lido.
+    Arquivos já presentes no cache de páginas não são abertos
+    (cache=False desliga o cache).
+    """
+    workers = INGEST_WORKERS if workers is None else workers
+    cache = PageCache() if cache is None else cache
+
+    # 1. O que já está no cache sai direto
+    pending = {}
+    for key, (digest, source) in sources.items():
+        pages = cache.get(digest) if cache else None
+        if pages is not None:
+            yield key, pages
+        else:
+            pending[key] = (digest, source)
+
+    # 2. Divide os arquivos restantes em faixas de páginas
+    tasks, results, readers = [], {}, {}
+    for key, (digest, source) in pending.items():
+        try:
+            readers[key] = open_pdf(source)
+            n_pages = len(readers[key].pages)
+        except Exception:
+            readers.pop(key, None)
+            yield key, None
+            continue
+        results[key] = [None] * n_pages
+        for start in range(0, n_pages, PAGES_PER_TASK):
+            tasks.append((key, source, start, min(start + PAGES_PER_TASK, n_pages)))
+    missing = {key: len(range(0, len(pages), PAGES_PER_TASK)) for key, pages in results.items()}
+
+    def finish(key):
+        pages = results.pop(key)
+        if cache:
+            cache.put(pending[key][0], pages)
+        return key, pages
+
+    for key in [k for k, n in missing.items() if n == 0]:
+        yield finish(key)  # PDF sem páginas
+
+    # 3. Executa as faixas (no próprio processo se o lote for pequeno)
+    total_pages = sum(len(pages) for pages in results.values())
+    if workers <= 1 or total_pages < MIN_PAGES_FOR_POOL:
+        for key, source, start, stop in tasks:
+            if key not in results:
+                continue
+            try:
+                # O PDF já aberto para contar as páginas: cada arquivo é lido uma vez só
+                results[key][start:stop] = _extract_range(source, start, stop, readers[key])[1]
+            except Exception:
+                results.pop(key)
+                yield key, None
+                continue
+            missing[key] -= 1
+            if missing[key] == 0:
+                yield finish(key)
+        return
+
+    readers.clear()  # Os processos do pool abrem os PDFs por conta própria
+    # 'spawn' evita fork de um servidor Streamlit com várias threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(_extract_range, source, start, stop): key for key, source, start, stop in tasks}
+        for future in as_completed(futures):
+            key = futures[future]
+            if key not in results:
+                continue  # Outra faixa deste arquivo já falhou
+            try:
+                start, texts = future.result()
+            except Exception:
+                results.pop(key)
+                yield key, None
+                continue
+            results[key][start : start + len(texts)] = texts
+            missing[key] -= 1
+            if missing[key] == 0:
+                yield finish(key)
+
+
+def pdf_bytes_to_pages(data, workers=1):
+    """
+    Texto de cada página de um PDF em memória (upload); lista vazia se não
+    puder ser lido. Por padrão no próprio processo: roda em cada worker da
+    fila de auditorias, e um pool por auditoria multiplicaria os processos.
+    """
+    for key, pages in extract_pages({0: (sha256_bytes(data), data)}, workers=workers):
+        return pages or []
+    return []
+
+
+def pdf_bytes_to_text(data, workers=1):
+    """Texto completo de um PDF em memória (upload), com as páginas separadas por quebra de linha."""
+    return "\n".join(pdf_bytes_to_pages(data, workers))
@@ -0,0 +1,360 @@
+"""
+Fila de auditorias persistida no PostgreSQL (tabela audit_jobs).
+
+A página só enfileira o PDF e acompanha o progresso; um pool de threads em
+segundo plano (AuditWorkerPool) executa as auditorias. Como o estado fica no
+banco, atualizar a página não perde o trabalho, o relatório e o .docx podem
+ser reabertos depois, e vários processos/containers podem consumir a mesma
+fila (SELECT ... FOR UPDATE SKIP LOCKED).
+
+Enquanto a auditoria roda, uma thread renova heartbeat_at; um job sem sinal
+de vida há STALE_AFTER segundos (worker morto) volta para a fila, até
+MAX_ATTEMPTS tentativas, e depois termina em 'erro'. Cada reserva incrementa
+attempts, que serve de ficha: o resultado (ou a falha) só é gravado se o job
+ainda pertence àquela tentativa, então um worker lento que perdeu o job não
+sobrescreve o de quem o reservou depois.
+
+Jobs de um lote (audit_batches, ver batch.py) saem da fila no máximo
+max_workers por vez; as reservas passam por um advisory lock, então o limite
+vale também com vários processos consumindo a fila.
+"""
+import os
+import time
+import socket
+import threading
+import traceback
+from db import get_db_connection, log_action
+
+AUDIT_WORKERS = int(os.environ.get("AUDIT_WORKERS", "4"))
+POLL_INTERVAL = 2.0  # Segundos entre consultas à fila quando ociosa
+STALE_AFTER = 600  # Job 'processando' sem sinal de vida há mais que isso volta para a fila
+HEARTBEAT_INTERVAL = 60  # Segundos entre sinais de vida durante a auditoria (bem menor que STALE_AFTER)
+MAX_ATTEMPTS = 3  # Reservas de um job abandonado antes de desistir dele
+WORKER_HOST = f"{socket.gethostname()}:{os.getpid()}"
+QUEUE_LOCK_ID = 5143  # pg_advisory_xact_lock: uma reserva por vez (respeita o limite de cada lote)
+
+ACTIVE_STATUSES = ("pendente", "processando")
+
+
+def submit_job(username, doc_type, filename, pdf_bytes, cache_key=None, batch_id=None):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO audit_jobs (username, doc_type, filename, input_pdf, message, cache_key, batch_id) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+        (username, doc_type, filename, pdf_bytes, "Na fila...", cache_key, batch_id),
+    )
+    job_id = cur.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def record_cached_job(username, doc_type, filename, report, docx_bytes, cache_key, batch_id=None):
+    """Registra como concluído um job atendido pelo cache (aparece no histórico do usuário)."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO audit_jobs (username, doc_type, filename, status, progress, message,
+                                report, report_docx, cache_key, batch_id, started_at, finished_at)
+        VALUES (%s, %s, %s, 'concluido', 100, 'Relatório recuperado do cache', %s, %s, %s, %s, NOW(), NOW())
+        RETURNING id
+    """, (username, doc_type, filename, report, docx_bytes, cache_key, batch_id))
+    job_id = cur.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def claim_next_job(worker=None):
+    """
+    Reserva o próximo job pendente (ou abandonado) para este worker, pulando
+    os lotes que já têm max_workers jobs em andamento. O job retornado traz
+    "attempt", a ficha exigida por heartbeat, update_progress, finish_job e
+    fail_job.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cur = conn.cursor()
+    # Sem o lock, duas reservas simultâneas poderiam ver o mesmo número de jobs do lote em andamento
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (QUEUE_LOCK_ID,))
+    # Abandonado de novo depois da última tentativa: desiste em vez de reservar para sempre
+    cur.execute("""
+        UPDATE audit_jobs
+        SET status = 'erro', message = NULL, input_pdf = NULL, finished_at = NOW(),
+            error = 'Auditoria interrompida ' || attempts || ' vezes (worker sem resposta). Envie o documento novamente.'
+        WHERE status = 'processando' AND heartbeat_at < NOW() - %s * INTERVAL '1 second' AND attempts >= %s
+    """, (STALE_AFTER, MAX_ATTEMPTS))
+    cur.execute("""
+        UPDATE audit_jobs
+        SET status = 'processando', progress = 0, report = NULL, started_at = NOW(), heartbeat_at = NOW(),
+            attempts = attempts + 1, claimed_by = %s
+        WHERE id = (
+            SELECT j.id FROM audit_jobs j
+            LEFT JOIN audit_batches b ON b.id = j.batch_id
+            WHERE (j.status = 'pendente'
+                   OR (j.status = 'processando' AND j.heartbeat_at < NOW() - %s * INTERVAL '1 second'))
+              AND (b.id IS NULL OR b.max_workers > (
+                  SELECT COUNT(*) FROM audit_jobs r
+                  WHERE r.batch_id = b.id AND r.status = 'processando'
+                    AND r.heartbeat_at >= NOW() - %s * INTERVAL '1 second'
+              ))
+            ORDER BY j.created_at, j.id
+            LIMIT 1
+            FOR UPDATE OF j SKIP LOCKED
+        )
+        RETURNING id, username, doc_type, filename, input_pdf, cache_key, attempts, batch_id
+    """, (worker or WORKER_HOST, STALE_AFTER, STALE_AFTER))
+    row = cur.fetchone()
+    conn.commit()
+    conn.close()
+    if not row:
+        return None
+    return {"id": row[0], "username": row[1], "doc_type": row[2], "filename": row[3], "pdf": bytes(row[4]),
+            "cache_key": row[5], "attempt": row[6], "batch_id": row[7]}
+
+
+# Condição das gravações do worker: o job ainda está com a tentativa que ele reservou
+OWNED = "id = %s AND status = 'processando' AND attempts = %s"
+
+
+def heartbeat(job_id, attempt):
+    """Renova o sinal de vida. False se o job não pertence mais a esta tentativa."""
+    conn = get_db_connection()
+    if not conn:
+        return True  # Banco fora: tenta de novo no próximo ciclo
+    cur = conn.cursor()
+    cur.execute(f"UPDATE audit_jobs SET heartbeat_at = NOW() WHERE {OWNED}", (job_id, attempt))
+    owned = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return owned
+
+
+def update_progress(job_id, attempt, progress, message, partial=None):
+    """Grava o andamento; partial é o relatório parcial enquanto o LLM escreve."""
+    conn = get_db_connection()
+    if conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE audit_jobs SET progress = %s, message = %s, report = COALESCE(%s, report), "
+            f"heartbeat_at = NOW() WHERE {OWNED}",
+            (progress, message, partial, job_id, attempt),
+        )
+        conn.commit()
+        conn.close()
+
+
+def finish_job(job_id, attempt, report, docx_bytes):
+    """Grava o resultado. False se o job foi reservado de novo (ou já terminou) e o resultado foi descartado."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cur = conn.cursor()
+    # O PDF de entrada não é mais necessário: libera espaço
+    cur.execute(f"""
+        UPDATE audit_jobs
+        SET status = 'concluido', progress = 100, message = 'Análise Concluída!',
+            report = %s, report_docx = %s, input_pdf = NULL, finished_at = NOW()
+        WHERE {OWNED}
+    """, (report, docx_bytes, job_id, attempt))
+    finished = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return finished
+
+
+def fail_job(job_id, attempt, error):
+    """Grava a falha. False se o job não pertence mais a esta tentativa."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE audit_jobs
+        SET status = 'erro', message = NULL, error = %s, input_pdf = NULL, finished_at = NOW()
+        WHERE {OWNED}
+    """, (error, job_id, attempt))
+    failed = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return failed
+
+
+JOB_COLUMNS = "id, doc_type, filename, status, progress, message, error, created_at, finished_at"
+
+
+def _job_dict(row):
+    keys = [c.strip() for c in JOB_COLUMNS.split(",")]
+    return dict(zip(keys, row))
+
+
+def list_jobs(username, limit=20):
+    """Últimos jobs do usuário (sem relatório/.docx, para a listagem ser leve)."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT {JOB_COLUMNS} FROM audit_jobs WHERE username = %s ORDER BY created_at DESC LIMIT %s",
+        (username, limit),
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return [_job_dict(r) for r in rows]
+
+
+def get_job(job_id, username, with_result=False):
+    """Estado de um job do usuário; with_result inclui relatório e .docx."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cur = conn.cursor()
+    columns = JOB_COLUMNS + (", report, report_docx" if with_result else "")
+    cur.execute(f"SELECT {columns} FROM audit_jobs WHERE id = %s AND username = %s", (job_id, username))
+    row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+    job = _job_dict(row)
+    if with_result:
+        job["report"] = row[-2]
+        job["report_docx"] = bytes(row[-1]) if row[-1] is not None else None
+    return job
+
+
+# --- LOTES ---
+def create_batch(username, name, max_workers):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO audit_batches (username, name, max_workers) VALUES (%s, %s, %s) RETURNING id",
+        (username, name, max_workers),
+    )
+    batch_id = cur.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return batch_id
+
+
+def list_batches(username, limit=10):
+    """Últimos lotes do usuário com a contagem de jobs por situação."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT b.id, b.name, b.max_workers, b.created_at, COUNT(j.id),
+               COUNT(j.id) FILTER (WHERE j.status = 'concluido'), COUNT(j.id) FILTER (WHERE j.status = 'erro')
+        FROM audit_batches b LEFT JOIN audit_jobs j ON j.batch_id = b.id
+        WHERE b.username = %s
+        GROUP BY b.id ORDER BY b.created_at DESC LIMIT %s
+    """, (username, limit))
+    rows = cur.fetchall()
+    conn.close()
+    keys = ["id", "name", "max_workers", "created_at", "total", "done", "failed"]
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def batch_jobs(batch_id, username, with_result=False):
+    """Jobs do lote, na ordem de envio; with_result inclui relatório e .docx (para o consolidado e o ZIP)."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cur = conn.cursor()
+    columns = JOB_COLUMNS + (", report, report_docx" if with_result else "")
+    cur.execute(
+        f"SELECT {columns} FROM audit_jobs WHERE batch_id = %s AND username = %s ORDER BY id",
+        (batch_id, username),
+    )
+    rows = cur.fetchall()
+    conn.close()
+    jobs = []
+    for row in rows:
+        job = _job_dict(row)
+        if with_result:
+            job["report"] = row[-2]
+            job["report_docx"] = bytes(row[-1]) if row[-1] is not None else None
+        jobs.append(job)
+    return jobs
+
+
+# --- WORKERS ---
+class AuditWorkerPool:
+    """
+    Threads que consomem a fila. handler(job, progress) executa a auditoria
+    e retorna (relatório, bytes do .docx); progress(pct, mensagem, parcial)
+    grava o andamento (e o relatório parcial) no banco. Exceções com atributo user_message=True (ex.:
+    audit.AuditError) são guardadas só com a mensagem, sem traceback.
+    """
+
+    def __init__(self, handler, workers=AUDIT_WORKERS):
+        self.handler = handler
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"audit-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def notify(self):
+        """Acorda os workers logo após um novo envio (sem esperar o próximo ciclo)."""
+        self._wakeup.set()
+
+    def _run(self):
+        worker = f"{WORKER_HOST}:{threading.current_thread().name}"
+        while True:
+            try:
+                job = claim_next_job(worker)
+            except Exception as e:
+                print(f"Erro ao consultar fila de auditorias: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _heartbeats(self, job, done):
+        """Thread que mantém o job vivo enquanto o handler roda (etapas longas não chamam progress)."""
+        while not done.wait(HEARTBEAT_INTERVAL):
+            try:
+                if not heartbeat(job["id"], job["attempt"]):
+                    print(f"Job {job['id']} foi reservado por outro worker (tentativa {job['attempt']} perdida)")
+                    return
+            except Exception as e:
+                print(f"Erro ao renovar job {job['id']}: {e}")
+
+    def _process(self, job):
+        def progress(pct, message, partial=None):
+            update_progress(job["id"], job["attempt"], pct, message, partial)
+
+        done = threading.Event()
+        threading.Thread(target=self._heartbeats, args=(job, done), name=f"heartbeat-{job['id']}", daemon=True).start()
+        started = time.monotonic()
+        try:
+            report, docx_bytes = self.handler(job, progress)
+        except Exception as e:
+            if getattr(e, "user_message", False):
+                fail_job(job["id"], job["attempt"], str(e))
+            else:
+                traceback.print_exc()
+                fail_job(job["id"], job["attempt"], f"Erro técnico: {e}")
+            return
+        finally:
+            done.set()
+        if not finish_job(job["id"], job["attempt"], report, docx_bytes):
+            print(f"Resultado do job {job['id']} descartado: o job não pertence mais a esta tentativa")
+            return
+        log_action(job["username"], "AUDITORIA", f"Doc: {job['doc_type']} ({time.monotonic() - started:.0f}s)")
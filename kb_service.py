@@ -0,0 +1,252 @@
+"""
+Serviço de busca da base jurídica, compartilhado entre processos e réplicas do app.
+
+Sem ele, cada processo do Streamlit carrega a sua cópia do índice
+(load_knowledge_base). Com KB_SERVICE_URL definido, o app usa um KBClient:
+um único processo (python kb_service.py) carrega o índice publicado (de
+preferência no modo compacto, com vetores e textos em mmap, ver
+compact_index.py) e responde às buscas em lote por HTTP. Cada chamada leva
+todas as janelas de consulta de um documento e devolve, numa só resposta,
+os rankings denso e lexicais que retrieval.py funde localmente.
+
+Se o serviço não responder, o KBClient passa a usar o índice local
+(fallback), carregado na primeira falha.
+
+Uso:
+    python kb_service.py [--host 127.0.0.1] [--port 8600] [--index faiss_index]
+    KB_SERVICE_URL=http://127.0.0.1:8600 streamlit run auditor.py
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain.docstore.document import Document
+
+KB_SERVICE_URL = os.environ.get("KB_SERVICE_URL")  # Vazio = índice no próprio processo
+KB_SERVICE_TOKEN = os.environ.get("KB_SERVICE_TOKEN")  # Opcional: exigido no cabeçalho Authorization
+KB_SERVICE_TIMEOUT = float(os.environ.get("KB_SERVICE_TIMEOUT", "30"))
+KB_SERVICE_PORT = 8600
+KB_INFO_TTL = float(os.environ.get("KB_INFO_TTL", "30"))  # Segundos até reler /info (o serviço pode trocar de versão)
+
+
+def _documents(payload):
+    return {doc_id: Document(page_content=d["text"], metadata=d["metadata"]) for doc_id, d in payload.items()}
+
+
+# --- CLIENTE ---
+class KBClient:
+    """
+    Base jurídica remota para retrieval.py (remote=True): search() e lookup()
+    vão ao serviço; fallback() devolve o vectorstore local usado se ele cair.
+    """
+
+    remote = True
+
+    def __init__(self, url=KB_SERVICE_URL, fallback=None, token=KB_SERVICE_TOKEN, timeout=KB_SERVICE_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self._fallback = fallback
+        self._local = None
+        self._lock = threading.Lock()
+        self._kb_version = None  # Versão da última resposta do serviço (chave do cache de busca)
+        self._version_read = False
+        self._info = None  # (instante da leitura, metadados)
+
+    @property
+    def kb_version(self):
+        """
+        Versão da base usada na chave do cache de busca: a da última resposta
+        do serviço ou, antes da primeira busca, a publicada em /info (lida uma
+        vez só), para que já o primeiro lote de resultados entre no cache.
+        """
+        if self._kb_version is None and not self._version_read:
+            self._version_read = True
+            try:
+                self._kb_version = self.info().get("kb_version")
+            except (OSError, ValueError) as e:
+                print(f"Erro ao ler a versão da base jurídica ({self.url}): {e}")
+        return self._kb_version
+
+    @kb_version.setter
+    def kb_version(self, value):
+        self._kb_version = value
+
+    def _request(self, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def info(self, max_age=KB_INFO_TTL):
+        """
+        Metadados da versão publicada que o serviço carregou (os mesmos de
+        load_index), relidos do serviço a cada max_age segundos.
+        """
+        cached = self._info
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        info = self._request("/info")
+        self._info = (time.monotonic(), info)
+        return info
+
+    def local(self):
+        """Vectorstore local (carregado uma vez, na primeira falha do serviço)."""
+        with self._lock:
+            if self._local is None:
+                if self._fallback is None:
+                    raise RuntimeError("Serviço da base jurídica indisponível e sem fallback local")
+                print("Serviço da base jurídica indisponível: carregando o índice local")
+                self._local = self._fallback()
+            return self._local
+
+    def search(self, queries, k):
+        """Para cada consulta: (ranking denso, [rankings lexicais]) de (id, Document)."""
+        from retrieval import search_batch, lexical_batch
+
+        try:
+            result = self._request("/search", {"queries": queries, "k": k})
+            docs = _documents(result["docs"])
+            dense = [[(doc_id, docs[doc_id]) for doc_id in ids] for ids in result["dense"]]
+            lexical = [[[(doc_id, docs[doc_id]) for doc_id in ids] for ids in lists] for lists in result["lexical"]]
+        except (OSError, ValueError, KeyError) as e:
+            # Serviço fora do ar, resposta que não é JSON ou sem os campos esperados
+            print(f"Erro no serviço da base jurídica ({self.url}): {e}")
+            local = self.local()
+            self.kb_version = getattr(local, "kb_version", None)
+            return search_batch(local, queries, k), lexical_batch(local, queries, k)
+        self.kb_version = result.get("kb_version")
+        return dense, lexical
+
+    def lookup(self, text, k):
+        from retrieval import lookup_citation
+
+        try:
+            result = self._request("/lookup", {"text": text, "k": k})
+            docs = _documents(result["docs"])
+            return [docs[doc_id] for doc_id in result["ids"]]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Erro no serviço da base jurídica ({self.url}): {e}")
+            return lookup_citation(self.local(), text, k)
+
+
+# --- SERVIDOR ---
+class KBServiceHandler(BaseHTTPRequestHandler):
+    server_version = "LiciKB/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = self.server.token
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}")
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send_json(401, {"error": "não autorizado"})
+        if self.path.rstrip("/") in ("/info", "/health"):
+            return self._send_json(200, self.server.info)
+        self._send_json(404, {"error": f"caminho desconhecido: {self.path}"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send_json(401, {"error": "não autorizado"})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.rstrip("/") == "/search":
+                return self._send_json(200, self._search(payload["queries"], int(payload.get("k", 10))))
+            if self.path.rstrip("/") == "/lookup":
+                return self._send_json(200, self._lookup(payload["text"], int(payload.get("k", 10))))
+        except (KeyError, ValueError) as e:
+            return self._send_json(400, {"error": f"requisição inválida: {e}"})
+        except Exception as e:
+            print(f"Erro no serviço da base jurídica: {e}")
+            return self._send_json(500, {"error": str(e)})
+        self._send_json(404, {"error": f"caminho desconhecido: {self.path}"})
+
+    def _search(self, queries, k):
+        from retrieval import search_batch, lexical_batch
+
+        vectorstore = self.server.vectorstore
+        dense = search_batch(vectorstore, queries, k)
+        lexical = lexical_batch(vectorstore, queries, k)
+        # Cada trecho vai uma vez só; os rankings levam apenas os ids
+        docs = {}
+        for hits in dense + [hits for lists in lexical for hits in lists]:
+            for doc_id, doc in hits:
+                docs[doc_id] = {"text": doc.page_content, "metadata": doc.metadata}
+        return {
+            "kb_version": self.server.info.get("kb_version"),
+            "docs": docs,
+            "dense": [[doc_id for doc_id, _ in hits] for hits in dense],
+            "lexical": [[[doc_id for doc_id, _ in hits] for hits in lists] for lists in lexical],
+        }
+
+    def _lookup(self, text, k):
+        vectorstore = self.server.vectorstore
+        lexical = getattr(vectorstore, "lexical_index", None)
+        ids = lexical.lookup(text)[:k] if lexical is not None else []
+        docs = {}
+        for doc_id in ids:
+            doc = vectorstore.docstore.search(doc_id)
+            docs[doc_id] = {"text": doc.page_content, "metadata": doc.metadata}
+        return {"ids": ids, "docs": docs}
+
+
+def serve(vectorstore, info, host="127.0.0.1", port=KB_SERVICE_PORT, token=KB_SERVICE_TOKEN):
+    """Sobe o serviço numa thread e retorna o servidor (server.server_address[1] é a porta)."""
+    server = ThreadingHTTPServer((host, port), KBServiceHandler)
+    server.daemon_threads = True
+    server.vectorstore = vectorstore
+    server.info = info
+    server.token = token
+    threading.Thread(target=server.serve_forever, name="kb-service", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from embeddings import make_embeddings
+    from knowledge_base import INDEX_PATH, describe_index, load_index
+
+    parser = argparse.ArgumentParser(description="Serviço de busca da base jurídica.")
+    parser.add_argument("--host", default=os.environ.get("KB_SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("KB_SERVICE_PORT", KB_SERVICE_PORT)))
+    parser.add_argument("--index", default=INDEX_PATH, help="Pasta do índice (versões + CURRENT)")
+    args = parser.parse_args(argv)
+
+    vectorstore, info = load_index(make_embeddings(), args.index)
+    if vectorstore is None:
+        print(f"Nenhum índice publicado em {args.index}: rode build_index.py antes")
+        return 1
+    server = serve(vectorstore, info, args.host, args.port)
+    print(f"Base Jurídica em http://{args.host}:{server.server_address[1]} ({describe_index(info)})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+"""
+Base de conhecimento jurídica (FAISS) com reconstrução incremental.
+
+O manifesto (manifest.json, salvo junto do índice) guarda, para cada PDF de
+data/legislacao, o hash do conteúdo, o mtime e os IDs dos trechos gravados
+no FAISS. Numa reconstrução só os arquivos novos ou alterados são lidos e
+vetorizados; os vetores de arquivos removidos são apagados do índice.
+
+O índice é construído fora do app (build_index.py) e publicado em versões:
+faiss_index/versions/<data>-<kb_version>-<sufixo>/ com os arquivos do índice e um
+build.json com os metadados do corpus, e faiss_index/CURRENT com o nome da
+versão ativa. A nova versão é montada numa pasta temporária e CURRENT só é
+trocado (os.replace) no fim, então o app nunca lê um índice pela metade.
+Com KB_INDEX_MODE=compact a versão inclui também o índice quantizado e o
+armazenamento de trechos em mmap (compact_index.py), e o app carrega só esses.
+
+Os trechos seguem a estrutura dos documentos (artigos, enunciados; ver
+legal_splitter.py). A versão do fatiamento fica no manifesto: se ela mudar,
+a base inteira é refatiada (as páginas saem do cache de ingestão e trechos
+com o mesmo texto, do cache de embeddings).
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime
+from langchain_community.vectorstores import FAISS
+from ingestion import extract_pages, file_sha256, scan_corpus
+from ocr import blank_pages, fill_blank_pages, ocr_available
+from lexical import LEXICAL_FILE, LexicalIndex, build_from_docstore
+from compact_index import KB_INDEX_MODE, CompactVectorStore, has_compact, write_compact
+from legal_splitter import SPLITTER_VERSION, split_pages
+
+INDEX_PATH = "faiss_index"
+FOLDER_PATH = "data/legislacao"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+EMBED_WINDOW = 2000  # Trechos vetorizados por vez (limita a memória dos vetores em lista)
+KB_OCR = os.environ.get("KB_OCR", "1") == "1"  # OCR das páginas digitalizadas ao indexar
+KB_OCR_TIME_LIMIT = float(os.environ.get("KB_OCR_TIME_LIMIT", "900"))  # Segundos por arquivo
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+BUILD_INFO_FILE = "build.json"
+ARTIFACT_FILES = ("index.faiss", "index.pkl", LEXICAL_FILE, MANIFEST_FILE)
+KEEP_VERSIONS = 3  # Versões mantidas em disco (a ativa + anteriores, para voltar atrás)
+STAGING_MAX_AGE = 24 * 3600  # Pastas temporárias de builds interrompidos são apagadas depois disso
+
+
+def load_manifest(index_path):
+    try:
+        with open(os.path.join(index_path, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    if manifest.get("splitter") != SPLITTER_VERSION:
+        print(f"Fatiamento mudou ({manifest.get('splitter')} -> {SPLITTER_VERSION}): refatiando a base")
+        return None
+    return manifest
+
+
+def save_manifest(index_path, manifest):
+    path = os.path.join(index_path, MANIFEST_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def plan_changes(files, manifest_files):
+    """
+    Compara os PDFs da pasta com o manifesto.
+    O hash só é recalculado quando tamanho ou mtime mudaram.
+    Retorna (a_indexar, removidos, inalterados, tocados): a_indexar é uma lista
+    de (rel, caminho, sha256, os.stat); inalterados conta os arquivos mantidos e
+    tocados os que só tiveram o mtime atualizado no manifesto.
+    """
+    to_index, unchanged, touched = [], 0, 0
+    for rel, path in sorted(files.items()):
+        stat = os.stat(path)
+        entry = manifest_files.get(rel)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            unchanged += 1
+            continue
+        digest = file_sha256(path)
+        if entry and entry["sha256"] == digest:
+            # Só o mtime mudou (cópia, checkout do git...): nada a vetorizar
+            entry["mtime"] = stat.st_mtime
+            unchanged += 1
+            touched += 1
+            continue
+        to_index.append((rel, path, digest, stat))
+    removed = sorted(rel for rel in manifest_files if rel not in files)
+    return to_index, removed, unchanged, touched
+
+
+def update_knowledge_base(embeddings, folder_path=FOLDER_PATH, index_path=INDEX_PATH, workers=None):
+    """
+    Carrega o índice salvo e o sincroniza com a pasta de legislação.
+    Retorna (vectorstore, relatório). O relatório lista os arquivos
+    adicionados, alterados e removidos e quantos trechos entraram/saíram.
+    O índice lexical/citações (lexical.py) é mantido junto, sobre os mesmos
+    trechos, e fica disponível em vectorstore.lexical_index.
+    """
+    report = {
+        "kb_version": None,
+        "full_rebuild": False,
+        "added": [],
+        "changed": [],
+        "removed": [],
+        "unchanged": 0,
+        "chunks_added": 0,
+        "chunks_removed": 0,
+        "failed": [],
+    }
+
+    # 1. Tenta carregar índice + manifesto do disco (Rápido)
+    vectorstore = None
+    manifest = load_manifest(index_path)
+    if manifest is not None:
+        try:
+            vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        except Exception as e:
+            print(f"Índice FAISS ilegível, reconstruindo do zero: {e}")
+            manifest = None
+    if manifest is None:
+        # Sem manifesto (índice antigo, corrompido ou inexistente): reconstrução completa
+        manifest = {"version": MANIFEST_VERSION, "splitter": SPLITTER_VERSION, "files": {}}
+        report["full_rebuild"] = True
+    lexical = LexicalIndex.load(index_path) if vectorstore is not None else LexicalIndex()
+    lexical_rebuilt = lexical is None
+    if lexical_rebuilt:
+        # Índice de antes do BM25: monta a partir dos trechos salvos, sem novos embeddings
+        lexical = build_from_docstore(vectorstore)
+
+    if not os.path.exists(folder_path):
+        report["kb_version"] = manifest_version(manifest)
+        if vectorstore is not None:
+            vectorstore.lexical_index = lexical
+        return vectorstore, report
+
+    # 2. Descobre o que mudou desde a última construção
+    files = scan_corpus(folder_path)
+    old_files = manifest["files"]
+    to_index, removed, report["unchanged"], touched = plan_changes(files, old_files)
+    dirty = report["full_rebuild"] or lexical_rebuilt or bool(to_index or removed or touched)
+
+    # 3. Remove os vetores de arquivos apagados ou alterados
+    stale_ids = []
+    for rel in removed:
+        stale_ids.extend(old_files.pop(rel)["chunk_ids"])
+        report["removed"].append(rel)
+    for rel, path, digest, stat in to_index:
+        if rel in old_files:
+            stale_ids.extend(old_files[rel]["chunk_ids"])
+            report["changed"].append(rel)
+        else:
+            report["added"].append(rel)
+    if stale_ids and vectorstore is not None:
+        vectorstore.delete(stale_ids)
+        lexical.remove(stale_ids)
+        report["chunks_removed"] = len(stale_ids)
+
+    # 4. Lê (em paralelo, com cache de páginas) e fatia só os arquivos novos/alterados
+    splits, ids = [], []
+    sources = {rel: (digest, path) for rel, path, digest, stat in to_index}
+    stats = {rel: stat for rel, path, digest, stat in to_index}
+
+    def add_file(rel, pages):
+        if pages is None:
+            # Fora do manifesto: a próxima construção tenta ler o arquivo de novo
+            print(f"Erro ao ler arquivo: {rel}")
+            old_files.pop(rel, None)
+            report["failed"].append(rel)
+            return
+        file_splits = split_pages(rel, pages)
+        chunk_ids = [f"{rel}#{i}" for i in range(len(file_splits))]
+        splits.extend(file_splits)
+        ids.extend(chunk_ids)
+        stat = stats[rel]
+        old_files[rel] = {
+            "sha256": sources[rel][0],
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunk_ids": chunk_ids,
+        }
+
+    scanned = []
+    use_ocr = KB_OCR and ocr_available()
+    for rel, pages in extract_pages(sources, workers=workers):
+        if use_ocr and pages and blank_pages(pages):
+            scanned.append((rel, pages))  # OCR depois, sem disputar CPU com o pool de extração
+        else:
+            add_file(rel, pages)
+    for rel, pages in scanned:
+        pages, ocr_stats = fill_blank_pages(sources[rel][1], pages, time_limit=KB_OCR_TIME_LIMIT)
+        print(f"OCR {rel}: {ocr_stats['recognized']} páginas reconhecidas, {ocr_stats['cached']} do cache"
+              + (" (tempo esgotado)" if ocr_stats["timed_out"] else ""))
+        add_file(rel, pages)
+
+    # 5. Vetoriza em janelas; dentro de cada janela os lotes vão em paralelo
+    #    e trechos já vetorizados saem do cache (ver embeddings.py)
+    for i in range(0, len(splits), EMBED_WINDOW):
+        window, window_ids = splits[i : i + EMBED_WINDOW], ids[i : i + EMBED_WINDOW]
+        texts = [doc.page_content for doc in window]
+        metadatas = [doc.metadata for doc in window]
+        vectors = embeddings.embed_documents(texts)
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(
+                list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=window_ids
+            )
+        else:
+            vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=window_ids)
+        for doc_id, text, metadata in zip(window_ids, texts, metadatas):
+            lexical.add(doc_id, text, metadata["path"])
+    report["chunks_added"] = len(splits)
+
+    report["kb_version"] = manifest_version(manifest)
+    if vectorstore is None:
+        return None, report
+    vectorstore.lexical_index = lexical
+    if dirty:
+        vectorstore.save_local(index_path)
+        lexical.save(index_path)
+        save_manifest(index_path, manifest)
+    if vectorstore.index.ntotal == 0:
+        return None, report
+    return vectorstore, report
+
+
+def manifest_version(manifest):
+    """Versão da base: hash do conteúdo indexado (muda quando algum PDF entra, sai ou muda, ou o fatiamento muda)."""
+    items = sorted((rel, entry["sha256"]) for rel, entry in manifest["files"].items())
+    if manifest.get("splitter"):
+        items.append(("splitter", manifest["splitter"]))
+    return hashlib.sha256(json.dumps(items).encode("utf-8")).hexdigest()[:12]
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def published_path(index_path=INDEX_PATH):
+    """
+    Pasta do índice publicado: a versão apontada por CURRENT ou, para
+    índices gerados antes das versões, a própria index_path. None se não houver.
+    """
+    try:
+        with open(os.path.join(index_path, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        name = ""
+    if name:
+        path = os.path.join(index_path, VERSIONS_DIR, name)
+        if os.path.exists(os.path.join(path, BUILD_INFO_FILE)):
+            return path
+        print(f"Versão publicada '{name}' ausente ou incompleta")
+    if load_manifest(index_path) is not None:
+        return index_path
+    return None
+
+
+def load_build_info(path):
+    """Metadados da versão (build.json); para o layout antigo, montados a partir do manifesto."""
+    try:
+        with open(os.path.join(path, BUILD_INFO_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    manifest = load_manifest(path)
+    if manifest is None:
+        return None
+    return {"version": None, "kb_version": manifest_version(manifest), "built_at": None,
+            "files": len(manifest["files"]), "chunks": None}
+
+
+def load_index(embeddings, index_path=INDEX_PATH):
+    """
+    Só carrega o índice já publicado: não lê PDFs nem chama a API de embeddings.
+    Retorna (vectorstore, metadados da versão) ou (None, None) se não houver índice pronto.
+    """
+    path = published_path(index_path)
+    if path is None:
+        return None, None
+    try:
+        if KB_INDEX_MODE == "compact" and has_compact(path):
+            vectorstore = CompactVectorStore(path, embeddings)
+        else:
+            vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    except Exception as e:
+        print(f"Erro ao carregar o índice publicado ({path}): {e}")
+        return None, None
+    if getattr(vectorstore, "lexical_index", None) is None:
+        # O modo compacto já traz o índice lexical em mmap; no plano vem do lexical.pkl
+        vectorstore.lexical_index = LexicalIndex.load(path) or build_from_docstore(vectorstore)
+    info = load_build_info(path)
+    vectorstore.kb_version = info["kb_version"] if info else None  # Chave do cache de busca (retrieval.QueryCache)
+    return vectorstore, info
+
+
+def build_index(embeddings, folder_path=FOLDER_PATH, index_path=INDEX_PATH, workers=None, keep=KEEP_VERSIONS):
+    """
+    Gera uma nova versão do índice a partir da versão publicada (atualização
+    incremental numa cópia) e a publica trocando CURRENT. Se o kb_version é o
+    da versão ativa, ela é mantida (report["published"] = False). Retorna
+    (vectorstore, metadados da versão, relatório); o vectorstore é sempre o
+    FAISS plano, mesmo no modo compacto: o compacto vem de load_index.
+    """
+    versions = os.path.join(index_path, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    source = published_path(index_path)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=versions)
+    try:
+        if source:
+            for name in ARTIFACT_FILES:
+                if os.path.exists(os.path.join(source, name)):
+                    shutil.copy2(os.path.join(source, name), staging)
+        vectorstore, report = update_knowledge_base(embeddings, folder_path, staging, workers)
+        report["published"] = False
+        if vectorstore is None:
+            return None, None, report
+        current_info = load_build_info(source) if source else None
+        unchanged = (
+            current_info is not None
+            and source != index_path
+            and current_info.get("kb_version") == report["kb_version"]
+            and os.path.exists(os.path.join(source, LEXICAL_FILE))
+            and (KB_INDEX_MODE != "compact" or has_compact(source))
+        )
+        if unchanged:
+            vectorstore.kb_version = current_info["kb_version"]
+            return vectorstore, current_info, report
+        compact_factory = write_compact(vectorstore, staging) if KB_INDEX_MODE == "compact" else None
+
+        built_at = datetime.now()
+        # O sufixo aleatório do mkdtemp evita colisão entre dois builds no mesmo segundo
+        suffix = os.path.basename(staging)[len(".staging-"):]
+        info = {
+            "version": f"{built_at:%Y%m%d-%H%M%S}-{report['kb_version']}-{suffix}",
+            "kb_version": report["kb_version"],
+            "built_at": built_at.isoformat(timespec="seconds"),
+            "folder": folder_path,
+            "files": len(load_manifest(staging)["files"]),
+            "chunks": vectorstore.index.ntotal,
+            "embeddings_model": getattr(embeddings, "model", None),
+            "splitter": SPLITTER_VERSION,
+            "compact_index": compact_factory,
+            "report": report,
+        }
+        _write_json(os.path.join(staging, BUILD_INFO_FILE), info)
+        os.rename(staging, os.path.join(versions, info["version"]))
+        staging = None
+        # Publicação atômica: quem ler CURRENT vê a versão antiga ou a nova
+        current = os.path.join(index_path, CURRENT_FILE)
+        with open(current + ".tmp", "w", encoding="utf-8") as f:
+            f.write(info["version"])
+        os.replace(current + ".tmp", current)
+        prune_versions(index_path, keep)
+        report["published"] = True
+        vectorstore.kb_version = info["kb_version"]
+        return vectorstore, info, report
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def prune_versions(index_path=INDEX_PATH, keep=KEEP_VERSIONS):
+    """Apaga versões antigas (mantendo as `keep` mais recentes e a ativa) e restos de builds interrompidos."""
+    versions = os.path.join(index_path, VERSIONS_DIR)
+    current = published_path(index_path)
+    names = sorted(os.listdir(versions))
+    published = [n for n in names if not n.startswith(".")]
+    old = [n for n in published[: max(len(published) - keep, 0)] if os.path.join(versions, n) != current]
+    for name in names:
+        path = os.path.join(versions, name)
+        if name.startswith(".staging-") and time.time() - os.path.getmtime(path) > STAGING_MAX_AGE:
+            old.append(name)
+    for name in old:
+        shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+
+def describe_index(info):
+    """Resumo legível da versão publicada."""
+    if not info:
+        return "Índice sem metadados"
+    parts = [f"Versão {info['kb_version']}", f"{info['files']} arquivos"]
+    if info.get("chunks"):
+        parts.append(f"{info['chunks']} trechos")
+    if info.get("built_at"):
+        parts.append(f"gerada em {info['built_at'].replace('T', ' ')}")
+    return " · ".join(parts)
+
+
+def describe_changes(report):
+    """Resumo legível do relatório de update_knowledge_base."""
+    if report["full_rebuild"]:
+        head = "Reconstrução completa"
+    elif not (report["added"] or report["changed"] or report["removed"]):
+        return f"Base atualizada ({report['unchanged']} arquivos, nada a reprocessar)"
+    else:
+        head = "Atualização incremental"
+    failed = report.get("failed")
+    return (
+        f"{head}: {len(report['added'])} novos, {len(report['changed'])} alterados, "
+        f"{len(report['removed'])} removidos, {report['unchanged']} inalterados "
+        f"(+{report['chunks_added']} / -{report['chunks_removed']} trechos)"
+        + (f"; {len(failed)} ilegíveis, tentados de novo na próxima construção" if failed else "")
+    )
@@ -0,0 +1,345 @@
+"""
+Fatiamento da base jurídica pela estrutura dos documentos.
+
+O RecursiveCharacterTextSplitter(1000, 200) corta leis e informativos em
+posições arbitrárias: artigos ficam divididos entre trechos e ~20% do texto
+vetorizado é sobreposição repetida. Aqui cada documento é cortado nas suas
+unidades naturais, sem sobreposição:
+- leis e decretos: um trecho por artigo ("Art. 75 ..."), com o capítulo/seção
+  em vigor nos metadados; artigos longos são divididos em §, incisos e
+  alíneas, e cada continuação começa pelo caput do artigo;
+- informativos: um trecho por enunciado. Cada enunciado termina na
+  referência da decisão de onde foi extraído ("Acórdão 1201/2025 Segunda
+  Câmara, Representação, Relator ..."; "Acórdão TC-1122/2015-Plenário, TC
+  8010/2013, relator ..., publicado em ..."), então o texto é cortado logo
+  depois de cada referência e a decisão vai para os metadados. O sumário do
+  início fica fora dos enunciados e o número ("1. ...") só é usado se o
+  corpo repetir a numeração do sumário; enunciados longos são divididos em
+  parágrafos e cada parte termina com a referência.
+Unidades muito curtas (artigos de uma linha) são juntadas à seguinte.
+Documentos sem estrutura reconhecível (ex.: tabelas de prejulgados)
+continuam no fatiamento por caracteres.
+
+Metadados de cada trecho: source, path, page (da primeira linha), structure
+("article", "enunciado" ou "text"), label (ex.: "Lei 14.133, art. 75") e,
+conforme o caso, law, article, heading, item e decisao.
+"""
+import os
+import re
+import bisect
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+
+KB_SPLITTER = os.environ.get("KB_SPLITTER", "legal")  # "legal" ou "chars" (fatiamento antigo, por caracteres)
+SPLITTER_VERSION = f"{KB_SPLITTER}-2"  # Gravada no manifesto: mudou, a base é refatiada
+CHUNK_MAX = 1500  # Caracteres por trecho; unidades maiores são divididas
+CHUNK_MIN = 300  # Unidades menores que isso são juntadas à vizinha
+CAPUT_MAX = 300  # Tamanho máximo do caput repetido nas continuações de um artigo
+MIN_UNITS = 2  # Unidades necessárias para tratar o documento como estruturado
+CHAR_CHUNK_SIZE = 1000
+CHAR_CHUNK_OVERLAP = 200
+
+LAW_FILE = re.compile(r"(lei|decreto)_(\d{4,5})")
+ARTICLE_START = re.compile(r"^[ \t]*Art\.?[ \t]*(\d{1,4})(?:[ \t]*[º°o])?(-[A-Z])?\.?[ \t]+(?=[A-ZÀ-Ý(“\"])", re.MULTILINE)
+HEADING = re.compile(r"^[ \t]*(?:LIVRO|TÍTULO|CAPÍTULO|SEÇÃO|Seção|SUBSEÇÃO|Subseção)[ \t]+[IVXLC]+\b.*$", re.MULTILINE)
+ARTICLE_PART = re.compile(r"^[ \t]*(?:§[ \t]*\d+|Parágrafo único|[IVXLC]+[ \t]*[-–—]|[a-z]\))", re.MULTILINE)
+ITEM_START = re.compile(r"^[ \t]*(\d{1,3})\.[ \t]+(?=[A-ZÀ-Ý])(?![^\n]*\.{4})", re.MULTILINE)
+# Enunciado sem número dos compilados do TCE-ES: "LICITAÇÃO. HABILITAÇÃO. É irregular ..."
+EMENTA_START = re.compile(r"^[ \t]*[A-ZÀ-Ý][A-ZÀ-Ý /,-]{3,}\.[ \t]+[A-ZÀ-Ý][A-ZÀ-Ý /,-]{3,}\.", re.MULTILINE)
+# Linha do sumário dos compilados: "1.6 Contratação de serviços terceirizados ....13"
+TOC_LINE = re.compile(r"^[ \t]*\d+(?:\.\d+)*\.?[ \t]+\S[^\n]*?(?:\.{4,}[ \t]*\d+|[ \t]\d{1,3})[ \t]*$", re.MULTILINE)
+# Referência que fecha o enunciado: início de linha ou de frase, decisão, número/ano e o relator
+# (ou a publicação) na mesma frase; citações no meio do texto não trazem o relator logo depois
+DECISION_REF = re.compile(
+    r"(?:(?<=\n)|(?<=[.;”\"’)])|(?<=[.;”\"’)]\s))[ \t]*"
+    r"(Ac[óo]rd[ãa]\s?o|Parecer(?: em)? Consulta|Parecer Pr[ée]\s*-?\s*vio|Decis[ãa]o(?: Normativa)?)\s*"
+    r"(TC)?[\s\-–]*(?:n[º°o.]*\s*)?(\d{1,5}(?:\.\d{3})?)\s*/\s*(\d{4})"
+    r"[^.;]{0,200}?\b(?:r\s?e-?\s*l\s?a-?\s*t\s?o\s?r|revisor|con-?\s*selheir|publi-?\s*cad)a?[\s,]",  # Com hifenização: "re-\nlator"
+    re.IGNORECASE,
+)
+SENTENCE_END = re.compile(r"\.(?=\s|$)")
+# "/ Informativo de Jurisprudência nº 23" logo depois da referência, nos compilados
+INFORMATIVO_REF = re.compile(r"\s*/?\s*Informativo(?: de Jurisprud[êe]n-?\s*cia)?\s*n[º°o.]*\s*\d+\.?", re.IGNORECASE)
+PARAGRAPH = re.compile(r"\n[ \t]*\n|(?<=[.;:!?])[ \t]*\n")  # Linha em branco ou fim de frase no fim da linha
+
+
+def _char_splitter():
+    return RecursiveCharacterTextSplitter(chunk_size=CHAR_CHUNK_SIZE, chunk_overlap=CHAR_CHUNK_OVERLAP)
+
+
+def split_by_chars(docs):
+    """Fatiamento antigo: blocos de 1000 caracteres com 200 de sobreposição."""
+    return _char_splitter().split_documents(docs)
+
+
+# --- UNIDADES ---
+def _article_starts(text):
+    """Posições de início dos artigos, com o número ("75", "1-A" para o artigo incluído "Art. 1º-A")."""
+    return [(m.start(), m.group(1) + (m.group(2) or "")) for m in ARTICLE_START.finditer(text)]
+
+
+def _pieces(text, pattern, limit):
+    """
+    Divide `text` nos inícios de `pattern` e junta os pedaços em blocos de até
+    `limit` caracteres. Retorna [(posição do bloco em text, bloco)].
+    """
+    cuts = [0] + [m.start() for m in pattern.finditer(text) if m.start() > 0] + [len(text)]
+    blocks, start, end = [], 0, 0
+    for a, b in zip(cuts, cuts[1:]):
+        if b - a > limit:
+            # Pedaço sem divisão natural que caiba: corta por caracteres, sem sobreposição
+            # (um bloco pendente curto, como o número da página, entra no corte)
+            if len(text[start:end].strip()) >= CHUNK_MIN:
+                blocks.append((start, text[start:end]))
+                start = a
+            splitter = RecursiveCharacterTextSplitter(chunk_size=limit, chunk_overlap=0, add_start_index=True)
+            parts = [(start + doc.metadata["start_index"], doc.page_content) for doc in splitter.create_documents([text[start:b]])]
+            blocks.extend(parts[:-1])
+            # O último corte fica aberto para os pedaços seguintes
+            start, end = (parts[-1][0], b) if parts else (b, b)
+        elif b - start > limit and len(text[start:end].strip()) >= CHUNK_MIN:
+            if text[start:end].strip():
+                blocks.append((start, text[start:end]))
+            start, end = a, b
+        else:
+            end = b
+    if text[start:end].strip():
+        blocks.append((start, text[start:end]))
+    if len(blocks) > 1 and len(blocks[-1][1].strip()) < CHUNK_MIN:
+        # Sobra curta no fim (ex.: "PLENÁRIO" ou a última linha) vai para o bloco anterior
+        (pos, _), (last_pos, last) = blocks[-2], blocks[-1]
+        blocks[-2:] = [(pos, text[pos : last_pos + len(last)])]
+    return [(pos + len(block) - len(block.lstrip()), block.strip()) for pos, block in blocks if block.strip()]
+
+
+def _caput(text):
+    """Começo do artigo (até o primeiro §/inciso), repetido como contexto nas continuações."""
+    m = ARTICLE_PART.search(text, len(text) - len(text.lstrip()) + 1)
+    caput = (text[: m.start()] if m else text).strip()
+    if len(caput) > CAPUT_MAX:
+        caput = caput[:CAPUT_MAX].rsplit(" ", 1)[0] + " (...)"
+    return caput
+
+
+def _law_label(rel):
+    m = LAW_FILE.search(os.path.basename(rel).lower())
+    if not m:
+        return None, None
+    number = m.group(2)
+    return number, f"{m.group(1).capitalize()} {int(number):,}".replace(",", ".")
+
+
+def _span(numbers):
+    return numbers[0] if len(numbers) == 1 else f"{numbers[0]} a {numbers[-1]}"
+
+
+def _merge_small(units):
+    """Junta unidades curtas à vizinha (mesmo cabeçalho), sem passar de CHUNK_MAX."""
+    merged = []
+    for unit in units:
+        last = merged[-1] if merged else None
+        if (
+            last is not None
+            and min(len(last["text"]), len(unit["text"])) < CHUNK_MIN
+            and len(last["text"]) + len(unit["text"]) <= CHUNK_MAX
+            and last.get("heading") == unit.get("heading")
+            and last["structure"] == unit["structure"]
+            and last.get("decisao") == unit.get("decisao")
+        ):
+            last["text"] += "\n" + unit["text"]
+            last["numbers"] += unit["numbers"]
+            last["reference"] = unit.get("reference")
+        else:
+            merged.append(dict(unit, numbers=list(unit["numbers"])))
+    return merged
+
+
+def _law_units(text, starts):
+    """Um artigo por unidade; os títulos de capítulo/seção entre artigos vão para o metadado heading."""
+    units, heading = [], None
+    preamble = text[: starts[0][0]]
+    m = HEADING.search(preamble)
+    if m:
+        heading = " ".join(preamble[m.start():].split())
+        preamble = preamble[: m.start()]
+    if preamble.strip():
+        units.append({"start": 0, "text": preamble, "structure": "text", "numbers": []})
+    bounds = [pos for pos, _ in starts] + [len(text)]
+    for (start, number), end in zip(starts, bounds[1:]):
+        body = text[start:end]
+        m = HEADING.search(body)
+        # Títulos no fim do artigo valem a partir do próximo
+        next_heading = " ".join(body[m.start():].split()) if m else None
+        if m:
+            body = body[: m.start()]
+        units.append({"start": start, "text": body, "structure": "article", "numbers": [number], "heading": heading})
+        heading = next_heading or heading
+    return units
+
+
+def _decision_name(kind, tc, number, year):
+    """Nome normalizado da decisão: "Acórdão TC-1122/2015", "Parecer em Consulta TC-12/2024", "Acórdão 1201/2025"."""
+    kind = re.sub(r"[\s-]", "", kind).lower()
+    if kind.startswith("ac"):
+        name = "Acórdão"
+    elif kind.startswith("parecerpr"):
+        name = "Parecer Prévio"
+    elif kind.startswith("parecer"):
+        name = "Parecer em Consulta"
+    else:
+        name = "Decisão Normativa" if kind.endswith("normativa") else "Decisão"
+    return f"{name} {'TC-' if tc else ''}{int(number.replace('.', ''))}/{year}"
+
+
+def _decision_refs(text):
+    """Referências que fecham os enunciados: [(início, fim, decisão)], o fim já depois do "/ Informativo nº N"."""
+    refs = []
+    for m in DECISION_REF.finditer(text):
+        if refs and m.start() < refs[-1][1]:
+            continue  # Segunda decisão na mesma referência ("... e Parecer Prévio TC-105/2017, ...")
+        dot = SENTENCE_END.search(text, m.end(), m.end() + 300)
+        end = dot.end() if dot else (text.find("\n", m.end()) % (len(text) + 1))
+        tail = INFORMATIVO_REF.match(text, end)
+        refs.append((m.start(), tail.end() if tail else end, _decision_name(*m.groups())))
+    return refs
+
+
+def _entry_starts(segment, number, first):
+    """
+    Possíveis inícios do enunciado no trecho entre duas referências:
+    (o último item "N." com o número esperado, depois do sumário, ou None;
+    a última ementa ou, no primeiro trecho, o fim do sumário, ou None).
+    """
+    items = [m.start() for m in ITEM_START.finditer(segment) if int(m.group(1)) == number]
+    others = [m.start() for m in EMENTA_START.finditer(segment)][-1:]
+    if first:
+        others += [m.end() for m in TOC_LINE.finditer(segment)][-1:]
+    return (items[-1] if items else None), (max(others) if others else None)
+
+
+def _summary_size(text):
+    """
+    Itens do sumário: a numeração crescente a partir de "1." no início do
+    documento, até recomeçar em "1." no corpo (o sumário pode pular itens
+    quebrados na extração). 0 se não houver sumário.
+    """
+    size = 0
+    for m in ITEM_START.finditer(text):
+        number = int(m.group(1))
+        if number == 1 and size:
+            return size
+        if number > size and (size or number == 1):
+            size = number
+    # Sem recomeço, um "1." isolado é o da ficha catalográfica
+    return size if size > 1 else 0
+
+
+def _decision_units(text, refs):
+    """
+    Um enunciado por unidade, do fim da referência anterior até o fim da sua,
+    com a decisão da referência. O texto antes do enunciado (capa, sumário)
+    vira uma unidade "text" se for longo; títulos curtos ("PLENÁRIO") ficam
+    no enunciado.
+    """
+    entries, previous, number = [], 0, 1
+    for ref_start, end, decision in refs:
+        item, other = _entry_starts(text[previous:end], number, first=not entries)
+        entries.append((previous, item, other, number, ref_start, end, decision))
+        number += item is not None
+        previous = end
+    # A numeração só vale se repetir a do sumário (nos compilados, "1." da ficha
+    # catalográfica e os títulos "2. FINANÇAS PÚBLICAS" não são enunciados)
+    use_numbers = 0 < number - 1 <= _summary_size(text[: refs[0][1]])
+
+    units = []
+    for segment_start, item, other, number, ref_start, end, decision in entries:
+        start = item if use_numbers and item is not None else other
+        start = segment_start if start is None else segment_start + start
+        if len(text[segment_start:start].strip()) < CHUNK_MIN:
+            start = segment_start
+        elif text[segment_start:start].strip():
+            units.append({"start": segment_start, "text": text[segment_start:start], "structure": "text", "numbers": []})
+        numbers = [str(number)] if use_numbers and item is not None else []
+        units.append({
+            "start": start, "text": text[start:end], "structure": "enunciado", "numbers": numbers,
+            "decisao": decision, "reference": text[ref_start:end],
+        })
+    tail = text[previous:]
+    if len(tail.strip()) < CHUNK_MIN:
+        # Sobra curta depois da última referência (expediente, fonte da notícia) fica no último enunciado
+        units[-1]["text"] += tail
+        units[-1]["reference"] += tail
+    else:
+        units.append({"start": previous, "text": tail, "structure": "text", "numbers": []})
+    return units
+
+
+# --- DOCUMENTOS ---
+def split_pages(rel, pages):
+    """Trechos (Documents) de um arquivo da base a partir do texto das suas páginas."""
+    source = os.path.basename(rel)
+    page_docs = [
+        Document(page_content=text, metadata={"source": source, "path": rel, "page": i + 1})
+        for i, text in enumerate(pages)
+        if text.strip()
+    ]
+    if KB_SPLITTER != "legal":
+        return split_by_chars(page_docs)
+
+    offsets, parts, position = [], [], 0
+    for i, page in enumerate(pages):
+        offsets.append(position)
+        parts.append(page)
+        position += len(page) + 1
+    text = "\n".join(parts)
+
+    law, law_label = _law_label(rel)
+    articles = _article_starts(text)
+    refs = _decision_refs(text)
+    # Informativos também citam artigos no início de linhas: as referências de decisões decidem
+    if len(articles) >= MIN_UNITS and (law or not refs):
+        units = _law_units(text, articles)
+    elif refs:
+        units = _decision_units(text, refs)
+    else:
+        return split_by_chars(page_docs)
+
+    docs = []
+    for unit in _merge_small(units):
+        metadata = {"source": source, "path": rel, "structure": unit["structure"]}
+        numbers = unit["numbers"]
+        if unit["structure"] == "article":
+            metadata["article"] = _span(numbers)
+            metadata["label"] = f"{law_label}, art. {metadata['article']}" if law_label else f"art. {metadata['article']}"
+            if law:
+                metadata["law"] = law
+            if unit.get("heading"):
+                metadata["heading"] = unit["heading"]
+        elif unit["structure"] == "enunciado":
+            metadata["label"] = re.sub(r"(\.pdf)+$", "", source, flags=re.IGNORECASE)
+            if numbers:
+                metadata["item"] = _span(numbers)
+                metadata["label"] += f", item {metadata['item']}"
+            metadata["decisao"] = unit["decisao"]
+            metadata["label"] += f" ({unit['decisao']})"
+        body = unit["text"]
+        if len(body.strip()) <= CHUNK_MAX:
+            blocks = [(len(body) - len(body.lstrip()), body.strip())]
+        elif unit["structure"] == "article":
+            caput = _caput(body)
+            blocks = _pieces(body, ARTICLE_PART, CHUNK_MAX - len(caput) - 1)
+            blocks = blocks[:1] + [(pos, f"{caput}\n{block}") for pos, block in blocks[1:]]
+        elif unit["structure"] == "enunciado":
+            # Enunciados longos: cada parte termina com a referência da decisão (a do label)
+            reference = f"({unit['decisao']})"
+            head = body[: len(body) - len(unit["reference"])]
+            blocks = _pieces(head, PARAGRAPH, CHUNK_MAX - len(unit["reference"]) - 1)
+            # A última parte leva a referência original; as outras, o nome da decisão
+            blocks = [(pos, f"{block}\n{reference}") for pos, block in blocks[:-1]] + [(blocks[-1][0], body[blocks[-1][0]:].strip())]
+        else:
+            blocks = _pieces(body, PARAGRAPH, CHUNK_MAX)
+        for pos, block in blocks:
+            # Página (a partir de 1) onde o bloco começa
+            page = bisect.bisect_right(offsets, unit["start"] + pos)
+            docs.append(Document(page_content=block, metadata=dict(metadata, page=page)))
+    return docs
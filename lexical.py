@@ -0,0 +1,185 @@
+"""
+Índice lexical (BM25) e tabela de citações, construídos junto com o FAISS
+sobre os mesmos trechos (mesmos IDs).
+
+O índice vetorial é fraco em correspondências exatas como "art. 75" ou
+"Acórdão 1234/2024". Aqui cada trecho tem:
+- os termos normalizados (sem acento, minúsculos) para o BM25;
+- as citações extraídas (artigos, acórdãos, súmulas, prejulgados), num
+  dicionário citação -> IDs, então a busca exata é um acesso a dicionário,
+  sem chamar a API de embeddings.
+"""
+import os
+import re
+import math
+import pickle
+import unicodedata
+from collections import Counter
+
+LEXICAL_FILE = "lexical.pkl"
+BM25_K1 = 1.5
+BM25_B = 0.75
+MAX_QUERY_TERMS = 40  # Consultas longas usam só os termos mais raros
+
+STOPWORDS = set("""
+a ao aos as com da das de do dos e em na nas no nos o os ou para pela pelas pelo pelos por que se sem
+sua suas seu seus um uma uns umas nao mais como ser sao foi ha isso este esta esse essa quando qual
+art lei
+""".split())
+
+TERM = re.compile(r"[a-z0-9]{2,}")
+LAW = re.compile(r"\b(?:lei|decreto)\s*(?:federal\s*)?(?:n[º°o.]*\s*)?(\d{1,2}\.?\d{3})\b", re.IGNORECASE)
+ARTICLE = re.compile(r"\bart(?:igo)?s?\.?\s*(\d{1,3})\s*(?:º|°|o\b)?", re.IGNORECASE)
+ACORDAO = re.compile(r"\bac[óo]rd[ãa]os?\s*(?:n[º°o.]*\s*)?(?:TCU\s*)?(\d{1,5})\s*/\s*(\d{4})", re.IGNORECASE)
+SUMULA = re.compile(r"\bs[úu]mulas?\s*(?:n[º°o.]*\s*)?(?:TCU\s*)?(\d{1,4})\b", re.IGNORECASE)
+PREJULGADO = re.compile(r"\bprejulgados?\s*(?:n[º°o.]*\s*)?(\d{1,4})\b", re.IGNORECASE)
+LAW_IN_FILENAME = re.compile(r"(?:lei|decreto)_(\d{4,5})")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [t for t in TERM.findall(normalize(text)) if t not in STOPWORDS]
+
+
+def extract_citations(text, source_path=""):
+    """
+    Citações do texto como chaves normalizadas:
+    "art:75", "lei:14133", "lei:14133:art:75", "acordao:1234/2024", "sumula:247", "prejulgado:12".
+    Artigos citados num PDF de lei (pelo nome do arquivo) ou logo após "Lei N"
+    também recebem a chave qualificada com a lei.
+    """
+    keys = set()
+    laws = [m.group(1).replace(".", "") for m in LAW.finditer(text)]
+    file_law = LAW_IN_FILENAME.search(source_path.lower())
+    default_law = file_law.group(1) if file_law else (laws[0] if len(set(laws)) == 1 else None)
+    for law in laws:
+        keys.add(f"lei:{law}")
+    for m in ARTICLE.finditer(text):
+        keys.add(f"art:{m.group(1)}")
+        # Lei citada logo depois do artigo ("art. 75 da Lei 14.133") tem prioridade
+        after = LAW.search(text, m.end(), m.end() + 40)
+        law = after.group(1).replace(".", "") if after else default_law
+        if law:
+            keys.add(f"lei:{law}:art:{m.group(1)}")
+    for m in ACORDAO.finditer(text):
+        keys.add(f"acordao:{int(m.group(1))}/{m.group(2)}")
+    for m in SUMULA.finditer(text):
+        keys.add(f"sumula:{int(m.group(1))}")
+    for m in PREJULGADO.finditer(text):
+        keys.add(f"prejulgado:{int(m.group(1))}")
+    return keys
+
+
+class LexicalIndex:
+    def __init__(self):
+        self.docs = {}  # id -> (nº de termos, Counter de termos, citações)
+        self.postings = {}  # termo -> {id: frequência}
+        self.citations = {}  # citação -> set de ids
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, text, source_path=""):
+        if doc_id in self.docs:
+            self.remove([doc_id])
+        terms = Counter(tokenize(text))
+        cites = extract_citations(text, source_path)
+        length = sum(terms.values())
+        self.docs[doc_id] = (length, terms, cites)
+        self.total_length += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        for key in cites:
+            self.citations.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_ids):
+        for doc_id in doc_ids:
+            entry = self.docs.pop(doc_id, None)
+            if entry is None:
+                continue
+            length, terms, cites = entry
+            self.total_length -= length
+            for term in terms:
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.postings[term]
+            for key in cites:
+                ids = self.citations.get(key)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del self.citations[key]
+
+    def search(self, query, k=10):
+        """BM25: lista de (id, pontuação) em ordem decrescente."""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_length = self.total_length / n
+        terms = set(tokenize(query))
+        idf = {}
+        for term in terms:
+            df = len(self.postings.get(term, ()))
+            if df:
+                idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        # Em consultas longas (janelas do documento) só os termos mais discriminantes contam
+        query_terms = sorted(idf, key=idf.get, reverse=True)[:MAX_QUERY_TERMS]
+        scores = {}
+        for term in query_terms:
+            for doc_id, tf in self.postings[term].items():
+                length = self.docs[doc_id][0]
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def lookup(self, text):
+        """
+        IDs dos trechos que contêm as citações presentes em `text`
+        (ex.: "art. 75 da Lei 14.133", "Acórdão 1234/2024"), mais específicas primeiro.
+        """
+        keys = extract_citations(text)
+        # "lei:14133:art:75" é mais específica que "art:75", que é mais que "lei:14133"
+        ordered = sorted(keys, key=lambda key: (-key.count(":"), key))
+        seen, ids, qualified_hit = set(), [], set()
+        for key in ordered:
+            if key.startswith("lei:") and key.count(":") == 1:
+                continue  # Citar só a lei casaria com a base inteira
+            if key.startswith("art:") and key in qualified_hit:
+                continue  # A chave qualificada com a lei já achou o artigo
+            if key.startswith("lei:") and self.citations.get(key):
+                qualified_hit.add(key.split(":", 2)[2])
+            for doc_id in sorted(self.citations.get(key, ())):
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    ids.append(doc_id)
+        return ids
+
+    def save(self, index_path):
+        path = os.path.join(index_path, LEXICAL_FILE)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(index_path):
+        try:
+            with open(os.path.join(index_path, LEXICAL_FILE), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+
+def build_from_docstore(vectorstore):
+    """Reconstrói o índice lexical a partir dos trechos já guardados no FAISS (sem embeddings)."""
+    index = LexicalIndex()
+    for doc_id in vectorstore.index_to_docstore_id.values():
+        doc = vectorstore.docstore.search(doc_id)
+        index.add(doc_id, doc.page_content, doc.metadata.get("path", ""))
+    return index
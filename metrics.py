@@ -0,0 +1,217 @@
+"""
+Métricas de desempenho das auditorias (tabela audit_metrics).
+
+run_audit mede cada etapa com StageTimer (extração do PDF, OCR, busca na base,
+montagem do prompt, chamada ao LLM e geração do .docx) e o worker grava uma
+linha por auditoria com os tempos, o tamanho do documento, os tokens e os
+acertos de cache. Auditorias atendidas pelo cache de resultados também
+entram (cache_hit), sem tempos de etapa.
+
+stage_percentiles() alimenta os gráficos p50/p95 da aba Admin e
+prometheus_text() gera o formato de exposição do Prometheus, servido em
+/metrics quando METRICS_PORT está definido (ver serve_metrics).
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from db import get_db_connection
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # 0 = sem endpoint HTTP
+METRICS_WINDOW_HOURS = int(os.environ.get("METRICS_WINDOW_HOURS", "168"))  # Janela do /metrics (7 dias)
+QUANTILES = (0.5, 0.95)
+
+# Etapas na ordem do pipeline ("total" = run_audit inteiro)
+STAGES = ("extraction", "ocr", "retrieval", "prompt", "llm", "docx", "total")
+STAGE_LABELS = {
+    "extraction": "Extração do PDF",
+    "ocr": "OCR",
+    "retrieval": "Busca na base",
+    "prompt": "Montagem do prompt",
+    "llm": "LLM",
+    "docx": "Geração do .docx",
+    "total": "Total",
+}
+
+
+class StageTimer:
+    """Soma o tempo (s) de cada etapa; pode ser usado por várias threads ao mesmo tempo."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {name: round(seconds, 4) for name, seconds in self.stages.items()}
+
+
+# --- GRAVAÇÃO ---
+def record_audit(job_id, username, doc_type, doc_bytes, stats=None, cache_hit=False):
+    """Grava as métricas de uma auditoria (stats = métricas devolvidas por run_audit)."""
+    stats = stats or {}
+    ocr = stats.get("ocr") or {}
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO audit_metrics (job_id, username, doc_type, doc_bytes, doc_pages, doc_tokens, sections,
+                                       input_tokens, output_tokens, cost_usd, ttft_s, cache_hit,
+                                       ocr_pages, ocr_cached, stages)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            job_id, username, doc_type, doc_bytes, stats.get("doc_pages"), stats.get("doc_tokens"),
+            stats.get("sections"), stats.get("total_input_tokens"), stats.get("total_output_tokens"),
+            stats.get("cost_usd"), stats.get("ttft_s"), cache_hit, ocr.get("recognized", 0),
+            ocr.get("cached", 0), json.dumps(stats.get("stages") or {}),
+        ))
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao gravar métricas da auditoria: {e}")
+    finally:
+        conn.close()
+
+
+# --- CONSULTAS ---
+def stage_percentiles(hours=METRICS_WINDOW_HOURS):
+    """{etapa: {"count", "sum", "p50", "p95"}} em segundos, nas últimas `hours` horas."""
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT stage.key, COUNT(*), SUM(stage.value::float),
+               percentile_cont(%s) WITHIN GROUP (ORDER BY stage.value::float),
+               percentile_cont(%s) WITHIN GROUP (ORDER BY stage.value::float)
+        FROM audit_metrics, jsonb_each_text(audit_metrics.stages) AS stage
+        WHERE created_at > NOW() - %s * INTERVAL '1 hour'
+        GROUP BY stage.key
+    """, QUANTILES + (hours,))
+    rows = cur.fetchall()
+    conn.close()
+    found = {key: {"count": n, "sum": total, "p50": p50, "p95": p95} for key, n, total, p50, p95 in rows}
+    # Ordem do pipeline; etapas desconhecidas (versões futuras) vão para o fim
+    return {key: found[key] for key in sorted(found, key=lambda k: (STAGES.index(k) if k in STAGES else len(STAGES), k))}
+
+
+def audit_summary(hours=METRICS_WINDOW_HOURS):
+    """Totais da janela: auditorias, acertos de cache, tokens, custo, páginas de OCR e tamanho dos documentos."""
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE cache_hit),
+               COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), COALESCE(SUM(cost_usd), 0),
+               COALESCE(SUM(ocr_pages), 0), COALESCE(SUM(ocr_cached), 0),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY doc_bytes),
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY doc_bytes)
+        FROM audit_metrics
+        WHERE created_at > NOW() - %s * INTERVAL '1 hour'
+    """, (hours,))
+    row = cur.fetchone()
+    conn.close()
+    keys = ["audits", "cache_hits", "input_tokens", "output_tokens", "cost_usd", "ocr_pages", "ocr_cached",
+            "doc_bytes_p50", "doc_bytes_p95"]
+    return dict(zip(keys, row))
+
+
+def recent_audits(limit=50):
+    """Últimas auditorias medidas (para a tabela da aba Admin)."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT created_at, job_id, username, doc_type, doc_bytes, doc_pages, doc_tokens, sections,
+               input_tokens, output_tokens, cost_usd, ttft_s, cache_hit, stages
+        FROM audit_metrics ORDER BY created_at DESC LIMIT %s
+    """, (limit,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+# --- FORMATO PROMETHEUS ---
+def prometheus_text(hours=METRICS_WINDOW_HOURS):
+    """Métricas no formato de exposição de texto do Prometheus (janela de `hours` horas)."""
+    lines = [
+        f"# HELP lici_audit_stage_seconds Duração das etapas da auditoria (últimas {hours}h).",
+        "# TYPE lici_audit_stage_seconds summary",
+    ]
+    for stage, values in stage_percentiles(hours).items():
+        for q in QUANTILES:
+            lines.append(f'lici_audit_stage_seconds{{stage="{stage}",quantile="{q}"}} {values[f"p{int(q * 100)}"]:.4f}')
+        lines.append(f'lici_audit_stage_seconds_sum{{stage="{stage}"}} {values["sum"]:.4f}')
+        lines.append(f'lici_audit_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+    summary = audit_summary(hours)
+    if summary:
+        lines += [
+            "# HELP lici_audits Auditorias na janela, por acerto no cache de resultados.",
+            "# TYPE lici_audits gauge",
+            f'lici_audits{{cache_hit="true"}} {summary["cache_hits"]}',
+            f'lici_audits{{cache_hit="false"}} {summary["audits"] - summary["cache_hits"]}',
+            "# HELP lici_audit_tokens Tokens enviados e recebidos do LLM na janela.",
+            "# TYPE lici_audit_tokens gauge",
+            f'lici_audit_tokens{{direction="input"}} {summary["input_tokens"]}',
+            f'lici_audit_tokens{{direction="output"}} {summary["output_tokens"]}',
+            "# HELP lici_audit_cost_usd Custo estimado do LLM na janela (US$).",
+            "# TYPE lici_audit_cost_usd gauge",
+            f"lici_audit_cost_usd {float(summary['cost_usd']):.4f}",
+            "# HELP lici_audit_ocr_pages Páginas de OCR na janela, reconhecidas ou lidas do cache.",
+            "# TYPE lici_audit_ocr_pages gauge",
+            f'lici_audit_ocr_pages{{source="recognized"}} {summary["ocr_pages"]}',
+            f'lici_audit_ocr_pages{{source="cache"}} {summary["ocr_cached"]}',
+        ]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = prometheus_text().encode("utf-8")
+        except Exception as e:
+            print(f"Erro ao gerar métricas: {e}")
+            self.send_error(503)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sem uma linha de log a cada coleta do Prometheus
+
+
+def serve_metrics(port=METRICS_PORT):
+    """Serve /metrics numa thread em segundo plano. Retorna o servidor."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    print(prometheus_text(), end="")
@@ -0,0 +1,217 @@
+"""
+OCR das páginas digitalizadas (só imagem) de um PDF.
+
+As imagens de cada página sem texto são extraídas com o pypdf e reconhecidas
+pelo Tesseract (pytesseract) num pool de processos único, compartilhado por
+todas as auditorias e limitado a OCR_WORKERS processos, página a página. O texto
+reconhecido fica em cache (SQLite, junto do cache de páginas) pelo hash das
+imagens da página, então o mesmo scan nunca é reconhecido duas vezes, nem em
+auditorias diferentes nem ao reconstruir a base. Cada documento tem um tempo
+máximo de OCR: o que não terminar a tempo fica sem texto.
+
+Dependências opcionais: o pacote pytesseract e o binário tesseract com o
+idioma português (no Dockerfile: tesseract-ocr tesseract-ocr-por). Sem elas
+ocr_available() é False e o restante do sistema segue como antes.
+"""
+import os
+import io
+import time
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from ingestion import PAGE_CACHE_PATH, open_pdf
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))  # Total de processos, somando os jobs
+OCR_TIME_LIMIT = float(os.environ.get("OCR_TIME_LIMIT", "180"))  # Segundos por documento
+OCR_PAGE_TIMEOUT = 60  # Segundos por página (limite passado ao tesseract)
+OCR_LANG = os.environ.get("OCR_LANG", "por")
+OCR_MIN_CHARS = 20  # Página com menos texto que isso é candidata a OCR
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD")
+
+_available = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def ocr_available():
+    """True se pytesseract e o binário tesseract estão instalados."""
+    global _available
+    if _available is None:
+        try:
+            import pytesseract
+            if TESSERACT_CMD:
+                pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+            pytesseract.get_tesseract_version()
+            _available = True
+        except Exception as e:
+            print(f"OCR indisponível: {e}")
+            _available = False
+    return _available
+
+
+def blank_pages(pages):
+    """Índices das páginas sem texto extraível (candidatas a OCR)."""
+    return [i for i, text in enumerate(pages) if len(text.strip()) < OCR_MIN_CHARS]
+
+
+# --- CACHE DE OCR (SQLite) ---
+class OcrCache:
+    def __init__(self, path=PAGE_CACHE_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ocr_pages (
+                    image_hash TEXT PRIMARY KEY,
+                    text TEXT NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, hashes):
+        with self._connect() as conn:
+            placeholders = ",".join("?" * len(hashes))
+            rows = conn.execute(
+                f"SELECT image_hash, text FROM ocr_pages WHERE image_hash IN ({placeholders})", list(hashes)
+            ).fetchall() if hashes else []
+        return dict(rows)
+
+    def put(self, image_hash, text):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO ocr_pages (image_hash, text) VALUES (?, ?)", (image_hash, text))
+
+
+# --- OCR ---
+def page_images(reader, page_no):
+    """Bytes das imagens de uma página (vazio se não houver ou não der para extrair)."""
+    try:
+        return [image.data for image in reader.pages[page_no].images]
+    except Exception:
+        return []
+
+
+def _get_pool():
+    """Pool de OCR do processo, criado no primeiro uso; os jobs concorrentes dividem os mesmos processos."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn' evita fork de um servidor Streamlit com várias threads
+            _pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(pool):
+    """Descarta um pool quebrado (processo morto); o próximo uso cria outro."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ocr_images(images, timeout):
+    """Tarefa do pool: reconhece as imagens de uma página e junta o texto."""
+    import pytesseract
+    from PIL import Image
+
+    if TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    texts = []
+    for data in images:
+        try:
+            texts.append(pytesseract.image_to_string(Image.open(io.BytesIO(data)), lang=OCR_LANG, timeout=timeout))
+        except Exception as e:
+            print(f"Falha no OCR de uma imagem: {e}")
+    return "\n".join(t.strip() for t in texts if t.strip())
+
+
+def ocr_pages(source, page_numbers, workers=None, time_limit=OCR_TIME_LIMIT, cache=None):
+    """
+    OCR das páginas indicadas de um PDF (caminho ou bytes). Com workers <= 1
+    roda no próprio processo; senão usa o pool compartilhado (_get_pool).
+    Retorna ({nº da página: texto}, métricas: páginas, do cache, reconhecidas, tempo esgotado).
+    """
+    workers = OCR_WORKERS if workers is None else workers
+    cache = OcrCache() if cache is None else cache
+    stats = {"pages": len(page_numbers), "cached": 0, "recognized": 0, "timed_out": False}
+    if not page_numbers or not ocr_available():
+        return {}, stats
+    deadline = time.monotonic() + time_limit
+
+    # 1. Imagens e hash de cada página; o que já foi reconhecido sai do cache
+    reader = open_pdf(source)
+    pending, hashes = {}, {}
+    for page_no in page_numbers:
+        images = page_images(reader, page_no)
+        if images:
+            digest = hashlib.sha256()
+            for data in images:
+                digest.update(hashlib.sha256(data).digest())
+            hashes[page_no] = digest.hexdigest()
+            pending[page_no] = images
+    cached = cache.get_many(set(hashes.values())) if cache else {}
+    results = {}
+    for page_no in list(pending):
+        if hashes[page_no] in cached:
+            results[page_no] = cached[hashes[page_no]]
+            stats["cached"] += 1
+            del pending[page_no]
+
+    def store(page_no, text):
+        results[page_no] = text
+        stats["recognized"] += 1
+        if cache:
+            cache.put(hashes[page_no], text)
+
+    # 2. Reconhece o resto, página a página, até o tempo limite do documento
+    if workers <= 1 or len(pending) <= 1:
+        for page_no, images in pending.items():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                stats["timed_out"] = True
+                break
+            store(page_no, _ocr_images(images, min(OCR_PAGE_TIMEOUT, remaining)))
+        return results, stats
+
+    pool = _get_pool()
+    futures = {}
+    try:
+        # Cada tarefa leva só as imagens da sua página
+        timeout = min(OCR_PAGE_TIMEOUT, time_limit)
+        futures = {pool.submit(_ocr_images, images, timeout): page_no for page_no, images in pending.items()}
+        for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+            try:
+                store(futures[future], future.result())
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                print(f"Falha no OCR da página {futures[future] + 1}: {e}")
+    except FuturesTimeout:
+        stats["timed_out"] = True
+    except BrokenProcessPool as e:
+        print(f"Pool de OCR interrompido: {e}")
+        _discard_pool(pool)
+    finally:
+        # Só as páginas deste documento que não começaram são canceladas; as em
+        # andamento param no timeout do tesseract e o pool segue para os outros jobs
+        for future in futures:
+            future.cancel()
+    return results, stats
+
+
+def fill_blank_pages(source, pages, workers=None, time_limit=OCR_TIME_LIMIT, cache=None):
+    """Lista de páginas com as que estavam sem texto substituídas pelo OCR. Retorna (páginas, métricas)."""
+    recognized, stats = ocr_pages(source, blank_pages(pages), workers, time_limit, cache)
+    pages = list(pages)
+    for page_no, text in recognized.items():
+        if text.strip():
+            pages[page_no] = text
+    return pages, stats
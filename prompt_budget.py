@@ -0,0 +1,145 @@
+"""
+Contagem exata de tokens (tiktoken) e montagem de prompts dentro de um orçamento.
+
+O orçamento de entrada é dividido entre instruções (fixas, contadas exatamente),
+jurisprudência (trechos inteiros até o teto de contexto) e documento (o que
+sobrar). O documento é cortado no último limite de seção, parágrafo ou frase
+que caiba, nunca no meio de uma palavra. Sem o arquivo do tokenizer (ex.:
+container sem internet e sem TIKTOKEN_CACHE_DIR preenchido) a contagem cai
+para a estimativa de ~4 caracteres por token.
+"""
+import os
+import re
+import threading
+import tiktoken
+
+LLM_MODEL = "gpt-4-turbo"
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "20000"))  # Entrada máxima por chamada
+TRIM_MIN_KEEP = 0.8  # Só corta num limite se ele preservar ao menos 80% do que cabe
+
+# Janela de contexto (entrada + saída) por modelo
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+
+# US$ por 1 milhão de tokens (entrada, saída); LLM_PRICE_INPUT/LLM_PRICE_OUTPUT sobrescrevem
+MODEL_PRICES = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+}
+
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+SENTENCE_END = re.compile(r"(?<=[.;:!?])\s")
+BOUNDARIES = (PARAGRAPH_BREAK, SENTENCE_END)
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def encoding_for(model=LLM_MODEL):
+    """Tokenizer do modelo (ou None se o arquivo do tiktoken não puder ser carregado)."""
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"tiktoken indisponível, usando estimativa de tokens: {e}")
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def context_limit(model=LLM_MODEL):
+    return MODEL_CONTEXT_TOKENS.get(model, 8192)
+
+
+def count_tokens(text, model=LLM_MODEL):
+    enc = encoding_for(model)
+    if enc is None:
+        return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def trim_to_tokens(text, max_tokens, boundaries=BOUNDARIES, model=LLM_MODEL):
+    """
+    Início do texto com no máximo max_tokens, cortado no último limite
+    (na ordem de `boundaries`) que caiba. Retorna (texto, foi_cortado).
+    """
+    if max_tokens <= 0:
+        return "", bool(text)
+    enc = encoding_for(model)
+    if enc is None:
+        if len(text) // 4 + 1 <= max_tokens:
+            return text, False
+        prefix = text[: max_tokens * 4]
+    else:
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text, False
+        prefix = enc.decode(tokens[:max_tokens])
+    floor = int(len(prefix) * TRIM_MIN_KEEP)
+    for pattern in boundaries:
+        cuts = [m.start() for m in pattern.finditer(prefix, floor)]
+        if cuts:
+            return prefix[: cuts[-1]].rstrip(), True
+    # Sem limite natural perto do fim: corta no último espaço
+    return prefix.rsplit(" ", 1)[0].rstrip(), True
+
+
+def fit_blocks(blocks, max_tokens, model=LLM_MODEL):
+    """Blocos inteiros, na ordem (de relevância), enquanto couberem. Retorna (texto, tokens)."""
+    chosen, used = [], 0
+    for block in blocks:
+        cost = count_tokens(block, model)
+        if used + cost > max_tokens:
+            continue
+        chosen.append(block)
+        used += cost
+    return "".join(chosen), used
+
+
+def assemble_prompt(template, document, context_blocks=(), budget=PROMPT_TOKEN_BUDGET, context_budget=None,
+                    boundaries=BOUNDARIES, model=LLM_MODEL, **fields):
+    """
+    Preenche um PromptTemplate (variáveis "text" e, se houver, "context")
+    dentro de `budget` tokens. Retorna (prompt, uso) com a contagem por parte.
+    """
+    has_context = "context" in template.input_variables
+    empty = dict(fields, text="", **({"context": ""} if has_context else {}))
+    instructions = count_tokens(template.format(**empty), model)
+    available = budget - instructions
+    context, context_tokens = "", 0
+    if has_context:
+        limit = available if context_budget is None else min(context_budget, available)
+        context, context_tokens = fit_blocks(context_blocks, limit, model)
+        fields["context"] = context
+    document_budget = available - context_tokens
+    while True:
+        text, trimmed = trim_to_tokens(document, document_budget, boundaries, model)
+        prompt = template.format(text=text, **fields)
+        total = count_tokens(prompt, model)
+        # Tokens na junção instrução/texto podem diferir da soma das partes
+        if total <= budget or document_budget <= 0:
+            break
+        document_budget -= total - budget
+    usage = {
+        "instructions": instructions,
+        "context": context_tokens,
+        "document": total - instructions - context_tokens,
+        "total": total,
+        "document_trimmed": trimmed,
+    }
+    return prompt, usage
+
+
+def estimate_cost(input_tokens, output_tokens, model=LLM_MODEL):
+    """Custo estimado em US$ pela tabela MODEL_PRICES (ou LLM_PRICE_INPUT/LLM_PRICE_OUTPUT)."""
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    price_in = float(os.environ.get("LLM_PRICE_INPUT", price_in))
+    price_out = float(os.environ.get("LLM_PRICE_OUTPUT", price_out))
+    return round((input_tokens * price_in + output_tokens * price_out) / 1_000_000, 4)
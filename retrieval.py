@@ -0,0 +1,245 @@
+"""
+Busca de jurisprudência para o documento auditado.
+
+Em vez de uma única consulta com o início do documento, o texto é dividido
+em janelas que são vetorizadas num único lote e consultadas no FAISS de uma
+vez (index.search com várias linhas). Cada janela também passa pelo índice
+lexical (BM25) e pela tabela de citações (lexical.py), que acertam
+correspondências exatas como "art. 75" ou "Acórdão 1234/2024". Todas as
+listas são fundidas por Reciprocal Rank Fusion, trechos quase idênticos (o
+mesmo enunciado repetido em informativos diferentes, ou a sobreposição dos
+índices antigos fatiados por caracteres) são descartados e a seleção final
+(MMR) privilegia trechos diversos até caber no orçamento de tokens do contexto.
+
+Com o serviço de busca (kb_service.py) as buscas densa e lexical rodam no
+serviço e só a fusão e a seleção rodam aqui.
+
+Num lote (batch.py), os rankings de cada consulta ficam num QueryCache
+compartilhado pelas auditorias do lote, pela consulta normalizada e pela
+versão da base: janelas repetidas entre ETP, TR e edital não são buscadas
+de novo.
+"""
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from prompt_budget import count_tokens
+
+QUERY_CHARS = 4000  # Tamanho de cada janela de consulta
+MAX_QUERIES = 12  # Janelas por documento (espalhadas do início ao fim)
+CANDIDATES_PER_QUERY = 10
+CONTEXT_TOKEN_BUDGET = 1800  # ~ o que os 6 trechos da busca antiga ocupavam
+RRF_K = 60
+MMR_LAMBDA = 0.7  # 1.0 = só relevância; menor = mais diversidade
+DUPLICATE_SIMILARITY = 0.5  # Jaccard de 5-gramas acima disso = trecho repetido
+QUERY_CACHE_SIZE = 2000  # Consultas guardadas por QueryCache (as mais recentes)
+
+WORD = re.compile(r"\w+")
+
+
+def query_windows(text, max_queries=MAX_QUERIES, chars=QUERY_CHARS):
+    """Janelas de até `chars` caracteres, espalhadas uniformemente pelo texto."""
+    starts = list(range(0, max(len(text) - chars, 0) + 1, chars)) or [0]
+    if len(starts) > max_queries:
+        step = len(starts) / max_queries
+        starts = [starts[int(i * step)] for i in range(max_queries)]
+    return [text[s : s + chars] for s in starts if text[s : s + chars].strip()]
+
+
+def search_batch(vectorstore, queries, k=CANDIDATES_PER_QUERY):
+    """
+    Consulta várias perguntas num só lote de embeddings e num só index.search.
+    Retorna, para cada consulta, a lista ordenada de (id do trecho, Document).
+    """
+    if not queries:
+        return []
+    vectors = np.array(vectorstore.embeddings.embed_documents(queries), dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        import faiss
+        faiss.normalize_L2(vectors)
+    distances, indices = vectorstore.index.search(vectors, k)
+    results = []
+    for row in indices:
+        hits = []
+        for idx in row:
+            if idx == -1:
+                continue
+            doc_id = vectorstore.index_to_docstore_id[idx]
+            hits.append((doc_id, vectorstore.docstore.search(doc_id)))
+        results.append(hits)
+    return results
+
+
+def lexical_batch(vectorstore, queries, k=CANDIDATES_PER_QUERY):
+    """
+    Para cada consulta, as listas ordenadas de (id, Document) não vazias
+    entre BM25 e citações exatas (nenhuma se a base não tiver índice lexical).
+    """
+    lexical = getattr(vectorstore, "lexical_index", None)
+    if lexical is None:
+        return [[] for _ in queries]
+    results = []
+    for query in queries:
+        bm25_ids = [doc_id for doc_id, score in lexical.search(query, k)]
+        citation_ids = lexical.lookup(query)[:k]
+        results.append([
+            [(doc_id, vectorstore.docstore.search(doc_id)) for doc_id in ids]
+            for ids in (bm25_ids, citation_ids) if ids
+        ])
+    return results
+
+
+class QueryCache:
+    """Rankings (denso, lexicais) por consulta; chave: (versão da base, k, consulta normalizada)."""
+
+    def __init__(self, max_queries=QUERY_CACHE_SIZE):
+        self.max_queries = max_queries
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kb_version, query, k):
+        return kb_version, k, " ".join(query.lower().split())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_queries:
+                self._entries.popitem(last=False)
+
+
+def _search(vectorstore, queries, k):
+    if getattr(vectorstore, "remote", False):
+        return vectorstore.search(queries, k)
+    return search_batch(vectorstore, queries, k), lexical_batch(vectorstore, queries, k)
+
+
+def candidate_lists(vectorstore, queries, k=CANDIDATES_PER_QUERY, cache=None):
+    """
+    Rankings de candidatos de cada consulta: (densos, lexicais), como
+    search_batch e lexical_batch. No serviço de busca (kb_service.KBClient)
+    os dois saem de uma única requisição. Com cache (QueryCache), só as
+    consultas que não estão nele são buscadas, todas num lote.
+    """
+    if cache is None:
+        return _search(vectorstore, queries, k)
+    kb_version = getattr(vectorstore, "kb_version", None)
+    keys = [cache.key(kb_version, query, k) for query in queries]
+    entries = [cache.get(key) for key in keys]
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    if missing:
+        dense, lexical = _search(vectorstore, [queries[i] for i in missing], k)
+        # O serviço pode ter trocado de versão no meio: resultados novos não entram com a chave antiga
+        current = getattr(vectorstore, "kb_version", None) == kb_version
+        for n, i in enumerate(missing):
+            entries[i] = (dense[n], lexical[n])
+            if current:
+                cache.put(keys[i], entries[i])
+    return [dense for dense, _ in entries], [lexical for _, lexical in entries]
+
+
+def lookup_citation(vectorstore, text, k=CANDIDATES_PER_QUERY):
+    """Trechos que contêm exatamente as citações de `text` (sem chamar a API de embeddings)."""
+    if getattr(vectorstore, "remote", False):
+        return vectorstore.lookup(text, k)
+    lexical = getattr(vectorstore, "lexical_index", None)
+    if lexical is None:
+        return []
+    return [vectorstore.docstore.search(doc_id) for doc_id in lexical.lookup(text)[:k]]
+
+
+def _shingles(text, n=5):
+    words = WORD.findall(text.lower())
+    return {tuple(words[i : i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def select_context(ranked_lists, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Funde as listas (RRF), remove quase-duplicados e escolhe trechos diversos
+    (MMR sobre a similaridade textual) até o orçamento de tokens.
+    """
+    fused, docs = {}, {}
+    for hits in ranked_lists:
+        for rank, (doc_id, doc) in enumerate(hits):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs[doc_id] = doc
+    if not fused:
+        return []
+    top = max(fused.values())
+    candidates = sorted(fused, key=fused.get, reverse=True)
+    shingles = {doc_id: _shingles(docs[doc_id].page_content) for doc_id in candidates}
+
+    selected, used = [], 0
+    while candidates:
+        best, best_score = None, None
+        for doc_id in candidates:
+            redundancy = max((_jaccard(shingles[doc_id], shingles[s]) for s in selected), default=0.0)
+            if redundancy >= DUPLICATE_SIMILARITY:
+                continue
+            score = MMR_LAMBDA * fused[doc_id] / top - (1 - MMR_LAMBDA) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = doc_id, score
+        if best is None:
+            break
+        candidates.remove(best)
+        cost = count_tokens(format_context([docs[best]]))
+        if used + cost > token_budget:
+            if selected:
+                continue  # Tenta um trecho menor que ainda caiba
+            break
+        selected.append(best)
+        used += cost
+    return [docs[doc_id] for doc_id in selected]
+
+
+def retrieve(vectorstore, text, token_budget=CONTEXT_TOKEN_BUDGET, cache=None):
+    """Trechos de jurisprudência para um documento inteiro."""
+    if not vectorstore:
+        return []
+    dense, lexical = candidate_lists(vectorstore, query_windows(text), cache=cache)
+    return select_context(dense + [hits for lists in lexical for hits in lists], token_budget)
+
+
+def retrieve_for_sections(vectorstore, sections, token_budget=CONTEXT_TOKEN_BUDGET, cache=None):
+    """
+    Trechos de jurisprudência para cada seção, com todas as janelas de todas
+    as seções vetorizadas e consultadas num único lote.
+    """
+    if not vectorstore:
+        return [[] for _ in sections]
+    windows = [query_windows(section, max_queries=3) for section in sections]
+    dense, lexical = candidate_lists(vectorstore, [w for section_windows in windows for w in section_windows], cache=cache)
+    results, pos = [], 0
+    for section_windows in windows:
+        end = pos + len(section_windows)
+        ranked = dense[pos:end] + [hits for lists in lexical[pos:end] for hits in lists]
+        results.append(select_context(ranked, token_budget))
+        pos = end
+    return results
+
+
+def format_context(docs):
+    # label (artigo, item, decisão) vem do fatiamento estrutural; índices antigos não têm
+    return "".join(
+        f"\n[JURISPRUDÊNCIA - {doc.metadata['label']}]: {doc.page_content}\n" if doc.metadata.get("label")
+        else f"\n[JURISPRUDÊNCIA]: {doc.page_content}\n"
+        for doc in docs
+    )